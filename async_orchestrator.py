@@ -0,0 +1,279 @@
+"""
+异步录制编排
+功能：
+1. 用asyncio把一个课件录制期间的工作拆成并发任务：课件事件监听、FFmpeg进程监督、最长录制时长截止、下一个课件预加载；
+   FFmpeg提前退出时立即结束这一课，不必等到最大时长（FFmpeg进度仍由进度监控的读取线程并行读取）
+2. Selenium驱动不是线程安全的，所有浏览器操作经同一个单线程执行器串行执行；
+   停止FFmpeg、收尾检查等阻塞操作在另一个线程池执行，事件循环不会被阻塞
+3. 结构化取消：Ctrl-C 取消录制任务时，finally 中一定会停止FFmpeg（发送q写完容器尾）并记录课件状态，
+   整批结束或中断时一定关闭浏览器和课件服务；收尾期间再次按 Ctrl-C 不会打断收尾
+4. 上一课件的转码和质量检查在后台线程池继续，与下一课件的录制并发
+5. 进程看护（process_watchdog.py）按课件采样资源，需要时在课件之间重启浏览器
+
+虚拟时间录制和分段录制自己控制节奏，整个课件在浏览器线程中执行，中断时等待当前课件结束。
+
+用法：config.json 中 异步编排.启用 = true 后运行 auto_record_smart.py
+"""
+
+import asyncio
+import functools
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from lesson_index import lesson_name_from_url
+from run_journal import partial_path_for, RECORDING, FAILED
+
+
+class AsyncRecordingOrchestrator:
+    """在一个事件循环中编排 SmartCoursewareRecorder 的录制流程"""
+
+    def __init__(self, recorder):
+        self.recorder = recorder
+        record_config = recorder.config.get("录制配置", {})
+        orchestrator_config = recorder.config.get("异步编排", {})
+        self.check_interval = record_config.get("检查间隔_秒", 30)
+        self.event_poll_interval = record_config.get("事件轮询间隔_秒", 0.2)
+        self.tail_padding = record_config.get("完成后补录_秒", 0.5)
+        self.ffmpeg_poll_interval = orchestrator_config.get("FFmpeg检查间隔_秒", 0.5)
+        self.browser = ThreadPoolExecutor(max_workers=1, thread_name_prefix="浏览器")
+        self.workers = ThreadPoolExecutor(max_workers=2, thread_name_prefix="编排")
+        self.cancelling = False
+
+    async def in_browser(self, func, *args):
+        """在浏览器线程中执行（按提交顺序串行）"""
+        return await asyncio.get_running_loop().run_in_executor(self.browser, functools.partial(func, *args))
+
+    async def in_worker(self, func, *args):
+        """在工作线程中执行不涉及浏览器的阻塞操作"""
+        return await asyncio.get_running_loop().run_in_executor(self.workers, functools.partial(func, *args))
+
+    def run(self, start_index=0, max_duration=600):
+        """录制所有课件，阻塞直到结束；Ctrl-C 时完成收尾后返回"""
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        main = loop.create_task(self.record_all(start_index, max_duration))
+        previous = signal.signal(signal.SIGINT, lambda *_: loop.call_soon_threadsafe(self.interrupt, main))
+        try:
+            loop.run_until_complete(main)
+        except asyncio.CancelledError:
+            self.recorder.log("用户中断录制，已停止FFmpeg并关闭浏览器")
+        finally:
+            signal.signal(signal.SIGINT, previous)
+            self.browser.shutdown(wait=True)
+            self.workers.shutdown(wait=True)
+            asyncio.set_event_loop(None)
+            loop.close()
+
+    def interrupt(self, main):
+        """第一次 Ctrl-C 取消录制任务；之后只提示，不打断正在进行的收尾"""
+        if self.cancelling:
+            self.recorder.log("正在收尾（停止FFmpeg、关闭浏览器），请稍候...")
+            return
+        self.cancelling = True
+        self.recorder.log("\n收到中断，正在停止录制...")
+        main.cancel()
+
+    async def record_all(self, start_index, max_duration):
+        """与 SmartCoursewareRecorder.record_all 相同的流程：准备 → 录制 → 重录失败的课件 → 收尾"""
+        recorder = self.recorder
+        try:
+            prepared = await self.in_browser(recorder.prepare_run, start_index, max_duration)
+        except asyncio.CancelledError:
+            # 浏览器线程中的启动仍会执行完，排在它之后关闭
+            await self.in_browser(recorder.cleanup)
+            raise
+        if prepared is None:
+            return
+        pending, total = prepared
+
+        try:
+            await self.record_batch(pending, total, max_duration)
+
+            # 录制失败或质量检查未通过的课件自动重新录制
+            retries = recorder.config.get("高级选项", {}).get("错误重试次数", 3)
+            for attempt in range(1, retries + 1):
+                await self.in_worker(recorder.wait_background_jobs)
+                failed = recorder.failed_lessons(pending)
+                if not failed:
+                    break
+                recorder.log(f"\n{len(failed)} 个课件录制失败或质量检查未通过，第 {attempt}/{retries} 次重新录制")
+                await self.record_batch(failed, total, max_duration)
+
+        finally:
+            await self.in_browser(recorder.finish_run, pending)
+
+    async def record_batch(self, pending, total, max_duration):
+        """依次录制 [(序号, URL)]"""
+        recorder = self.recorder
+        for n, (i, url) in enumerate(pending):
+            recorder.next_url = next(
+                (next_url for _, next_url in pending[n + 1:] if not recorder.is_up_to_date(next_url)),
+                None
+            )
+            lesson_max = recorder.lesson_max_duration(url, max_duration)
+            lesson = lesson_name_from_url(url)
+            watchdog = recorder.get_watchdog()
+            if watchdog:
+                await self.in_browser(recorder.maybe_recycle_browser)
+                watchdog.begin_lesson(lesson)
+            try:
+                with recorder.get_tracer().span('录制课件', 课件=lesson) as span_args:
+                    span_args['结果'] = await self.record_lesson(url, i + 1, total, lesson_max)
+                recorder.adjust_resources(lesson)
+            finally:
+                if watchdog:
+                    watchdog.end_lesson()
+
+            recorder.log_eta([url for _, url in pending[n + 1:]])
+
+            interval = recorder.config.get("高级选项", {}).get("录制间隔等待_秒", 0)
+            if n < len(pending) - 1 and interval > 0:
+                recorder.log(f"等待{interval}秒后继续下一个...")
+                await asyncio.sleep(interval)
+
+    async def record_lesson(self, url, index, total, max_duration):
+        """录制一个课件；被取消时停止FFmpeg、记录状态后继续向上传递取消"""
+        recorder = self.recorder
+        if recorder.virtual_time_engine or recorder.segmented_enabled():
+            return await self.in_browser(
+                recorder._record_single_url, url, index, total, max_duration, self.check_interval
+            )
+
+        recorder.log_lesson_header(url, index, total)
+        lesson = lesson_name_from_url(url)
+        output_file = recorder.output_path_for(url)
+        partial_file = partial_path_for(output_file)
+        journal = recorder.get_journal()
+
+        settled = await self.in_worker(recorder.settle_existing, url)
+        if settled is not None:
+            return settled
+
+        two_stage = recorder.two_stage_enabled()
+        capture_file = recorder.capture_path_for(output_file) if two_stage else partial_file
+        phases = recorder.get_tracer().phases(课件=lesson)
+        capturing = False
+        finishing = None
+        try:
+            window_info = await self.in_browser(recorder.load_lesson, url, phases)
+            event_driven = await self.in_browser(recorder.start_playback, phases)
+
+            phases.next('启动采集')
+            recorder.log(f"开始录制，最大时长: {max_duration}秒")
+            capturing = True
+            await self.in_browser(recorder.start_ffmpeg_recording, window_info, capture_file, max_duration, two_stage)
+            capture_started = time.time()
+            journal.record(lesson, RECORDING, 临时文件=capture_file.name)
+            await self.in_browser(recorder.wait_until_ready, '首条字幕')
+            recorder.log_phase_waits()
+
+            phases.next('录制')
+            recorded_seconds = await self.supervise(event_driven, max_duration)
+
+            phases.next('停止FFmpeg')
+            capturing = False
+            await self.stop_capture()
+            phases.next('提交收尾')
+            # 收尾在工作线程中运行，取消无法中止它；屏蔽取消，由收尾自己写入运行记录的最终状态
+            finishing = asyncio.ensure_future(self.in_worker(
+                recorder.finish_capture, lesson, output_file, capture_file, two_stage, recorded_seconds, capture_started
+            ))
+            return await asyncio.shield(finishing)
+
+        except asyncio.CancelledError as e:
+            phases.end(e)
+            if finishing is not None:
+                # 等收尾结束再向上传递取消；收尾正常完成时不记为失败
+                await asyncio.wait({finishing})
+                if not finishing.cancelled() and finishing.exception() is None:
+                    raise
+            journal.record(lesson, FAILED, 原因="录制被中断")
+            raise
+        except Exception as e:
+            phases.end(e)
+            recorder.log(f"✗ 录制失败: {e}")
+            journal.record(lesson, FAILED, 原因=str(e))
+            return False
+
+        finally:
+            if capturing:
+                await self.stop_capture()
+            phases.end()
+
+    async def stop_capture(self):
+        """停止FFmpeg并写完容器尾；先等浏览器线程中已提交的调用（可能正在启动FFmpeg）执行完"""
+        await self.in_browser(lambda: None)
+        await self.in_worker(self.recorder.stop_ffmpeg_recording)
+
+    async def supervise(self, event_driven, max_duration):
+        """并发运行事件监听、FFmpeg监督和下一课预加载，播放完成、FFmpeg退出或达到最大时长时结束；返回录制秒数"""
+        recorder = self.recorder
+        start_time = time.time()
+        listener = asyncio.ensure_future(self.listen_events(event_driven, start_time))
+        watcher = asyncio.ensure_future(self.watch_ffmpeg())
+        background = []
+        if recorder.next_url and recorder.prefetch_enabled():
+            background.append(asyncio.ensure_future(self.in_browser(recorder.prefetch_lesson, recorder.next_url)))
+        try:
+            done, _ = await asyncio.wait({listener, watcher}, timeout=max_duration,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                recorder.log(f"达到最大录制时长 {max_duration}秒")
+            for task in done:
+                # FFmpeg异常退出时在这里抛出
+                task.result()
+        finally:
+            for task in (listener, watcher):
+                task.cancel()
+            await asyncio.gather(listener, watcher, *background, return_exceptions=True)
+        return time.time() - start_time
+
+    async def listen_events(self, event_driven, start_time):
+        """课件事件监听：收到播放完成后补录片刻再结束；钩子丢失时改为定期检查播放状态"""
+        recorder = self.recorder
+        last_check = 0
+        while True:
+            elapsed = time.time() - start_time
+            # 进程看护终止了停滞的渲染进程：这一课失败，稍后重录
+            recorder.raise_if_stalled()
+
+            # 事件驱动：等待最后一页讲解结束
+            if event_driven:
+                events = await self.in_browser(recorder.drain_lesson_events)
+                if events is None:
+                    recorder.log("⚠ 课件事件钩子丢失，改用轮询检测播放状态")
+                    event_driven = False
+                    last_check = elapsed
+                    continue
+                if recorder.handle_lesson_events(events, elapsed):
+                    await asyncio.sleep(self.tail_padding)
+                    return
+                await asyncio.sleep(self.event_poll_interval)
+                continue
+
+            # 定期检查播放状态
+            if elapsed - last_check >= self.check_interval:
+                status = await self.in_browser(recorder.check_playback_status)
+                recorder.log(f"已录制 {int(elapsed)}秒，状态: {status}")
+                if status == 'completed':
+                    recorder.log("检测到播放完成")
+                    await asyncio.sleep(5)  # 多录5秒确保完整
+                    return
+                last_check = elapsed
+            await asyncio.sleep(1)
+
+    async def watch_ffmpeg(self):
+        """FFmpeg进程监督：进程异常退出（设备丢失、磁盘写满等）时立即结束这一课"""
+        recorder = self.recorder
+        process = recorder.ffmpeg_process
+        if process is None:
+            # 页面内采集画面时没有FFmpeg进程
+            await asyncio.Event().wait()
+        while process.poll() is None:
+            await asyncio.sleep(self.ffmpeg_poll_interval)
+        if process.returncode == 0:
+            # 达到 -t 指定的时长，与最大录制时长截止相同
+            recorder.log("FFmpeg已录满最大时长")
+            return
+        raise RuntimeError(f"FFmpeg提前退出（退出码 {process.returncode}）")
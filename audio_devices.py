@@ -0,0 +1,180 @@
+"""
+音频采集设备注册表
+功能：
+1. 每次运行只枚举一次采集设备并缓存（设备失效时重新枚举，对应热插拔）
+2. 支持 dshow（Windows/VB-Cable）、PulseAudio/PipeWire（pactl）和 ALSA（arecord）
+3. 录制前用一段很短的试录验证设备可用，设备缺失时在加载课件之前就失败
+"""
+
+import shutil
+import subprocess
+import sys
+
+
+# Windows 上默认使用 VB-Cable 虚拟声卡
+VB_CABLE_DEVICE = "CABLE Output (VB-Audio Virtual Cable)"
+VB_CABLE_KEYWORDS = ('CABLE Output', 'VB-Audio')
+
+
+class AudioDeviceError(RuntimeError):
+    """找不到可用的音频采集设备"""
+
+
+def detect_backend():
+    """根据平台和已安装的工具选择音频后端"""
+    if sys.platform == 'win32':
+        return 'dshow'
+    if shutil.which('pactl'):
+        # PipeWire 通过 pipewire-pulse 提供同样的 pactl 接口
+        return 'pulse'
+    return 'alsa'
+
+
+class AudioDeviceRegistry:
+    """音频采集设备注册表"""
+
+    def __init__(self, ffmpeg_path='ffmpeg', backend=None):
+        self.ffmpeg_path = ffmpeg_path
+        self.backend = backend or detect_backend()
+        self._devices = None
+        self._probed = {}
+
+    def devices(self):
+        """返回采集设备名称列表（首次调用时枚举并缓存）"""
+        if self._devices is None:
+            enumerate_devices = {
+                'dshow': self._enumerate_dshow,
+                'pulse': self._enumerate_pulse,
+                'alsa': self._enumerate_alsa,
+            }[self.backend]
+            self._devices = enumerate_devices()
+        return self._devices
+
+    def refresh(self):
+        """丢弃缓存，下次访问时重新枚举（设备插拔后调用）"""
+        self._devices = None
+        self._probed = {}
+
+    def _enumerate_dshow(self):
+        result = subprocess.run(
+            [self.ffmpeg_path, '-hide_banner', '-list_devices', 'true', '-f', 'dshow', '-i', 'dummy'],
+            capture_output=True,
+            text=True,
+            encoding='utf-8',
+            errors='ignore'
+        )
+        devices = []
+        in_audio_section = False
+        for line in result.stderr.split('\n'):
+            # 旧版FFmpeg按"DirectShow audio devices"分段，新版在每行末尾标注"(audio)"
+            if 'DirectShow audio devices' in line:
+                in_audio_section = True
+                continue
+            if 'DirectShow video devices' in line:
+                in_audio_section = False
+                continue
+            if 'Alternative name' in line or '"' not in line:
+                continue
+            if in_audio_section or line.rstrip().endswith('(audio)'):
+                devices.append(line.split('"')[1])
+        return devices
+
+    def _enumerate_pulse(self):
+        result = subprocess.run(['pactl', 'list', 'short', 'sources'], capture_output=True, text=True)
+        return [line.split('\t')[1] for line in result.stdout.splitlines() if '\t' in line]
+
+    def _enumerate_alsa(self):
+        if not shutil.which('arecord'):
+            return ['default']
+        result = subprocess.run(['arecord', '-L'], capture_output=True, text=True)
+        return [line.strip() for line in result.stdout.splitlines() if line and not line[0].isspace()]
+
+    def default_device(self):
+        """本后端的默认采集设备：dshow 为VB-Cable，pulse 为默认输出的监听源（<sink>.monitor），ALSA 为 default"""
+        if self.backend == 'dshow':
+            return VB_CABLE_DEVICE
+        if self.backend == 'pulse':
+            result = subprocess.run(['pactl', 'get-default-sink'], capture_output=True, text=True)
+            sink = result.stdout.strip() if result.returncode == 0 else ''
+            if not sink:
+                # 旧版pactl没有 get-default-sink
+                result = subprocess.run(['pactl', 'info'], capture_output=True, text=True)
+                for line in result.stdout.splitlines():
+                    if line.startswith('Default Sink:'):
+                        sink = line.split(':', 1)[1].strip()
+            return f"{sink}.monitor" if sink else None
+        return 'default'
+
+    def default_keywords(self):
+        return VB_CABLE_KEYWORDS if self.backend == 'dshow' else ()
+
+    def find(self, preferred_name=None, keywords=(), fallback=None):
+        """按完整名称或关键词查找设备，都找不到时使用 fallback（存在时），否则返回None"""
+        devices = self.devices()
+        if preferred_name in devices:
+            return preferred_name
+        for keyword in keywords:
+            for device in devices:
+                if keyword in device:
+                    return device
+        if fallback in devices:
+            return fallback
+        return None
+
+    def input_args(self, device):
+        """FFmpeg音频输入参数"""
+        if self.backend == 'dshow':
+            return ['-f', 'dshow', '-i', f'audio={device}']
+        return ['-f', self.backend, '-i', device]
+
+    def probe(self, device, seconds=0.5):
+        """试录一小段验证设备可用，返回 (是否可用, 错误信息)；结果在本次运行内缓存"""
+        if device in self._probed:
+            return self._probed[device]
+
+        cmd = [self.ffmpeg_path, '-hide_banner', '-loglevel', 'error'] + self.input_args(device) + [
+            '-t', str(seconds), '-f', 'null', '-'
+        ]
+        try:
+            result = subprocess.run(
+                cmd,
+                capture_output=True,
+                text=True,
+                encoding='utf-8',
+                errors='ignore',
+                timeout=seconds + 10
+            )
+            outcome = (result.returncode == 0, result.stderr.strip())
+        except subprocess.TimeoutExpired:
+            outcome = (False, '试录超时')
+        except FileNotFoundError:
+            outcome = (False, f'找不到FFmpeg: {self.ffmpeg_path}')
+
+        self._probed[device] = outcome
+        return outcome
+
+    def resolve(self, preferred_name=None, keywords=(), fallback=None):
+        """查找并试录验证设备；失败时重新枚举一次（设备可能刚插拔），仍失败则抛出AudioDeviceError"""
+        for attempt in range(2):
+            device = self.find(preferred_name, keywords, fallback)
+            if device:
+                ok, error = self.probe(device)
+                if ok:
+                    return device
+            if attempt == 0:
+                self.refresh()
+
+        if not device:
+            raise AudioDeviceError(
+                f"未找到音频设备 {preferred_name or ''}（{self.backend}），可用设备: {self.devices()}"
+            )
+        raise AudioDeviceError(f"音频设备试录失败: {device}（{error}）")
+
+
+if __name__ == "__main__":
+    registry = AudioDeviceRegistry()
+    print(f"音频后端: {registry.backend}")
+    print("-" * 60)
+    for name in registry.devices():
+        ok, error = registry.probe(name)
+        print(f"{'✓' if ok else '✗'} {name}" + ("" if ok else f"  ({error.splitlines()[-1] if error else '失败'})"))
@@ -8,34 +8,381 @@
 """
 
 import os
+import sys
 import time
+import base64
+import threading
 import subprocess
 import json
 from pathlib import Path
 from datetime import datetime
 from selenium import webdriver
-from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.chrome.service import Service
+from selenium.common.exceptions import TimeoutException, WebDriverException
 import psutil
+from lesson_index import LessonDurationIndex, lesson_name_from_url
+from lesson_manifest import LessonManifest
+from slide_segments import SLIDE_NAVIGATION_JS, SlideSegmentRecorder
+from page_capture import PageCaptureSession, PAGE_CAPTURE_INIT_JS, mux_page_audio, convert_page_video
+from local_lesson_server import LocalLessonServer
+from audio_devices import AudioDeviceRegistry, AudioDeviceError
+from transcoder import TranscodeQueue, frame_timing_args, scale_args
+from ffmpeg_progress import FFmpegProgressMonitor, progress_args
+from video_verifier import VideoVerifier
+from video_trimmer import VideoTrimmer, content_bounds_from_report
+from tracing import Tracer, NULL_TRACER
+from async_orchestrator import AsyncRecordingOrchestrator
+from process_watchdog import ProcessWatchdog
+from resource_governor import ResourceGovernor
+from encoder_calibration import load_host_profile
+from run_journal import RunJournal, partial_path_for, LOADING, QUEUED, RECORDING, FINALISING, VERIFIED, FAILED
 try:
     from screeninfo import get_monitors
     HAS_SCREENINFO = True
 except ImportError:
     HAS_SCREENINFO = False
 
+
+# 多个录制器（并行模式下每个工作线程一个）共享同一个日志文件，写入时需要加锁
+_log_lock = threading.Lock()
+
+def get_ffmpeg_path():
+    """优先使用当前目录的ffmpeg.exe，否则使用PATH中的ffmpeg"""
+    ffmpeg_path = Path("ffmpeg.exe").absolute()
+    if ffmpeg_path.exists():
+        return str(ffmpeg_path)
+    return 'ffmpeg'
+
+
+def keyframe_interval_frames(ffmpeg_config):
+    """关键帧间隔（帧数）= 帧率 × 关键帧间隔_秒"""
+    return max(1, int(ffmpeg_config.get("帧率", 30) * ffmpeg_config.get("关键帧间隔_秒", 2)))
+
+
+# 页面可视区域的位置和大小（CSS像素）及设备像素比
+VIEWPORT_METRICS_JS = """
+return {
+    screenX: window.screenX, screenY: window.screenY,
+    outerWidth: window.outerWidth, outerHeight: window.outerHeight,
+    innerWidth: window.innerWidth, innerHeight: window.innerHeight,
+    dpr: window.devicePixelRatio || 1
+};
+"""
+
+
+def viewport_rect(metrics):
+    """页面可视区域在屏幕上的位置（物理像素）
+
+    左右和底部边框同宽，外框高度减去可视高度和底边框即为标签栏+地址栏的高度；
+    按 devicePixelRatio 换算为抓屏使用的物理像素，宽高取偶数（yuv420p要求）。
+    """
+    dpr = metrics['dpr']
+    border = max(0, (metrics['outerWidth'] - metrics['innerWidth']) / 2)
+    top = max(0, metrics['outerHeight'] - metrics['innerHeight'] - border)
+    return {
+        'x': round((metrics['screenX'] + border) * dpr),
+        'y': round((metrics['screenY'] + top) * dpr),
+        'width': int(metrics['innerWidth'] * dpr) // 2 * 2,
+        'height': int(metrics['innerHeight'] * dpr) // 2 * 2,
+        'dpr': dpr,
+    }
+
+
+# 就绪条件：替代固定等待，每个条件都有超时，实际等待时间按阶段写入日志
+READINESS_PREDICATES = {
+    'DOM就绪': "return document.readyState === 'complete';",
+    '字体加载': "return !document.fonts || document.fonts.status === 'loaded';",
+    'MathJax排版': """
+        if (!document.getElementById('MathJax-script')) return true;
+        const startup = window.MathJax && window.MathJax.startup;
+        if (!startup || !startup.promise) return false;
+        if (window.__mathjaxSettled === undefined) {
+            window.__mathjaxSettled = false;
+            startup.promise.then(() => { window.__mathjaxSettled = true; },
+                                 () => { window.__mathjaxSettled = true; });
+        }
+        return window.__mathjaxSettled;
+    """,
+    'SDK就绪': "return typeof window.AvatarPlatform !== 'undefined';",
+    '样式生效': "return window.__recorderStyleApplied === true && (!document.fonts || document.fonts.status === 'loaded');",
+    '播放按钮可用': """
+        const btn = document.getElementById('autoPlayBtn');
+        if (btn) return !btn.disabled;
+        return document.querySelectorAll('button').length > 0;
+    """,
+    '手动点击播放': "return !!(window.__recorderHook && window.__recorderHook.autoPlaying);",
+    '虚拟人连接': """
+        if (typeof isConnected !== 'undefined' && isConnected) return true;
+        return !!(window.__recorderHook && window.__recorderHook.lastSpoken > 0);
+    """,
+    '首条字幕': """
+        const area = document.getElementById('subtitleArea');
+        if (window.__recorderHook && window.__recorderHook.lastSpoken > 0) return true;
+        return !!(area && area.textContent.trim() && area.textContent !== window.__recorderSubtitleBefore);
+    """,
+}
+
+# 各阶段默认超时（秒），可在 config.json 的 就绪等待 中覆盖
+READINESS_TIMEOUTS = {
+    'DOM就绪': 30,
+    '字体加载': 10,
+    'MathJax排版': 15,
+    'SDK就绪': 15,
+    '样式生效': 5,
+    '播放按钮可用': 15,
+    '手动点击播放': 10,
+    '虚拟人连接': 20,
+    '首条字幕': 15,
+}
+
+
+# 课件生命周期钩子：包装页面自带的 startAutoPlay/showSlide/stopAutoPlay/speakContent，
+# 并监听虚拟人SDK的 frame_stop 事件。事件写入 window.__recorderHook.events，
+# 由录制脚本以很短的间隔一次性取走（一次往返，不扫描整个页面文本）。
+LESSON_EVENT_HOOK_JS = """
+if (window.__recorderHook) {
+    return true;
+}
+const hook = window.__recorderHook = { events: [], lastSpoken: 0, completed: false, autoPlaying: false };
+const emit = (type, detail) => hook.events.push({ type: type, detail: detail === undefined ? null : detail, time: Date.now() });
+""" + SLIDE_NAVIGATION_JS + """
+// 最后一页有讲稿的页码：部分课件的讲稿键比 totalPages 少一页，最后一次 speakContent 没有语音也没有 frame_stop
+const scriptOf = () => {
+    if (typeof subtitleScript !== 'undefined' && subtitleScript) return subtitleScript;
+    if (typeof pageContent !== 'undefined' && pageContent) return pageContent;
+    return null;
+};
+const lastScriptedPage = () => {
+    const script = scriptOf();
+    const pages = script ? Object.keys(script).map(Number).filter((n) => !isNaN(n)) : [];
+    return pages.length ? Math.min(Math.max(...pages), slideCount()) : slideCount();
+};
+const complete = (reason) => {
+    if (!hook.completed) {
+        hook.completed = true;
+        emit('lesson_complete', reason);
+    }
+};
+
+// 虚拟人每讲完一段话触发 frame_stop；startTeaching 可能重建 avatarPlatform，需要重新挂载
+let attachedPlatform = null;
+const attachAvatar = () => {
+    if (typeof avatarPlatform === 'undefined' || !avatarPlatform || avatarPlatform === attachedPlatform) {
+        return;
+    }
+    attachedPlatform = avatarPlatform;
+    avatarPlatform.on('frame_stop', () => {
+        emit('speech_end', hook.lastSpoken);
+        if (hook.autoPlaying && hook.lastSpoken >= lastScriptedPage()) {
+            complete('last_speech_end');
+        }
+    });
+};
+
+const wrap = (name, before, after) => {
+    const original = window[name];
+    if (typeof original !== 'function') {
+        return false;
+    }
+    window[name] = function (...args) {
+        if (before) before(args);
+        emit(name, args.length ? args[0] : null);
+        const result = original.apply(this, args);
+        if (after) after(args, result);
+        return result;
+    };
+    return true;
+};
+
+const hooked = {
+    startAutoPlay: wrap('startAutoPlay', () => { hook.autoPlaying = true; }, (args, result) => {
+        // 计时驱动的课件在 startAutoPlay 的 Promise 结束时播放完毕；
+        // frame_stop 驱动的课件此时仍处于自动播放状态，由最后一页的 speech_end 判定完成
+        Promise.resolve(result).then(() => {
+            if (typeof isAutoPlaying !== 'undefined' && !isAutoPlaying) {
+                complete('autoplay_finished');
+            }
+        });
+    }),
+    showSlide: wrap('showSlide'),
+    stopAutoPlay: wrap('stopAutoPlay', null, () => {
+        if (hook.autoPlaying) {
+            complete('autoplay_stopped');
+        }
+    }),
+    speakContent: wrap('speakContent', (args) => {
+        hook.lastSpoken = args[0];
+        attachAvatar();
+        // 翻到最后一页之后没有讲稿的页：不会再有 frame_stop，直接判定完成
+        const script = scriptOf();
+        if (hook.autoPlaying && script && !script[args[0]] && args[0] >= lastScriptedPage()) {
+            complete('no_script_after_last_page');
+        }
+    })
+};
+emit('hook_installed', hooked);
+return hooked.startAutoPlay;
+"""
+
+
+# 播放按钮选择器默认值（config.json 中的 播放按钮选择器 优先）
+DEFAULT_PLAY_BUTTON_SELECTORS = {
+    "文本关键词": ["自动播放", "播放", "开始", "Start", "Play", "开始播放"],
+    "CSS类名": ["play-button", "btn-play", "start-button"],
+    "元素ID": ["autoPlayBtn", "playButton", "autoPlay", "startBtn"],
+}
+
+# 播放按钮定位：在页面内一次完成 模板识别 → 缓存命中检查 → 候选打分 → 点击。
+# 模板签名取页面所有按钮ID（同一模板的课件相同），命中缓存时直接点击上次的选择器。
+# 打分：配置的元素ID > CSS类名 > 文本关键词（越靠前分越高），不可见或禁用的按钮不参与。
+PLAY_BUTTON_LOCATOR_JS = """
+const rules = arguments[0];
+const cache = arguments[1] || {};
+const candidates = Array.from(document.querySelectorAll('button, [role="button"], a, input[type="button"]'));
+const signature = candidates.map((el) => el.id).filter(Boolean).sort().join(',')
+    || ('buttons:' + candidates.length);
+
+const usable = (el) => {
+    if (!el || el.disabled) return false;
+    const rect = el.getBoundingClientRect();
+    const style = getComputedStyle(el);
+    return rect.width > 0 && rect.height > 0 && style.visibility !== 'hidden' && style.display !== 'none';
+};
+
+const selectorFor = (el) => {
+    if (el.id) return '#' + CSS.escape(el.id);
+    const path = [];
+    for (let node = el; node && node.nodeType === 1 && node !== document.body; node = node.parentElement) {
+        const siblings = Array.from(node.parentElement.children).filter((s) => s.tagName === node.tagName);
+        path.unshift(node.tagName.toLowerCase() + ':nth-of-type(' + (siblings.indexOf(node) + 1) + ')');
+        if (node.parentElement.id) {
+            path.unshift('#' + CSS.escape(node.parentElement.id));
+            break;
+        }
+    }
+    return path.join(' > ');
+};
+
+const cachedSelector = cache[signature];
+if (cachedSelector) {
+    const el = document.querySelector(cachedSelector);
+    if (usable(el)) {
+        el.click();
+        return { signature: signature, selector: cachedSelector, cached: true };
+    }
+}
+
+const ids = rules.ids.map((id) => id.toLowerCase());
+const classes = rules.classes.map((name) => name.toLowerCase());
+const keywords = rules.keywords.map((word) => word.toLowerCase());
+let best = null;
+let considered = 0;
+for (const el of candidates) {
+    if (!usable(el)) continue;
+    considered++;
+    const id = (el.id || '').toLowerCase();
+    const classList = Array.from(el.classList).map((name) => name.toLowerCase());
+    const text = (el.textContent || el.value || '').trim().toLowerCase();
+    let score = 0;
+    const idRank = ids.indexOf(id);
+    if (id && idRank >= 0) score += 1000 - idRank * 10;
+    for (const name of classList) {
+        const classRank = classes.indexOf(name);
+        if (classRank >= 0) score = Math.max(score, 500 - classRank * 10);
+    }
+    keywords.forEach((word, rank) => {
+        if (word && text.includes(word)) score += 100 - rank * 10;
+    });
+    if (score > 0 && (!best || score > best.score)) {
+        best = { el: el, score: score, text: text.slice(0, 20) };
+    }
+}
+if (!best) return null;
+
+best.el.click();
+return {
+    signature: signature, selector: selectorFor(best.el), cached: false,
+    score: best.score, text: best.text, candidates: considered
+};
+"""
+
+
 class SmartCoursewareRecorder:
-    def __init__(self, url_file, output_dir="录制视频"):
+    def __init__(self, url_file, output_dir="录制视频", config=None,
+                 display=None, audio_source=None, profile_dir=None, worker_name=None):
         self.url_file = url_file
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(exist_ok=True)
+        self.config = config or {}
         self.driver = None
         self.ffmpeg_process = None
+        # FFmpeg进度监控（读取管道输出、记录实时倍率和丢帧）及上一次录制的统计
+        self.progress_monitor = None
+        self.last_capture_stats = None
+        # 采集开销统计：浏览器窗口（物理像素）、当前采集的区域/文件/开始时间、本课件所有采集的累计值
+        self.window_rect = None
+        self.capture_region = None
+        self.capture_file = None
+        self.capture_started_at = None
+        # 最近一次FFmpeg采集的文件 t=0 对应的系统时间（由进度输出得到）
+        self.capture_media_origin = None
+        self.capture_totals = {}
+        # 页面内采集（MediaRecorder）会话、输出目标和画面开始时间
+        self.page_capture = None
+        self.page_capture_target = None
+        self.page_capture_video_started = None
+        self.virtual_time_engine = None
+        self.lesson_index = None
+        self.lesson_events = []
+        self.phase_waits = {}
+        # 播放按钮选择器缓存 {模板签名: CSS选择器}
+        self.play_button_cache = {}
+        # 流水线预加载：下一个课件的URL和已在后台打开的 (URL, 标签页ID)
+        self.next_url = None
+        self.prefetched = None
+        self.lesson_server = None
+        # 音频设备注册表：每次运行枚举、验证一次，之后每个课件直接复用
+        self.audio_registry = None
+        self.audio_input_args = None
+        # 两段式录制的后台转码队列（并行模式下由调度器共享给所有录制器）
+        self.transcoder = None
+        # 断点续录运行记录（并行模式下同样由调度器共享）
+        self.journal = None
+        # 后台质量检查（同样由并行调度器共享）
+        self.verifier = None
+        # 课件清单（内容哈希）及每个课件开始录制时的哈希，验证通过后写入运行记录
+        self.manifest = None
+        self.recording_hashes = {}
+        # 资源调节降档时开始录制的课件：{课件: 降档后的帧率和编码预设}
+        self.degraded_recordings = {}
+        # 阶段耗时追踪（Chrome trace格式，同样由并行调度器共享）
+        self.tracer = None
+        # 进程看护（资源采样、停滞检测、浏览器定期重启）及最近一次页面脚本正常返回的时间
+        self.watchdog = None
+        self.page_alive_at = None
+        # 资源调节（课件之间调整帧率、编码预设和并发数；并行模式下由调度器共享）
+        self.governor = None
+        # 本机编码校准结果（host_profiles/<主机名>.json，首次使用时读取）
+        self.host_profile = None
         self.log_file = self.output_dir / "录制日志.txt"
-        self.primary_monitor = self._get_primary_monitor_info()
-        
+        # 并行录制：独立的虚拟显示器(如":99")、PulseAudio音频源、Chrome配置目录
+        self.display = display
+        self.audio_source = audio_source
+        self.profile_dir = profile_dir
+        self.worker_name = worker_name
+        if self.display:
+            width, height = self._display_size()
+            self.primary_monitor = {'x': 0, 'y': 0, 'width': width, 'height': height}
+        else:
+            self.primary_monitor = self._get_primary_monitor_info()
+
+    def _display_size(self):
+        """虚拟显示器分辨率（与浏览器窗口大小一致）"""
+        browser_config = self.config.get("浏览器配置", {})
+        return browser_config.get("窗口宽度", 1920), browser_config.get("窗口高度", 1080)
+
     def _get_primary_monitor_info(self):
         """获取主显示器信息（Windows多显示器支持）"""
         try:
@@ -82,13 +429,21 @@ class SmartCoursewareRecorder:
     def log(self, message):
         """记录日志"""
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        log_message = f"[{timestamp}] {message}"
-        print(log_message)
-        with open(self.log_file, 'a', encoding='utf-8') as f:
-            f.write(log_message + '\n')
+        if self.worker_name:
+            log_message = f"[{timestamp}] [{self.worker_name}] {message}"
+        else:
+            log_message = f"[{timestamp}] {message}"
+        with _log_lock:
+            print(log_message)
+            with open(self.log_file, 'a', encoding='utf-8') as f:
+                f.write(log_message + '\n')
     
     def read_urls(self):
-        """读取URL列表"""
+        """读取URL列表（配置为从课件目录生成时直接扫描仓库中的课件）"""
+        if self.config.get("课件清单", {}).get("从课件目录生成链接", False):
+            urls = self.get_manifest().urls()
+            self.log(f"✓ 已从课件目录生成URL列表: {len(urls)} 个课件")
+            return urls
         with open(self.url_file, 'r', encoding='utf-8') as f:
             urls = [line.strip() for line in f if line.strip()]
         return urls
@@ -104,15 +459,46 @@ class SmartCoursewareRecorder:
         # 音频自动播放
         chrome_options.add_argument("--autoplay-policy=no-user-gesture-required")
 
+        # 页面内采集画面：自动允许采集当前标签页，窗口被遮挡时也不能停止渲染
+        page_video = self.page_capture_enabled() and self.config.get("页面内采集", {}).get("采集画面", False)
+        if page_video:
+            chrome_options.add_argument("--auto-accept-this-tab-capture")
+
+        # 后台标签页预加载下一个课件时不能被节流，否则MathJax/d3/SDK初始化会被推迟
+        if self.prefetch_enabled() or page_video:
+            chrome_options.add_argument("--disable-background-timer-throttling")
+            chrome_options.add_argument("--disable-backgrounding-occluded-windows")
+            chrome_options.add_argument("--disable-renderer-backgrounding")
+
+        # 并行录制时每个工作线程使用独立的Chrome配置目录，避免配置锁冲突
+        if self.profile_dir:
+            Path(self.profile_dir).mkdir(parents=True, exist_ok=True)
+            chrome_options.add_argument(f"--user-data-dir={Path(self.profile_dir).absolute()}")
+        else:
+            # 持久磁盘缓存：跨运行保留已预热的课件资源（并行模式下缓存在各自的配置目录中）
+            cache_dir = self.config.get("本地课件服务", {}).get("浏览器缓存目录")
+            if cache_dir:
+                Path(cache_dir).mkdir(parents=True, exist_ok=True)
+                chrome_options.add_argument(f"--disk-cache-dir={Path(cache_dir).absolute()}")
+
+        # 虚拟显示器和音频输出通过环境变量传给ChromeDriver（Chrome继承该环境）
+        service_env = None
+        if self.display or self.audio_source:
+            service_env = dict(os.environ)
+            if self.display:
+                service_env["DISPLAY"] = self.display
+            if self.audio_source:
+                service_env["PULSE_SINK"] = self.audio_source
+
         # 使用当前目录的chromedriver.exe
         chromedriver_path = str(Path("chromedriver.exe").absolute())
 
         if Path(chromedriver_path).exists():
-            service = Service(executable_path=chromedriver_path)
+            service = Service(executable_path=chromedriver_path, env=service_env)
             self.driver = webdriver.Chrome(service=service, options=chrome_options)
             self.log(f"使用ChromeDriver: {chromedriver_path}")
         else:
-            self.driver = webdriver.Chrome(options=chrome_options)
+            self.driver = webdriver.Chrome(service=Service(env=service_env), options=chrome_options)
             self.log("使用系统PATH中的ChromeDriver")
 
         # 设置窗口大小和位置
@@ -123,87 +509,160 @@ class SmartCoursewareRecorder:
         self.driver.set_window_size(window_width, window_height)
 
         self.log(f"浏览器窗口设置: 位置({self.primary_monitor['x']}, {self.primary_monitor['y']}), 大小({window_width}x{window_height})")
+
+        # 采集脚本在课件脚本之前执行，SDK创建的音频元素和WebAudio连接都能登记到
+        if self.page_capture_enabled():
+            self.driver.execute_cdp_cmd('Page.addScriptToEvaluateOnNewDocument', {'source': PAGE_CAPTURE_INIT_JS})
         
     def get_browser_window_info(self):
-        """获取浏览器窗口位置和大小"""
+        """获取录制区域：默认只取页面可视区域（不含标签栏和地址栏），否则为整个浏览器窗口"""
         position = self.driver.get_window_position()
         size = self.driver.get_window_size()
-        
-        return {
+        window = {
             'x': position['x'],
             'y': position['y'],
             'width': size['width'],
             'height': size['height']
         }
+        if not self.config.get("画面采集", {}).get("仅页面区域", True):
+            self.window_rect = window
+            return window
+
+        viewport = viewport_rect(self.driver.execute_script(VIEWPORT_METRICS_JS))
+        # 窗口位置和大小同样是CSS像素，换算后才能与采集区域比较
+        self.window_rect = {key: round(value * viewport['dpr']) for key, value in window.items()}
+        return viewport
     
+    def prefetch_enabled(self):
+        return self.config.get("高级选项", {}).get("预加载下一课", True)
+
+    def output_path_for(self, url):
+        """课件对应的输出文件路径"""
+        filename = url.split('/')[-1].replace('.html', '.mp4')
+        return self.output_dir / filename
+
+    def get_manifest(self):
+        """课件清单（首次使用时创建）"""
+        if self.manifest is None:
+            lesson_dir = Path(self.config.get("时长索引", {}).get("课件目录") or Path(__file__).parent)
+            self.manifest = LessonManifest(lesson_dir, self.config)
+        return self.manifest
+
+    def incremental_enabled(self):
+        return self.config.get("课件清单", {}).get("增量录制", True)
+
+    def is_up_to_date(self, url):
+        """正式文件存在且无需重录：内容哈希与上次验证通过时相同（增量录制关闭时只看文件是否存在）"""
+        if not self.output_path_for(url).exists():
+            return False
+        if not self.incremental_enabled():
+            return True
+        entry = self.get_journal().entry(lesson_name_from_url(url))
+        if entry is None:
+            # 没有运行记录的旧文件视为最新，由 order_pending 补记哈希作为基准
+            return True
+        if entry['状态'] != VERIFIED:
+            # 课件修改后正在重录：旧文件保留到新文件验证通过后才被替换
+            return False
+        if entry.get('降档设置'):
+            # 资源调节降低了帧率或编码预设：按配置的设置重新录制
+            return False
+        recorded = entry.get('内容哈希')
+        return recorded is None or recorded == self.get_manifest().content_hash(lesson_name_from_url(url))
+
+    def prefetch_lesson(self, url):
+        """在后台标签页预加载课件（不激活，录制中的标签页保持在前台）"""
+        self.discard_prefetched()
+        try:
+            result = self.driver.execute_cdp_cmd('Target.createTarget', {'url': url, 'background': True})
+            self.prefetched = (url, result['targetId'])
+            self.log(f"⇢ 已在后台标签页预加载下一个课件: {lesson_name_from_url(url)}")
+        except Exception as e:
+            self.log(f"⚠ 预加载下一个课件失败: {e}")
+
+    def activate_prefetched(self, url):
+        """切换到已预加载的标签页并关闭当前标签页；没有对应的预加载页时返回False"""
+        if not self.prefetched or self.prefetched[0] != url:
+            self.discard_prefetched()
+            return False
+
+        target_id = self.prefetched[1]
+        self.prefetched = None
+        try:
+            if target_id not in self.driver.window_handles:
+                return False
+            self.driver.execute_cdp_cmd('Target.activateTarget', {'targetId': target_id})
+            self.driver.close()
+            self.driver.switch_to.window(target_id)
+            return True
+        except Exception as e:
+            self.log(f"⚠ 切换到预加载标签页失败，重新加载: {e}")
+            handles = self.driver.window_handles
+            if handles:
+                self.driver.switch_to.window(handles[0])
+            return False
+
+    def discard_prefetched(self):
+        """关闭未使用的预加载标签页"""
+        if not self.prefetched:
+            return
+        target_id = self.prefetched[1]
+        self.prefetched = None
+        try:
+            self.driver.execute_cdp_cmd('Target.closeTarget', {'targetId': target_id})
+        except Exception:
+            pass
+
+    def wait_until_ready(self, phase):
+        """等待就绪条件成立，记录实际等待时间；超时返回False（不中断录制）"""
+        timeout = self.config.get("就绪等待", {}).get(phase, READINESS_TIMEOUTS[phase])
+        start = time.time()
+        with self.get_tracer().span(f'等待:{phase}', '就绪等待') as span_args:
+            try:
+                WebDriverWait(
+                    self.driver, timeout, poll_frequency=0.1, ignored_exceptions=(WebDriverException,)
+                ).until(lambda d: d.execute_script(READINESS_PREDICATES[phase]))
+                ready = True
+            except TimeoutException:
+                ready = False
+            span_args['超时'] = not ready
+
+        waited = time.time() - start
+        self.phase_waits[phase] = waited
+        if ready:
+            self.log(f"✓ {phase}（等待 {waited:.2f}秒）")
+        else:
+            self.log(f"⚠ {phase}超时（{timeout}秒），继续执行")
+        return ready
+
     def find_and_click_play_button(self, timeout=15):
-        """智能查找并点击播放按钮"""
+        """一次往返完成播放按钮的查找、打分和点击；同一模板的课件直接复用上次的选择器"""
         try:
             self.log("正在查找播放按钮...")
-            time.sleep(3)
-            
-            # 方法1: 通过文本查找
-            text_selectors = [
-                "自动播放", "播放", "开始", "Start", "Play", "开始播放"
-            ]
-            
-            for text in text_selectors:
-                try:
-                    buttons = self.driver.find_elements(By.XPATH, f"//button[contains(text(), '{text}')]")
-                    if buttons:
-                        buttons[0].click()
-                        self.log(f"✓ 通过文本'{text}'找到并点击播放按钮")
-                        return True
-                except:
-                    continue
-            
-            # 方法2: 通过class和id查找
-            class_id_selectors = [
-                (By.CLASS_NAME, "play-button"),
-                (By.CLASS_NAME, "btn-play"),
-                (By.ID, "playButton"),
-                (By.ID, "autoPlay"),
-                (By.CLASS_NAME, "start-button"),
-            ]
-            
-            for by, selector in class_id_selectors:
-                try:
-                    button = self.driver.find_element(by, selector)
-                    button.click()
-                    self.log(f"✓ 通过选择器'{selector}'找到并点击播放按钮")
-                    return True
-                except:
-                    continue
-            
-            # 方法3: JavaScript全局搜索
-            try:
-                result = self.driver.execute_script("""
-                    const keywords = ['播放', '自动', '开始', 'play', 'start'];
-                    const buttons = document.querySelectorAll('button, div[role="button"], a[role="button"]');
-                    
-                    for (let btn of buttons) {
-                        const text = btn.textContent.toLowerCase();
-                        const className = btn.className.toLowerCase();
-                        const id = btn.id.toLowerCase();
-                        
-                        for (let keyword of keywords) {
-                            if (text.includes(keyword) || className.includes(keyword) || id.includes(keyword)) {
-                                btn.click();
-                                return keyword;
-                            }
-                        }
-                    }
-                    return null;
-                """)
-                
-                if result:
-                    self.log(f"✓ 通过JavaScript找到并点击播放按钮（关键词: {result}）")
-                    return True
-            except Exception as e:
-                self.log(f"JavaScript查找失败: {e}")
-            
-            self.log("⚠ 未找到播放按钮，将继续录制（可能需要手动点击）")
-            return False
+            self.wait_until_ready('播放按钮可用')
+
+            selector_config = self.config.get("播放按钮选择器", {})
+            result = self.driver.execute_script(
+                PLAY_BUTTON_LOCATOR_JS,
+                {
+                    'keywords': selector_config.get("文本关键词", DEFAULT_PLAY_BUTTON_SELECTORS["文本关键词"]),
+                    'classes': selector_config.get("CSS类名", DEFAULT_PLAY_BUTTON_SELECTORS["CSS类名"]),
+                    'ids': selector_config.get("元素ID", DEFAULT_PLAY_BUTTON_SELECTORS["元素ID"]),
+                },
+                self.play_button_cache
+            )
+
+            if not result:
+                self.log("⚠ 未找到播放按钮，将继续录制（可能需要手动点击）")
+                return False
+
+            self.play_button_cache[result['signature']] = result['selector']
+            if result['cached']:
+                self.log(f"✓ 使用模板缓存的选择器 '{result['selector']}' 点击播放按钮")
+            else:
+                self.log(f"✓ 找到并点击播放按钮 '{result['selector']}'"
+                         f"（{result['text']}，得分 {result['score']}，候选 {result['candidates']} 个）")
+            return True
             
         except Exception as e:
             self.log(f"查找播放按钮时出错: {e}")
@@ -228,51 +687,396 @@ class SmartCoursewareRecorder:
                 
                 return 'playing';
             """)
+            self.page_alive_at = time.time()
             return result
         except:
             return 'unknown'
     
-    def get_audio_device_name(self):
-        """获取VB-Cable音频设备的准确名称"""
+    def install_lesson_event_hook(self):
+        """注入课件生命周期钩子，返回是否成功挂载到自动播放函数"""
         try:
-            # 使用当前目录的ffmpeg.exe
-            ffmpeg_path = str(Path("ffmpeg.exe").absolute())
-            if not Path(ffmpeg_path).exists():
-                ffmpeg_path = 'ffmpeg'
-
-            result = subprocess.run(
-                [ffmpeg_path, '-list_devices', 'true', '-f', 'dshow', '-i', 'dummy'],
-                capture_output=True,
-                text=True,
-                encoding='utf-8',
-                errors='ignore'
-            )
-            
-            output = result.stderr
-            
-            # 查找CABLE相关的音频设备
-            for line in output.split('\n'):
-                if 'CABLE Output' in line or 'VB-Audio' in line:
-                    # 提取设备名称
-                    if '"' in line:
-                        device_name = line.split('"')[1]
-                        self.log(f"找到音频设备: {device_name}")
-                        return device_name
-            
-            # 默认名称
-            return "CABLE Output (VB-Audio Virtual Cable)"
+            installed = bool(self.driver.execute_script(LESSON_EVENT_HOOK_JS))
         except Exception as e:
-            self.log(f"获取音频设备名称失败: {e}")
-            return "CABLE Output (VB-Audio Virtual Cable)"
+            self.log(f"⚠ 注入课件事件钩子失败: {e}")
+            return False
+
+        if installed:
+            self.log("✓ 已挂载课件事件钩子（startAutoPlay/showSlide/stopAutoPlay/speakContent）")
+        else:
+            self.log("⚠ 页面没有startAutoPlay函数，改用轮询检测播放状态")
+        return installed
+
+    def drain_lesson_events(self):
+        """取走页面中累积的课件事件；钩子丢失（如页面被刷新）时返回None"""
+        try:
+            events = self.driver.execute_script(
+                "return window.__recorderHook ? window.__recorderHook.events.splice(0) : null;"
+            )
+        except Exception:
+            return None
+        self.page_alive_at = time.time()
+        return events
+
+    def page_capture_enabled(self):
+        return self.config.get("页面内采集", {}).get("启用", False)
+
+    def prepare_audio_device(self):
+        """查找并试录验证音频设备（每次运行一次），设备不可用时抛出AudioDeviceError"""
+        if self.audio_input_args:
+            return self.audio_input_args
+
+        if self.audio_registry is None:
+            # 并行模式下录制器独占的null sink一定是pulse后端
+            self.audio_registry = AudioDeviceRegistry(
+                get_ffmpeg_path(), backend='pulse' if self.audio_source else None
+            )
+
+        registry = self.audio_registry
+        if self.audio_source:
+            device = registry.resolve(f"{self.audio_source}.monitor")
+        else:
+            # 配置的设备不存在时使用本后端的默认设备（config.json 默认填的是Windows上VB-Cable的名称）
+            default = registry.default_device()
+            preferred = self.config.get("FFmpeg配置", {}).get("音频设备名称") or default
+            device = registry.resolve(preferred, keywords=registry.default_keywords(), fallback=default)
+
+        self.audio_input_args = registry.input_args(device)
+        self.log(f"✓ 音频设备可用: {device}（{registry.backend}）")
+        return self.audio_input_args
+
+    def get_audio_device_name(self):
+        """获取VB-Cable音频设备的准确名称"""
+        args = self.prepare_audio_device()
+        return args[-1].split('=', 1)[-1]
     
-    def start_ffmpeg_recording(self, window_info, output_file, max_duration=600):
-        """启动FFmpeg录制（双显示器优化）"""
-        audio_device = self.get_audio_device_name()
+    def build_capture_inputs(self, window_info):
+        """构建FFmpeg画面和音频输入参数
+
+        Windows使用gdigrab抓取桌面区域；Linux使用x11grab抓取X显示器
+        （并行模式下为录制器独占的虚拟显示器）。音频输入来自音频设备注册表。
+        """
+        display = self.display or (None if sys.platform == 'win32' else os.environ.get('DISPLAY', ':0'))
+        frame_rate = self.ffmpeg_settings().get("帧率", 30)
+        if display:
+            video_args = [
+                '-f', 'x11grab',
+                '-framerate', str(frame_rate),
+                '-video_size', f"{window_info['width']}x{window_info['height']}",
+                '-i', f"{display}+{window_info['x']},{window_info['y']}",
+            ]
+        else:
+            video_args = [
+                '-f', 'gdigrab',
+                '-framerate', str(frame_rate),
+                '-offset_x', str(window_info['x']),
+                '-offset_y', str(window_info['y']),
+                '-video_size', f"{window_info['width']}x{window_info['height']}",
+                '-i', 'desktop',
+            ]
+        # 页面内采集时声音来自页面，FFmpeg只抓画面
+        if self.page_capture_enabled():
+            return video_args
+        return video_args + self.prepare_audio_device()
+
+    def two_stage_enabled(self):
+        return self.config.get("两段式录制", {}).get("启用", False)
 
-        # 使用当前目录的ffmpeg.exe
-        ffmpeg_path = str(Path("ffmpeg.exe").absolute())
-        if not Path(ffmpeg_path).exists():
-            ffmpeg_path = 'ffmpeg'
+    def capture_path_for(self, output_file):
+        """两段式录制的中间文件路径"""
+        return output_file.with_name(output_file.stem + '.capture.mkv')
+
+    def variable_frame_rate_enabled(self):
+        return self.config.get("画面采集", {}).get("可变帧率", False)
+
+    def decimate_filter(self):
+        """可变帧率：mpdecimate 丢弃与上一帧几乎相同的帧，静止的幻灯片几乎不占编码CPU和磁盘；
+        最长静止间隔内至少保留一帧，播放器拖动和质量检查的画面静止检测不受影响"""
+        if not self.variable_frame_rate_enabled():
+            return None
+        capture_config = self.config.get("画面采集", {})
+        frame_rate = self.ffmpeg_settings().get("帧率", 30)
+        max_dropped = max(1, int(frame_rate * capture_config.get("最长静止间隔_秒", 1)))
+        return "mpdecimate=hi={}:lo={}:frac={}:max={}".format(
+            capture_config.get("去重阈值_hi", 768),
+            capture_config.get("去重阈值_lo", 320),
+            capture_config.get("去重比例", 0.33),
+            max_dropped,
+        )
+
+    def video_filter_args(self, ffmpeg_config=None):
+        """-vf 参数：可变帧率去重；最终编码时按 输出宽度 缩放（中间文件保持采集分辨率，由转码时缩放）"""
+        filters = [self.decimate_filter()]
+        width = (ffmpeg_config or {}).get("输出宽度", 0)
+        if width:
+            filters.append(f"scale={width}:-2")
+        filters = [f for f in filters if f]
+        return ['-vf', ','.join(filters)] if filters else []
+
+    def encoder_args(self, intermediate=False):
+        """编码参数：最终输出使用 FFmpeg配置；中间文件使用无损、几乎不占CPU的编码"""
+        if intermediate:
+            capture_config = self.config.get("两段式录制", {})
+            vfr_args = ['-fps_mode', 'vfr'] if self.variable_frame_rate_enabled() else []
+            return self.video_filter_args() + [
+                '-c:v', 'libx264',
+                '-preset', capture_config.get("采集编码预设", "ultrafast"),
+                '-qp', str(capture_config.get("采集量化参数_QP", 0)),
+            ] + vfr_args + [
+                '-c:a', 'pcm_s16le',
+            ]
+
+        ffmpeg_config = self.ffmpeg_settings()
+        # 关键帧较密，首尾裁剪可以用流复制精确对齐
+        timing_args = frame_timing_args(ffmpeg_config, self.variable_frame_rate_enabled())
+        threads = ffmpeg_config.get("编码线程数", 0)
+        return self.video_filter_args(ffmpeg_config) + [
+            '-c:v', ffmpeg_config.get("视频编码器", "libx264"),
+            '-preset', ffmpeg_config.get("编码预设", "medium"),
+            '-crf', str(ffmpeg_config.get("视频质量_CRF", 23)),
+        ] + timing_args + (['-threads', str(threads)] if threads else []) + [
+            '-c:a', ffmpeg_config.get("音频编码器", "aac"),
+            '-b:a', ffmpeg_config.get("音频比特率", "192k"),
+        ]
+
+    def base_ffmpeg_settings(self):
+        """FFmpeg配置叠加本机编码校准结果（python encoder_calibration.py 生成）"""
+        if self.host_profile is None:
+            self.host_profile = load_host_profile(self.config)
+            if self.host_profile:
+                self.log("✓ 使用本机编码校准结果: " + "，".join(f"{k} {v}" for k, v in self.host_profile.items()))
+        return dict(self.config.get("FFmpeg配置", {}), **self.host_profile)
+
+    def ffmpeg_settings(self):
+        """录制使用的FFmpeg设置：FFmpeg配置 → 本机编码校准结果 → 资源调节的当前帧率和编码预设"""
+        ffmpeg_config = self.base_ffmpeg_settings()
+        governor = self.get_governor()
+        return governor.ffmpeg_config(ffmpeg_config) if governor else ffmpeg_config
+
+    def get_governor(self):
+        """资源调节（首次使用时创建；关闭时返回None）。单机录制时调节的是后台转码并发数"""
+        if self.governor is None and self.config.get("资源调节", {}).get("启用", False):
+            concurrency = self.config.get("两段式录制", {}).get("转码并发数", 2) if self.two_stage_enabled() else 1
+            # 以本机编码校准结果为调节起点
+            self.governor = ResourceGovernor(dict(self.config, FFmpeg配置=self.base_ffmpeg_settings()), self.log,
+                                             concurrency=concurrency)
+        return self.governor
+
+    def adjust_resources(self, lesson):
+        """课件录完后由资源调节决定之后课件的帧率、编码预设和并发数（跳过的课件没有采集统计）"""
+        governor = self.get_governor()
+        if governor and self.last_capture_stats is not None:
+            governor.after_lesson(lesson, self.last_capture_stats)
+
+    def get_transcoder(self):
+        """两段式录制的后台转码队列（首次使用时创建）"""
+        if self.transcoder is None:
+            capture_config = self.config.get("两段式录制", {})
+            governor = self.get_governor()
+            self.transcoder = TranscodeQueue(
+                get_ffmpeg_path(),
+                self.base_ffmpeg_settings(),
+                workers=capture_config.get("转码并发数", 2),
+                threads=capture_config.get("每个转码线程数", 0),
+                log=self.log,
+                tracer=self.get_tracer(),
+                # 中间文件已去掉重复帧，转码时保留原始时间戳
+                variable_frame_rate=self.variable_frame_rate_enabled(),
+                limit=governor.limit if governor and governor.concurrency_target == "转码" else None
+            )
+        return self.transcoder
+
+    def get_tracer(self):
+        """阶段耗时追踪（首次使用时创建；关闭时返回空实现）"""
+        if self.tracer is None:
+            if self.config.get("性能追踪", {}).get("启用", True):
+                trace_file = self.output_dir / "性能追踪" / f"trace_{datetime.now():%Y%m%d_%H%M%S}.json"
+                self.tracer = Tracer(trace_file, log=self.log)
+            else:
+                self.tracer = NULL_TRACER
+        return self.tracer
+
+    def get_watchdog(self):
+        """进程看护（首次使用时启动；关闭时返回None）"""
+        if self.watchdog is None and self.config.get("进程看护", {}).get("启用", True):
+            self.watchdog = ProcessWatchdog(self, self.output_dir / "资源曲线").start()
+        return self.watchdog
+
+    def maybe_recycle_browser(self):
+        """连续录制的课件数或浏览器内存达到上限、或上一课终止过渲染进程时，重启浏览器"""
+        watchdog = self.watchdog
+        if watchdog is None or self.driver is None or self.virtual_time_engine:
+            return
+        reason = watchdog.recycle_reason()
+        if not reason:
+            return
+
+        self.log(f"♻ 重启浏览器: {reason}")
+        with self.get_tracer().span('重启浏览器', 原因=reason):
+            chrome_pids = watchdog.chrome_pids()
+            self.discard_prefetched()
+            try:
+                self.driver.quit()
+            except Exception as e:
+                self.log(f"⚠ 关闭浏览器失败: {e}")
+            self.driver = None
+            leftovers = watchdog.kill_leftovers(chrome_pids)
+            if leftovers:
+                self.log(f"⚠ 已强制结束 {leftovers} 个未退出的Chrome进程")
+            self.setup_browser()
+        watchdog.browser_restarted()
+
+    def get_journal(self):
+        """断点续录运行记录（首次使用时创建）"""
+        if self.journal is None:
+            self.journal = RunJournal(self.output_dir / "录制记录.jsonl")
+        return self.journal
+
+    def verify_capture(self, path):
+        """检查临时文件能否转为正式文件：文件非空，且FFmpeg正常写完了文件尾"""
+        if not path.exists() or path.stat().st_size == 0:
+            return False, "文件未生成"
+        if self.last_capture_stats is not None and not self.last_capture_stats.get('正常结束', True):
+            return False, "FFmpeg未正常结束，文件可能不完整"
+        return True, None
+
+    def quality_check_enabled(self):
+        return self.config.get("质量检查", {}).get("启用", True)
+
+    def get_verifier(self):
+        """后台质量检查线程池（首次使用时创建）"""
+        if self.verifier is None:
+            self.verifier = VideoVerifier(get_ffmpeg_path(), self.config, self.output_dir / "质量报告",
+                                          log=self.log, tracer=self.get_tracer())
+        return self.verifier
+
+    def finalize_output(self, lesson, partial_file, output_file, timeline=None):
+        """基本检查通过后交给质量检查；全部通过才原子改名为正式文件"""
+        journal = self.get_journal()
+        journal.record(lesson, FINALISING, **self.capture_report_detail())
+        ok, reason = self.verify_capture(partial_file)
+        if not ok:
+            self.log(f"✗ 录制失败: {reason}")
+            journal.record(lesson, FAILED, 原因=reason)
+            return False
+
+        if not self.quality_check_enabled():
+            return self.accept_output(lesson, partial_file, output_file)
+        self.submit_quality_check(lesson, partial_file, output_file, timeline)
+        return True
+
+    def accept_output(self, lesson, partial_file, output_file, **detail):
+        """临时文件改名为正式文件并记录为已完成"""
+        os.replace(partial_file, output_file)
+        file_size = output_file.stat().st_size / (1024 * 1024)  # MB
+        self.log(f"✓ 录制完成: {output_file.name} ({file_size:.2f} MB)")
+        content_hash = self.recording_hashes.pop(lesson, None) or self.get_manifest().content_hash(lesson)
+        if self.host_profile:
+            detail['本机编码校准'] = self.host_profile
+        degraded = self.degraded_recordings.pop(lesson, None)
+        if degraded:
+            detail['降档设置'] = degraded
+        self.get_journal().record(lesson, VERIFIED, 大小_MB=round(file_size, 2), 内容哈希=content_hash, **detail)
+        return True
+
+    def submit_quality_check(self, lesson, partial_file, output_file, timeline=None):
+        """提交后台质量检查；未通过的课件记为失败，由 record_all 自动重新录制"""
+        journal = self.get_journal()
+        expected = self.lesson_index.expected_duration(lesson) if self.lesson_index else None
+        # 虚拟时间引擎只输出画面
+        require_audio = self.virtual_time_engine is None
+
+        def on_done(report):
+            if report['通过']:
+                trimmed = self.trim_to_content(partial_file, report, timeline)
+                detail = {'裁剪': list(trimmed)} if trimmed else {}
+                self.accept_output(lesson, partial_file, output_file, 质量报告=report['报告文件'], **detail)
+            else:
+                problems = "；".join(report['问题'])
+                self.log(f"✗ 质量检查未通过: {output_file.name}（{problems}）")
+                journal.record(lesson, FAILED, 原因=problems, 质量报告=report['报告文件'])
+
+        self.get_verifier().submit(partial_file, expected, require_audio, on_done)
+        self.log(f"已提交后台质量检查: {partial_file.name}")
+
+    def trim_to_content(self, path, report, timeline=None):
+        """去掉首尾空白：优先按课件事件时间线，否则按质量检查的静音/画面静止区间"""
+        if not self.config.get("首尾裁剪", {}).get("启用", True):
+            return None
+        bounds = timeline or content_bounds_from_report(report)
+        if not bounds:
+            return None
+        with self.get_tracer().span('首尾裁剪', 'FFmpeg', 文件=path.name):
+            return VideoTrimmer(get_ffmpeg_path(), self.config, self.log).trim(path, report['时长_秒'], *bounds)
+
+    def content_timeline(self, capture_started):
+        """课件事件时间线换算成视频时间：(第一次讲解开始, 播放完成)，事件不全时返回None"""
+        speech_starts = [event['time'] for event in self.lesson_events if event['type'] == 'speakContent']
+        completions = [event['time'] for event in self.lesson_events if event['type'] == 'lesson_complete']
+        if not speech_starts or not completions:
+            return None
+        # 页面 Date.now() 与 time.time() 是同一个系统时钟。capture_started 是启动FFmpeg进程的时间，
+        # 早于实际开始采集（设备初始化），按它换算的内容起点偏晚；有进度输出时改用文件 t=0 对应的时间
+        origin = self.capture_media_origin or capture_started
+        return max(0.0, speech_starts[0] / 1000 - origin), completions[-1] / 1000 - origin
+
+    def submit_transcode(self, lesson, capture_file, output_file, media_seconds=None, timeline=None):
+        """两段式录制：把采集文件交给后台转码，转码完成后进入质量检查"""
+        journal = self.get_journal()
+        journal.record(lesson, FINALISING, 采集文件=capture_file.name, **self.capture_report_detail())
+        partial_file = partial_path_for(output_file)
+
+        def on_done(ok, target):
+            if not ok:
+                journal.record(lesson, FAILED, 原因="转码失败")
+            elif self.quality_check_enabled():
+                self.submit_quality_check(lesson, target, output_file, timeline)
+            else:
+                self.accept_output(lesson, target, output_file)
+
+        self.get_transcoder().submit(capture_file, partial_file, media_seconds, on_done=on_done,
+                                     ffmpeg_config=self.ffmpeg_settings())
+
+    def segmented_enabled(self):
+        return self.config.get("分段录制", {}).get("启用", False)
+
+    def record_segmented(self, lesson, window_info, output_file, partial_file, capture_file, max_duration):
+        """按页分段录制并拼接，之后与整体录制相同：两段式交给后台转码，否则进入验证"""
+        two_stage = self.two_stage_enabled()
+        target = capture_file if two_stage else partial_file
+        ok, reason, seconds = SlideSegmentRecorder(self, get_ffmpeg_path()).record(
+            lesson, window_info, target, max_duration, intermediate=two_stage
+        )
+        if not ok:
+            self.log(f"✗ 录制失败: {reason}")
+            self.get_journal().record(lesson, FAILED, 原因=reason)
+            return False
+        if two_stage:
+            self.submit_transcode(lesson, capture_file, output_file, seconds)
+            return True
+        return self.finalize_output(lesson, partial_file, output_file)
+
+    def wait_background_jobs(self):
+        """等待后台转码和质量检查结束（转码完成时才提交质量检查，所以循环到两者都空闲）"""
+        while (self.transcoder and self.transcoder.pending()) or (self.verifier and self.verifier.pending()):
+            if self.transcoder:
+                self.transcoder.wait()
+            if self.verifier:
+                self.verifier.wait()
+
+    def close_background_jobs(self):
+        """等待后台转码和质量检查结束并关闭线程池"""
+        self.wait_background_jobs()
+        if self.transcoder:
+            self.transcoder.close()
+            self.transcoder = None
+        if self.verifier:
+            self.verifier.close()
+            self.verifier = None
+
+    def start_ffmpeg_recording(self, window_info, output_file, max_duration=600, intermediate=False):
+        """启动FFmpeg录制（双显示器优化）"""
+        ffmpeg_path = get_ffmpeg_path()
+        self.capture_media_origin = None
 
         # 验证录制区域在主显示器内
         self.log(f"录制区域: x={window_info['x']}, y={window_info['y']}, "
@@ -280,21 +1084,17 @@ class SmartCoursewareRecorder:
         self.log(f"主显示器: x={self.primary_monitor['x']}, y={self.primary_monitor['y']}, "
                 f"width={self.primary_monitor['width']}, height={self.primary_monitor['height']}")
 
-        cmd = [
-            ffmpeg_path,
-            '-f', 'gdigrab',
-            '-framerate', '30',
-            '-offset_x', str(window_info['x']),
-            '-offset_y', str(window_info['y']),
-            '-video_size', f"{window_info['width']}x{window_info['height']}",
-            '-i', 'desktop',
-            '-f', 'dshow',
-            '-i', f'audio={audio_device}',
-            '-c:v', 'libx264',
-            '-preset', 'medium',
-            '-crf', '23',
-            '-c:a', 'aac',
-            '-b:a', '192k',
+        if self.page_capture_enabled():
+            sidecar = output_file.with_name(output_file.stem + '.page.webm')
+            self.page_capture = PageCaptureSession(self.driver, sidecar, self.config, self.log,
+                                                   ffmpeg_config=self.ffmpeg_settings())
+            self.page_capture_target = (Path(output_file), intermediate)
+            if self.page_capture.video:
+                # 画面和声音都由页面录制，不启动FFmpeg
+                self.page_capture.start()
+                return None
+
+        cmd = [ffmpeg_path] + self.build_capture_inputs(window_info) + self.encoder_args(intermediate) + progress_args() + [
             '-t', str(max_duration),
             '-y',
             str(output_file)
@@ -302,13 +1102,20 @@ class SmartCoursewareRecorder:
         
         self.log(f"FFmpeg命令: {' '.join(cmd)}")
         
+        self.capture_region = window_info
+        self.capture_file = Path(output_file)
+        self.capture_started_at = self.page_capture_video_started = time.time()
         self.ffmpeg_process = subprocess.Popen(
             cmd,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
             stdin=subprocess.PIPE,
-            creationflags=subprocess.CREATE_NO_WINDOW
+            creationflags=getattr(subprocess, 'CREATE_NO_WINDOW', 0)
         )
+        # 持续读取stdout/stderr，避免管道写满后FFmpeg阻塞
+        self.progress_monitor = FFmpegProgressMonitor(self.ffmpeg_process, self.log, self.config).start()
+        if self.page_capture:
+            self.page_capture.start()
         
         return self.ffmpeg_process
     
@@ -316,6 +1123,7 @@ class SmartCoursewareRecorder:
         """停止FFmpeg录制"""
         if self.ffmpeg_process:
             self.log("正在停止录制...")
+            cpu_seconds = self.ffmpeg_cpu_seconds()
             try:
                 # 发送'q'命令
                 self.ffmpeg_process.stdin.write(b'q')
@@ -326,169 +1134,838 @@ class SmartCoursewareRecorder:
                 time.sleep(2)
                 if self.ffmpeg_process.poll() is None:
                     self.ffmpeg_process.kill()
-            
+
+            if self.progress_monitor:
+                self.capture_media_origin = self.progress_monitor.media_origin()
+                self.last_capture_stats = self.progress_monitor.stop()
+                self.progress_monitor = None
+                self.add_capture_cost(cpu_seconds)
             self.ffmpeg_process = None
             self.log("录制已停止")
+        self.finish_page_capture()
+
+    def ffmpeg_cpu_seconds(self):
+        """FFmpeg进程已用的CPU时间（用户+系统），在发送 'q' 之前读取"""
+        try:
+            times = psutil.Process(self.ffmpeg_process.pid).cpu_times()
+            return times.user + times.system
+        except psutil.Error:
+            return None
+
+    def add_capture_cost(self, cpu_seconds):
+        """累计本课件一次采集的开销（分段录制时每页一次）"""
+        stats = self.last_capture_stats or {}
+        frame_rate = self.ffmpeg_settings().get("帧率", 30)
+        totals = self.capture_totals
+        totals['墙钟_秒'] = totals.get('墙钟_秒', 0) + time.time() - self.capture_started_at
+        totals['CPU_秒'] = totals.get('CPU_秒', 0) + (cpu_seconds or 0)
+        totals['媒体时长_秒'] = totals.get('媒体时长_秒', 0) + (stats.get('媒体时长_秒') or 0)
+        totals['编码帧数'] = totals.get('编码帧数', 0) + (stats.get('编码帧数') or 0)
+        totals['名义帧数'] = totals.get('名义帧数', 0) + (stats.get('媒体时长_秒') or 0) * frame_rate
+        if self.capture_file and self.capture_file.exists():
+            totals['大小_MB'] = totals.get('大小_MB', 0) + self.capture_file.stat().st_size / (1024 * 1024)
+
+    def capture_report(self):
+        """本课件的采集开销报告：采集区域比整个窗口少的像素、可变帧率省下的帧、FFmpeg占用的CPU、文件大小"""
+        totals = self.capture_totals
+        if not totals.get('墙钟_秒'):
+            return None
+        region = self.capture_region
+        window = self.window_rect or region
+        region_pixels = region['width'] * region['height']
+        window_pixels = window['width'] * window['height']
+        media_minutes = totals['媒体时长_秒'] / 60
+        report = {
+            '采集区域': f"{region['width']}x{region['height']}",
+            '窗口区域': f"{window['width']}x{window['height']}",
+            '像素节省_%': round(100 * (1 - region_pixels / window_pixels), 1) if window_pixels else 0,
+            '编码帧数': totals['编码帧数'],
+            '帧数节省_%': round(100 * (1 - totals['编码帧数'] / totals['名义帧数']), 1) if totals['名义帧数'] else 0,
+            'FFmpeg_CPU_秒': round(totals['CPU_秒'], 1),
+            'FFmpeg_平均核数': round(totals['CPU_秒'] / totals['墙钟_秒'], 2),
+            '大小_MB': round(totals.get('大小_MB', 0), 2),
+            '每分钟_MB': round(totals.get('大小_MB', 0) / media_minutes, 2) if media_minutes else None,
+        }
+        self.log(f"采集开销: 区域 {report['采集区域']}（窗口 {report['窗口区域']}，省 {report['像素节省_%']}% 像素），"
+                 f"编码 {report['编码帧数']} 帧（省 {report['帧数节省_%']}%），"
+                 f"FFmpeg CPU {report['FFmpeg_CPU_秒']}秒（平均 {report['FFmpeg_平均核数']} 核），"
+                 f"{report['大小_MB']} MB（{report['每分钟_MB']} MB/分钟）")
+        return report
+
+    def capture_report_detail(self):
+        """写入运行记录的采集报告（本次没有FFmpeg采集时为空）"""
+        report = self.capture_report()
+        return {'采集报告': report} if report else {}
+
+    def finish_page_capture(self):
+        """停止页面内采集：把声音按开始时间对齐合成进FFmpeg抓取的画面，或把页面录制的画面转为输出格式"""
+        session, self.page_capture = self.page_capture, None
+        if session is None:
+            return
+        stats = session.stop()
+        target, intermediate = self.page_capture_target
+        ffmpeg_path = get_ffmpeg_path()
+        encoder_args = self.encoder_args(intermediate)
+
+        if session.video:
+            # 页面录制的画面本身就是可变帧率，开启可变帧率时不再补成恒定帧率
+            frame_rate = None if self.variable_frame_rate_enabled() else self.ffmpeg_settings().get("帧率", 30)
+            ok = stats['正常结束'] and convert_page_video(ffmpeg_path, session.output_file, target,
+                                                        encoder_args, frame_rate, self.log)
+            self.last_capture_stats = dict(stats, 正常结束=ok)
+            return
+
+        offset = (session.started_at or self.page_capture_video_started) - self.page_capture_video_started
+        ok = (stats['正常结束'] and target.exists()
+              and mux_page_audio(ffmpeg_path, target, session.output_file, offset,
+                                 encoder_args[encoder_args.index('-c:a'):], self.log))
+        if self.last_capture_stats is not None:
+            self.last_capture_stats['正常结束'] = self.last_capture_stats.get('正常结束', True) and ok
     
     def record_single_url(self, url, index, total, max_duration=600, check_interval=30):
         """录制单个URL（智能检测完成）"""
-        self.log(f"\n{'='*60}")
-        self.log(f"正在录制 [{index}/{total}]: {url}")
-        self.log(f"{'='*60}")
-        
-        filename = url.split('/')[-1].replace('.html', '.mp4')
-        output_file = self.output_dir / filename
-        
-        # 如果文件已存在，跳过
-        if output_file.exists():
-            self.log(f"⊙ 文件已存在，跳过: {output_file}")
-            return True
+        lesson = lesson_name_from_url(url)
+        watchdog = self.get_watchdog()
+        if watchdog:
+            self.maybe_recycle_browser()
+            watchdog.begin_lesson(lesson)
+        try:
+            with self.get_tracer().span('录制课件', 课件=lesson) as span_args:
+                result = self._record_single_url(url, index, total, max_duration, check_interval)
+                span_args['结果'] = result
+            self.adjust_resources(lesson)
+            return result
+        finally:
+            if watchdog:
+                watchdog.end_lesson()
+
+    def _record_single_url(self, url, index, total, max_duration, check_interval):
+        self.log_lesson_header(url, index, total)
+        lesson = lesson_name_from_url(url)
+        output_file = self.output_path_for(url)
+        capture_file = self.capture_path_for(output_file)
+        partial_file = partial_path_for(output_file)
+        journal = self.get_journal()
+
+        settled = self.settle_existing(url)
+        if settled is not None:
+            return settled
+
+        if self.virtual_time_engine:
+            journal.record(lesson, RECORDING, 引擎="虚拟时间")
+            if self.virtual_time_engine.record(url, partial_file, max_duration):
+                return self.finalize_output(lesson, partial_file, output_file)
+            journal.record(lesson, FAILED, 原因="虚拟时间录制失败")
+            return False
         
+        phases = self.get_tracer().phases(课件=lesson)
         try:
-            # 打开网页
-            self.log("正在加载网页...")
-            self.driver.get(url)
-            time.sleep(5)
-            
-            # 获取窗口信息
-            window_info = self.get_browser_window_info()
-            self.log(f"浏览器窗口: {window_info}")
-            
-            # 注入CSS优化（仅统一字号，不修改播放时长）
-            self.log("正在优化页面样式...")
-            self.driver.execute_script("""
-                // 统一字号：基于01_1.1的尺寸减少3px
-                // 原始：subtitle 18px, h2 22px, h3 20px, 普通文本 18px
-                // 新尺寸：subtitle 15px, h2 19px, h3 17px, 普通文本 15px
-                const style = document.createElement('style');
-                style.textContent = `
-                    .subtitle-area,
-                    .subtitle-text,
-                    [class*="subtitle"] {
-                        font-size: 15px !important;
-                    }
-                    .blackboard h2,
-                    .content h2,
-                    h2 {
-                        font-size: 19px !important;
-                    }
-                    .blackboard h3,
-                    .content h3,
-                    h3 {
-                        font-size: 17px !important;
-                    }
-                    .blackboard p,
-                    .blackboard li,
-                    .content p,
-                    .content li,
-                    p, li {
-                        font-size: 15px !important;
-                    }
-                `;
-                document.head.appendChild(style);
-            """)
-            self.log("✓ 已优化：统一字号(15/17/19px)，保持原有播放节奏")
-            time.sleep(2)
+            window_info = self.load_lesson(url, phases)
 
-            # 查找并点击播放按钮
-            play_clicked = self.find_and_click_play_button()
+            if self.segmented_enabled():
+                if SlideSegmentRecorder.supported(self.driver):
+                    phases.next('分段录制')
+                    return self.record_segmented(lesson, window_info, output_file, partial_file, capture_file, max_duration)
+                self.log("⚠ 课件不支持分段录制（没有 speakContent 或可用的翻页函数），改用整体录制")
 
-            if not play_clicked:
-                self.log("⚠ 请在10秒内手动点击播放按钮...")
-                time.sleep(10)
-            else:
-                time.sleep(3)
+            event_driven = self.start_playback(phases)
             
             # 开始录制
+            phases.next('启动采集')
             self.log(f"开始录制，最大时长: {max_duration}秒")
-            self.start_ffmpeg_recording(window_info, output_file, max_duration)
+            two_stage = self.two_stage_enabled()
+            if not two_stage:
+                capture_file = partial_file
+            self.start_ffmpeg_recording(window_info, capture_file, max_duration, intermediate=two_stage)
+            capture_started = time.time()
+            journal.record(lesson, RECORDING, 临时文件=capture_file.name)
+            self.wait_until_ready('首条字幕')
+
+            # 录制期间在后台预加载下一个课件
+            if self.next_url and self.prefetch_enabled():
+                self.prefetch_lesson(self.next_url)
+            self.log_phase_waits()
             
             # 智能监控录制过程
-            start_time = time.time()
-            last_check = 0
-            
-            while True:
-                elapsed = time.time() - start_time
-                
-                # 检查是否超时
-                if elapsed >= max_duration:
-                    self.log(f"达到最大录制时长 {max_duration}秒")
-                    break
-                
-                # 定期检查播放状态
-                if elapsed - last_check >= check_interval:
-                    status = self.check_playback_status()
-                    self.log(f"已录制 {int(elapsed)}秒，状态: {status}")
-                    
-                    if status == 'completed':
-                        self.log("检测到播放完成")
-                        time.sleep(5)  # 多录5秒确保完整
-                        break
-                    
-                    last_check = elapsed
-                
-                time.sleep(1)
+            phases.next('录制')
+            recorded_seconds = self.monitor_playback(max_duration, check_interval, event_driven)
             
             # 停止录制
+            phases.next('停止FFmpeg')
             self.stop_ffmpeg_recording()
-            
-            # 检查文件是否生成
-            if output_file.exists():
-                file_size = output_file.stat().st_size / (1024 * 1024)  # MB
-                self.log(f"✓ 录制完成: {output_file.name} ({file_size:.2f} MB)")
-                return True
-            else:
-                self.log(f"✗ 录制失败: 文件未生成")
-                return False
+            phases.next('提交收尾')
+            return self.finish_capture(lesson, output_file, capture_file, two_stage, recorded_seconds, capture_started)
             
         except Exception as e:
+            phases.end(e)
             self.log(f"✗ 录制失败: {e}")
             self.stop_ffmpeg_recording()
+            journal.record(lesson, FAILED, 原因=str(e))
             return False
-    
+
+        finally:
+            phases.end()
+
+    def log_lesson_header(self, url, index, total):
+        self.log(f"\n{'='*60}")
+        self.log(f"正在录制 [{index}/{total}]: {url}")
+        self.log(f"{'='*60}")
+
+    def settle_existing(self, url):
+        """已完成或上次收尾未结束的课件直接处理并返回结果；需要录制时返回None"""
+        output_file = self.output_path_for(url)
+        lesson = lesson_name_from_url(url)
+        journal = self.get_journal()
+        self.last_capture_stats = None
+        self.capture_totals = {}
+        
+        # 正式文件只在验证通过后才会出现，存在且课件未修改即表示已完成
+        if self.is_up_to_date(url):
+            self.log(f"⊙ 文件已存在，跳过: {output_file}")
+            if journal.state(lesson) != VERIFIED:
+                journal.record(lesson, VERIFIED, 原因="已有文件", 内容哈希=self.get_manifest().content_hash(lesson))
+            return True
+
+        # 上次运行已录制完成、收尾未结束：重新转码或重新检查，不必重录
+        capture_file = self.capture_path_for(output_file)
+        partial_file = partial_path_for(output_file)
+        if journal.state(lesson) == FINALISING:
+            if capture_file.exists():
+                self.log(f"⊙ 上次已采集完成，重新提交转码: {capture_file.name}")
+                self.submit_transcode(lesson, capture_file, output_file)
+                return True
+            if partial_file.exists():
+                self.log(f"⊙ 上次已录制完成，重新检查: {partial_file.name}")
+                return self.finalize_output(lesson, partial_file, output_file)
+
+        # 以开始录制时的课件内容为准，录制期间再修改课件，下次运行仍会重录
+        self.recording_hashes[lesson] = self.get_manifest().content_hash(lesson)
+        governor = self.get_governor()
+        degraded = governor.degraded_settings() if governor else None
+        if degraded:
+            self.degraded_recordings[lesson] = degraded
+        else:
+            self.degraded_recordings.pop(lesson, None)
+        return None
+
+    def load_lesson(self, url, phases):
+        """加载课件页面（或切换到预加载的标签页），等待就绪并注入样式，返回录制区域"""
+        lesson = lesson_name_from_url(url)
+        journal = self.get_journal()
+        # 打开网页
+        phases.next('加载页面')
+        self.log("正在加载网页...")
+        journal.record(lesson, LOADING)
+        self.phase_waits = {}
+        if self.activate_prefetched(url):
+            self.log("✓ 已切换到预加载完成的标签页")
+        else:
+            self.driver.get(url)
+        for phase in ('DOM就绪', '字体加载', 'MathJax排版', 'SDK就绪'):
+            self.wait_until_ready(phase)
+        
+        # 获取窗口信息
+        window_info = self.get_browser_window_info()
+        self.log(f"浏览器窗口: {window_info}")
+        
+        # 注入CSS优化（仅统一字号，不修改播放时长）
+        phases.next('注入样式')
+        self.log("正在优化页面样式...")
+        self.driver.execute_script("""
+            // 统一字号：基于01_1.1的尺寸减少3px
+            // 原始：subtitle 18px, h2 22px, h3 20px, 普通文本 18px
+            // 新尺寸：subtitle 15px, h2 19px, h3 17px, 普通文本 15px
+            const style = document.createElement('style');
+            style.textContent = `
+                .subtitle-area,
+                .subtitle-text,
+                [class*="subtitle"] {
+                    font-size: 15px !important;
+                }
+                .blackboard h2,
+                .content h2,
+                h2 {
+                    font-size: 19px !important;
+                }
+                .blackboard h3,
+                .content h3,
+                h3 {
+                    font-size: 17px !important;
+                }
+                .blackboard p,
+                .blackboard li,
+                .content p,
+                .content li,
+                p, li {
+                    font-size: 15px !important;
+                }
+            `;
+            document.head.appendChild(style);
+            // 两帧之后新样式已完成布局
+            window.__recorderStyleApplied = false;
+            requestAnimationFrame(() => requestAnimationFrame(() => {
+                window.__recorderStyleApplied = true;
+            }));
+            const subtitleArea = document.getElementById('subtitleArea');
+            window.__recorderSubtitleBefore = subtitleArea ? subtitleArea.textContent : '';
+        """)
+        self.log("✓ 已优化：统一字号(15/17/19px)，保持原有播放节奏")
+        self.wait_until_ready('样式生效')
+        if self.page_capture_enabled():
+            # 后台预加载的标签页没有新文档脚本，这里补执行（已有时不重复）
+            self.driver.execute_script(PAGE_CAPTURE_INIT_JS)
+        return window_info
+
+    def start_playback(self, phases):
+        """挂载课件事件钩子、点击播放并等待虚拟人连接；返回是否由课件事件检测播放完成"""
+        # 挂载课件事件钩子（必须在点击播放之前）
+        phases.next('点击播放')
+        self.lesson_events = []
+        event_driven = (
+            self.config.get("高级选项", {}).get("自动检测播放完成", True)
+            and self.install_lesson_event_hook()
+        )
+
+        # 查找并点击播放按钮
+        play_clicked = self.find_and_click_play_button()
+
+        if not play_clicked:
+            self.log("⚠ 请手动点击播放按钮...")
+            self.wait_until_ready('手动点击播放')
+
+        # 虚拟人连接后约1秒开始第一页讲解，此时开始录制不会丢失开头
+        phases.next('等待虚拟人')
+        self.wait_until_ready('虚拟人连接')
+        return event_driven
+
+    def monitor_playback(self, max_duration, check_interval, event_driven):
+        """等待播放完成或达到最大时长，返回录制秒数"""
+        record_config = self.config.get("录制配置", {})
+        event_poll_interval = record_config.get("事件轮询间隔_秒", 0.2)
+        tail_padding = record_config.get("完成后补录_秒", 0.5)
+        start_time = time.time()
+        last_check = 0
+        
+        while True:
+            elapsed = time.time() - start_time
+            
+            # 检查是否超时
+            if elapsed >= max_duration:
+                self.log(f"达到最大录制时长 {max_duration}秒")
+                break
+
+            # 进程看护已终止停滞的FFmpeg或渲染进程：这一课失败，稍后重录
+            self.raise_if_stalled()
+
+            # 事件驱动：等待最后一页讲解结束
+            if event_driven:
+                events = self.drain_lesson_events()
+                if events is None:
+                    self.log("⚠ 课件事件钩子丢失，改用轮询检测播放状态")
+                    event_driven = False
+                    last_check = elapsed
+                    continue
+
+                if self.handle_lesson_events(events, elapsed):
+                    time.sleep(tail_padding)
+                    break
+
+                time.sleep(event_poll_interval)
+                continue
+            
+            # 定期检查播放状态
+            if elapsed - last_check >= check_interval:
+                status = self.check_playback_status()
+                self.log(f"已录制 {int(elapsed)}秒，状态: {status}")
+                
+                if status == 'completed':
+                    self.log("检测到播放完成")
+                    time.sleep(5)  # 多录5秒确保完整
+                    break
+                
+                last_check = elapsed
+            
+            time.sleep(1)
+        return time.time() - start_time
+
+    def raise_if_stalled(self):
+        stall = self.watchdog.stall_reason() if self.watchdog else None
+        if stall:
+            raise RuntimeError(stall)
+
+    def handle_lesson_events(self, events, elapsed):
+        """记录课件事件并写入日志，返回是否已播放完成"""
+        completed = False
+        for event in events:
+            self.lesson_events.append(event)
+            if event['type'] == 'showSlide':
+                self.log(f"已录制 {int(elapsed)}秒，切换到第 {event['detail'] + 1} 页")
+            elif event['type'] == 'lesson_complete':
+                self.log(f"检测到播放完成（{event['detail']}），已录制 {elapsed:.1f}秒")
+                completed = True
+        return completed
+
+    def finish_capture(self, lesson, output_file, capture_file, two_stage, recorded_seconds, capture_started):
+        """停止采集后的收尾：两段式交给后台转码，否则验证后改名为正式文件"""
+        journal = self.get_journal()
+        # 两段式：采集文件交给后台转码，马上开始下一个课件
+        if two_stage:
+            ok, reason = self.verify_capture(capture_file)
+            if not ok:
+                self.log(f"✗ 录制失败: {reason}")
+                journal.record(lesson, FAILED, 原因=reason)
+                return False
+            file_size = capture_file.stat().st_size / (1024 * 1024)
+            self.log(f"✓ 采集完成: {capture_file.name} ({file_size:.2f} MB)，交给后台转码")
+            self.submit_transcode(lesson, capture_file, output_file, recorded_seconds,
+                                  self.content_timeline(capture_started))
+            return True
+        
+        # 验证通过后改名为正式文件
+        return self.finalize_output(lesson, capture_file, output_file, self.content_timeline(capture_started))
+
+    def log_phase_waits(self):
+        self.log("就绪等待合计 {:.2f}秒（{}）".format(
+            sum(self.phase_waits.values()),
+            ", ".join(f"{phase} {waited:.1f}" for phase, waited in self.phase_waits.items())
+        ))
+
+    def start_lesson_server(self, urls):
+        """启用本地课件服务时启动服务器，并把线上课件地址映射到localhost"""
+        server_config = self.config.get("本地课件服务", {})
+        if not server_config.get("启用", False):
+            return urls
+
+        root = Path(self.config.get("时长索引", {}).get("课件目录") or Path(__file__).parent)
+        self.lesson_server = LocalLessonServer(
+            root,
+            port=server_config.get("端口", 8765),
+            remote_prefix=server_config.get("线上地址前缀", "https://cherishwy1974.github.io/123/")
+        ).start()
+        self.log(f"✓ 本地课件服务已启动: {self.lesson_server.base_url}（课件目录: {root}）")
+        return [self.lesson_server.local_url(url) for url in urls]
+
+    def stop_lesson_server(self):
+        if self.lesson_server:
+            self.lesson_server.stop()
+            self.lesson_server = None
+
+    def warm_browser_cache(self, urls):
+        """依次打开覆盖全部资源引用的少量课件，预热浏览器磁盘缓存"""
+        if not self.lesson_server or not self.config.get("本地课件服务", {}).get("启动时预热缓存", True):
+            return
+        warmup_urls = self.lesson_server.cache_warmup_urls(urls)
+        start = time.time()
+        for url in warmup_urls:
+            self.driver.get(url)
+            self.wait_until_ready('DOM就绪')
+        self.driver.get('about:blank')
+        self.log(f"✓ 浏览器缓存预热完成: {len(warmup_urls)} 个课件，用时 {time.time() - start:.1f}秒")
+
+    def load_lesson_index(self):
+        """加载课件时长索引（课件目录默认为脚本所在目录）"""
+        lesson_dir = Path(self.config.get("时长索引", {}).get("课件目录") or Path(__file__).parent)
+        try:
+            index = LessonDurationIndex(lesson_dir, lesson_dir / "课程时长索引.json", self.config)
+            index.load()
+            self.log(f"✓ 已加载课件时长索引: {len(index.entries)} 个课件")
+            return index
+        except Exception as e:
+            self.log(f"⚠ 课件时长索引不可用，使用统一最大时长: {e}")
+            return None
+
+    def lesson_max_duration(self, url, cap=600):
+        """按课件预计时长计算最大录制时长（不超过全局上限）"""
+        if not self.lesson_index:
+            return cap
+        lesson_name = lesson_name_from_url(url)
+        expected = self.lesson_index.expected_duration(lesson_name)
+        if expected is None:
+            return cap
+        lesson_max = self.lesson_index.max_duration_for(lesson_name, cap)
+        self.log(f"预计播放时长 {expected:.0f}秒，最大录制时长 {lesson_max}秒")
+        return lesson_max
+
+    def order_pending(self, urls, start_index=0):
+        """待录制列表 [(序号, URL)]：跳过已完成的课件，按配置使用最长优先顺序"""
+        journal = self.get_journal()
+        if journal.entries:
+            self.log(f"上次运行记录: {journal.describe()}")
+
+        pending = []
+        for i, url in list(enumerate(urls))[start_index:]:
+            lesson = lesson_name_from_url(url)
+            if self.is_up_to_date(url):
+                entry = journal.entry(lesson)
+                if self.incremental_enabled() and (entry is None or '内容哈希' not in entry):
+                    journal.record(lesson, VERIFIED, 原因="已有文件", 内容哈希=self.get_manifest().content_hash(lesson))
+                continue
+            state = journal.state(lesson)
+            if state == VERIFIED:
+                self.log(f"课件内容或录制配置已修改，将重新录制: {lesson}")
+            elif state in (LOADING, RECORDING):
+                self.log(f"上次中断的课件将重新录制: {lesson}")
+            if state != FINALISING:
+                journal.record(lesson, QUEUED)
+            pending.append((i, url))
+        done = len(urls) - start_index - len(pending)
+        if done:
+            self.log(f"已完成 {done} 个课件，本次录制剩余 {len(pending)} 个")
+
+        longest_first = self.config.get("时长索引", {}).get("最长优先", True)
+        if self.lesson_index and longest_first:
+            order = {url: n for n, url in enumerate(self.lesson_index.sort_longest_first([url for _, url in pending]))}
+            pending.sort(key=lambda item: order[item[1]])
+            self.log("已按预计时长从长到短排序（最长优先）")
+        return pending
+
+    def log_eta(self, remaining_urls):
+        """根据时长索引输出剩余时间估算"""
+        if not self.lesson_index or not remaining_urls:
+            return
+        overhead = self.config.get("时长索引", {}).get("每课额外开销_秒", 30)
+        remaining = self.lesson_index.estimate_remaining(remaining_urls, overhead)
+        self.log(f"剩余 {len(remaining_urls)} 个课件，预计还需 {remaining / 60:.1f} 分钟")
+
     def record_all(self, start_index=0, max_duration=600):
         """录制所有URL"""
+        prepared = self.prepare_run(start_index, max_duration)
+        if prepared is None:
+            return
+        pending, total = prepared
+        
+        try:
+            self.record_batch(pending, total, max_duration)
+
+            # 录制失败或质量检查未通过的课件自动重新录制
+            retries = self.config.get("高级选项", {}).get("错误重试次数", 3)
+            for attempt in range(1, retries + 1):
+                self.wait_background_jobs()
+                failed = self.failed_lessons(pending)
+                if not failed:
+                    break
+                self.log(f"\n{len(failed)} 个课件录制失败或质量检查未通过，第 {attempt}/{retries} 次重新录制")
+                self.record_batch(failed, total, max_duration)
+        
+        finally:
+            self.finish_run(pending)
+
+    def prepare_run(self, start_index=0, max_duration=600):
+        """读取URL、启动课件服务、加载时长索引、准备音频设备和浏览器；
+        返回 (待录制列表, URL总数)，音频设备不可用时返回None"""
         urls = self.read_urls()
         total = len(urls)
         
         self.log(f"共找到 {total} 个URL")
         self.log(f"从第 {start_index + 1} 个开始录制")
         self.log(f"每个视频最大录制时长: {max_duration}秒")
-        
-        self.setup_browser()
-        
-        success_count = 0
-        fail_count = 0
-        skip_count = 0
-        
+
+        tracer = self.get_tracer()
+        with tracer.span('启动课件服务'):
+            urls = self.start_lesson_server(urls)
+        with tracer.span('时长索引'):
+            self.lesson_index = self.load_lesson_index()
+        pending = self.order_pending(urls, start_index)
+        self.log_eta([url for _, url in pending])
+
+        if self.config.get("录制配置", {}).get("录制引擎", "桌面") == "虚拟时间":
+            self.virtual_time_engine = VirtualTimeCaptureEngine(self)
+            with tracer.span('启动浏览器'):
+                self.virtual_time_engine.setup_browser()
+        else:
+            # 音频设备缺失时在加载任何课件之前失败（页面内采集不需要音频设备）
+            try:
+                with tracer.span('准备音频设备'):
+                    if not self.page_capture_enabled():
+                        self.prepare_audio_device()
+            except AudioDeviceError as e:
+                self.log(f"✗ {e}")
+                self.stop_lesson_server()
+                tracer.close()
+                return None
+            with tracer.span('启动浏览器'):
+                self.setup_browser()
+            with tracer.span('预热缓存'):
+                self.warm_browser_cache([url for _, url in pending])
+        return pending, total
+
+    def finish_run(self, pending):
+        """关闭浏览器和课件服务，等待后台任务结束，输出本次统计"""
+        tracer = self.get_tracer()
+        if self.watchdog:
+            self.watchdog.stop()
+            self.watchdog = None
         try:
-            for i, url in enumerate(urls[start_index:], start=start_index):
-                result = self.record_single_url(url, i + 1, total, max_duration)
-                
-                if result:
-                    success_count += 1
-                else:
-                    fail_count += 1
-                
-                if i < total - 1:
-                    self.log("等待5秒后继续下一个...")
-                    time.sleep(5)
-        
-        finally:
             if self.driver:
                 self.driver.quit()
+        finally:
+            self.driver = None
+            self.stop_lesson_server()
+        with tracer.span('等待后台任务'):
+            self.close_background_jobs()
+        tracer.close()
+
+        counts = self.lesson_state_counts(pending)
+        self.log(f"\n{'='*60}")
+        self.log(f"录制完成！")
+        self.log(f"成功: {counts.get(VERIFIED, 0)}, 失败: {counts.get(FAILED, 0)}")
+        self.log(f"输出目录: {self.output_dir.absolute()}")
+        self.log(f"{'='*60}")
+
+    def record_batch(self, pending, total, max_duration):
+        """依次录制 [(序号, URL)]"""
+        for n, (i, url) in enumerate(pending):
+            self.next_url = next(
+                (next_url for _, next_url in pending[n + 1:] if not self.is_up_to_date(next_url)),
+                None
+            )
+            lesson_max = self.lesson_max_duration(url, max_duration)
+            self.record_single_url(url, i + 1, total, lesson_max)
+
+            self.log_eta([url for _, url in pending[n + 1:]])
             
-            self.log(f"\n{'='*60}")
-            self.log(f"录制完成！")
-            self.log(f"成功: {success_count}, 失败: {fail_count}")
-            self.log(f"输出目录: {self.output_dir.absolute()}")
-            self.log(f"{'='*60}")
+            interval = self.config.get("高级选项", {}).get("录制间隔等待_秒", 0)
+            if n < len(pending) - 1 and interval > 0:
+                self.log(f"等待{interval}秒后继续下一个...")
+                time.sleep(interval)
+
+    def failed_lessons(self, pending):
+        """运行记录中状态为失败的课件"""
+        journal = self.get_journal()
+        return [(i, url) for i, url in pending if journal.state(lesson_name_from_url(url)) == FAILED]
+
+    def lesson_state_counts(self, pending):
+        """本次课件的最终状态统计"""
+        journal = self.get_journal()
+        counts = {}
+        for _, url in pending:
+            state = journal.state(lesson_name_from_url(url))
+            counts[state] = counts.get(state, 0) + 1
+        return counts
     
     def cleanup(self):
         """清理资源"""
         self.stop_ffmpeg_recording()
+        if self.watchdog:
+            self.watchdog.stop()
+            self.watchdog = None
         if self.driver:
             self.driver.quit()
+        self.stop_lesson_server()
+
+
+class VirtualTimeCaptureEngine:
+    """虚拟时间录制引擎（无头Chrome + CDP逐帧截图 → FFmpeg标准输入）
+
+    页面时钟由 Emulation.setVirtualTimePolicy 逐帧推进，每推进一帧截一张图，
+    以 image2pipe 原始帧流写入FFmpeg。渲染与宿主负载、遮挡窗口无关，
+    动画较多的d3课件可以在无头服务器上以快于实时的速度确定性地渲染。
+
+    注意：虚拟人语音来自远端WebRTC流，不随虚拟时间加速，因此本引擎按
+    课件的每页时长（getSlideDuration() 或 autoPlayDurations）静默翻页，只输出画面（无音轨）；
+    课件没有可用的翻页函数时这一课失败。
+    """
+
+    def __init__(self, recorder):
+        self.recorder = recorder
+        engine_config = recorder.config.get("虚拟时间录制", {})
+        browser_config = recorder.config.get("浏览器配置", {})
+        self.width = browser_config.get("窗口宽度", 1920)
+        self.height = browser_config.get("窗口高度", 1080)
+        # 帧率和编码设置在每个课件开始时从 recorder.ffmpeg_settings() 读取（本机编码校准结果、资源调节）
+        self.fps = recorder.ffmpeg_settings().get("帧率", 30)
+        self.jpeg_quality = engine_config.get("截图质量", 90)
+        self.default_slide_ms = engine_config.get("默认每页时长_毫秒", 20000)
+        self.page_load_timeout = engine_config.get("页面加载超时_秒", 30)
+
+    def setup_browser(self):
+        """启动无头Chrome"""
+        chrome_options = Options()
+        chrome_options.add_argument("--headless=new")
+        chrome_options.add_argument("--no-sandbox")
+        chrome_options.add_argument("--disable-dev-shm-usage")
+        chrome_options.add_argument("--hide-scrollbars")
+        chrome_options.add_argument("--mute-audio")
+        chrome_options.add_argument("--run-all-compositor-stages-before-draw")
+        chrome_options.add_argument(f"--window-size={self.width},{self.height}")
+
+        self.recorder.driver = webdriver.Chrome(options=chrome_options)
+        self.recorder.log(f"✓ 虚拟时间引擎：无头Chrome {self.width}x{self.height}@{self.fps}fps")
+
+    def open_fresh_tab(self):
+        """每个课件使用新标签页：虚拟时间策略绑定在页面上，无法恢复为实时"""
+        driver = self.recorder.driver
+        old_handle = driver.current_window_handle
+        driver.switch_to.new_window('tab')
+        new_handle = driver.current_window_handle
+        driver.switch_to.window(old_handle)
+        driver.close()
+        driver.switch_to.window(new_handle)
+        self._cdp("Emulation.setDeviceMetricsOverride", {
+            "width": self.width,
+            "height": self.height,
+            "deviceScaleFactor": 1,
+            "mobile": False
+        })
+
+    def _cdp(self, method, params=None):
+        return self.recorder.driver.execute_cdp_cmd(method, params or {})
+
+    def _evaluate(self, expression, await_promise=False):
+        result = self._cdp("Runtime.evaluate", {
+            "expression": expression,
+            "awaitPromise": await_promise,
+            "returnByValue": True
+        })
+        return result.get("result", {}).get("value")
+
+    def advance(self, budget_ms):
+        """推进虚拟时间 budget_ms 毫秒，返回时页面定时器和动画已执行到新的时间点"""
+        # 先在暂停状态下登记一个恰好在预算末尾触发的定时器，再放行虚拟时间并等待它
+        self._evaluate(f"window.__virtualTick = new Promise(r => setTimeout(r, {budget_ms}));")
+        self._cdp("Emulation.setVirtualTimePolicy", {"policy": "advance", "budget": budget_ms})
+        self._evaluate("window.__virtualTick", await_promise=True)
+
+    def capture_frame(self):
+        """截取当前视口，返回JPEG字节"""
+        result = self._cdp("Page.captureScreenshot", {
+            "format": "jpeg",
+            "quality": self.jpeg_quality,
+            "fromSurface": True
+        })
+        return base64.b64decode(result["data"])
+
+    def get_slide_plan(self):
+        """读取页面自带的页数和每页时长（getSlideDuration 或 autoPlayDurations，都没有时用默认时长）"""
+        durations = self._evaluate("(() => {" + SLIDE_NAVIGATION_JS + f"""
+            const total = slideCount();
+            if (!isFinite(total) || total < 1) return null;
+            const durations = [];
+            for (let n = 1; n <= total; n++) {{
+                if (typeof getSlideDuration === 'function') {{
+                    durations.push(getSlideDuration(n));
+                }} else if (typeof autoPlayDurations !== 'undefined' && autoPlayDurations[n]) {{
+                    durations.push(autoPlayDurations[n]);
+                }} else {{
+                    durations.push({self.default_slide_ms});
+                }}
+            }}
+            return durations;
+        }})()""")
+        if not durations:
+            raise RuntimeError("无法确定课件页数")
+        return durations
+
+    def show_slide(self, slide_num):
+        """静默切换到第 slide_num 页（不触发虚拟人讲解）"""
+        if not self._evaluate("(() => {" + SLIDE_NAVIGATION_JS + f"return goToSlide({slide_num}); }})()"):
+            raise RuntimeError("课件没有可用的翻页函数，无法用虚拟时间引擎录制")
+
+    def start_ffmpeg(self, output_file, ffmpeg_config):
+        """启动从标准输入读取JPEG帧流的FFmpeg，返回 (进程, 进度监控)"""
+        threads = ffmpeg_config.get("编码线程数", 0)
+        cmd = [
+            get_ffmpeg_path(),
+            '-f', 'image2pipe',
+            '-framerate', str(self.fps),
+            '-c:v', 'mjpeg',
+            '-i', '-',
+        ] + scale_args(ffmpeg_config) + [
+            '-c:v', 'libx264',
+            '-preset', ffmpeg_config.get("编码预设", "medium"),
+            '-crf', str(ffmpeg_config.get("视频质量_CRF", 23)),
+            '-g', str(keyframe_interval_frames(ffmpeg_config)),
+        ] + (['-threads', str(threads)] if threads else []) + [
+            '-pix_fmt', 'yuv420p',
+            '-an',
+        ] + progress_args() + [
+            '-y',
+            str(output_file)
+        ]
+        self.recorder.log(f"FFmpeg命令: {' '.join(cmd)}")
+        process = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            creationflags=getattr(subprocess, 'CREATE_NO_WINDOW', 0)
+        )
+        # 持续读取stdout/stderr，管道不会写满；FFmpeg出错时日志中有stderr最后几行
+        return process, FFmpegProgressMonitor(process, self.recorder.log, self.recorder.config).start()
+
+    def record(self, url, output_file, max_duration=600):
+        """以虚拟时间渲染一个课件"""
+        recorder = self.recorder
+        ffmpeg_process = None
+        monitor = None
+        try:
+            ffmpeg_config = recorder.ffmpeg_settings()
+            self.fps = ffmpeg_config.get("帧率", 30)
+            recorder.log("正在加载网页（虚拟时间引擎）...")
+            self.open_fresh_tab()
+            recorder.driver.get(url)
+            WebDriverWait(recorder.driver, self.page_load_timeout).until(
+                lambda d: d.execute_script("return document.readyState") == "complete"
+            )
+
+            durations = self.get_slide_plan()
+            frame_ms = 1000.0 / self.fps
+            max_frames = int(max_duration * self.fps)
+            recorder.log(f"共 {len(durations)} 页，预计时长 {sum(durations) / 1000:.0f}秒（虚拟时间）")
+
+            self._cdp("Emulation.setVirtualTimePolicy", {"policy": "pause"})
+            ffmpeg_process, monitor = self.start_ffmpeg(output_file, ffmpeg_config)
+            start_time = time.time()
+            frames = 0
+
+            for slide_num, duration_ms in enumerate(durations, start=1):
+                self.show_slide(slide_num)
+                for _ in range(int(duration_ms / frame_ms)):
+                    if frames >= max_frames:
+                        break
+                    self.advance(frame_ms)
+                    ffmpeg_process.stdin.write(self.capture_frame())
+                    frames += 1
+                recorder.log(f"已渲染第 {slide_num} 页，累计 {frames} 帧")
+
+            ffmpeg_process.stdin.close()
+            returncode = ffmpeg_process.wait()
+            ffmpeg_process = None
+            monitor.stop()
+            if returncode != 0:
+                recorder.log(f"✗ 录制失败: FFmpeg异常退出（退出码 {returncode}{self.ffmpeg_error(monitor)}）")
+                return False
+
+            wall = time.time() - start_time
+            video_seconds = frames / self.fps
+            speed = video_seconds / wall if wall > 0 else 0
+            recorder.log(f"虚拟时间渲染完成: 视频 {video_seconds:.1f}秒，耗时 {wall:.1f}秒（{speed:.2f}x实时）")
+
+            if output_file.exists():
+                file_size = output_file.stat().st_size / (1024 * 1024)
+                recorder.log(f"✓ 录制完成: {output_file.name} ({file_size:.2f} MB)")
+                return True
+            recorder.log("✗ 录制失败: 文件未生成")
+            return False
+
+        except Exception as e:
+            if ffmpeg_process:
+                # FFmpeg已退出时写入帧会得到BrokenPipeError，原因在FFmpeg的stderr中
+                ffmpeg_process.kill()
+                ffmpeg_process.wait()
+                ffmpeg_process = None
+                monitor.stop()
+            recorder.log(f"✗ 虚拟时间录制失败: {e}{self.ffmpeg_error(monitor) if monitor else ''}")
+            return False
+
+        finally:
+            if ffmpeg_process:
+                ffmpeg_process.kill()
+
+    @staticmethod
+    def ffmpeg_error(monitor):
+        """FFmpeg stderr 的最后一行（附在失败原因后面）"""
+        return f"；FFmpeg: {monitor.stderr_tail[-1]}" if monitor.stderr_tail else ""
 
 
 def load_config():
@@ -530,10 +2007,14 @@ if __name__ == "__main__":
     print(f"  起始索引: {START_INDEX}")
     print()
 
-    recorder = SmartCoursewareRecorder(URL_FILE, OUTPUT_DIR)
+    recorder = SmartCoursewareRecorder(URL_FILE, OUTPUT_DIR, config=config)
 
     try:
-        recorder.record_all(start_index=START_INDEX, max_duration=MAX_DURATION)
+        if (config or {}).get("异步编排", {}).get("启用", False):
+            # Ctrl-C 由编排器处理：取消录制任务，停止FFmpeg并关闭浏览器后返回
+            AsyncRecordingOrchestrator(recorder).run(start_index=START_INDEX, max_duration=MAX_DURATION)
+        else:
+            recorder.record_all(start_index=START_INDEX, max_duration=MAX_DURATION)
     except KeyboardInterrupt:
         print("\n用户中断录制")
         recorder.cleanup()
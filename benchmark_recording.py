@@ -0,0 +1,313 @@
+"""
+录制流水线离线基准测试（Linux）
+功能：
+1. 本地课件服务提供仓库中的课件，虚拟人SDK替换为桩实现（按讲稿字数和加速倍数触发 frame_stop），
+   不访问任何外网服务
+2. 在Xvfb虚拟显示器上运行完整录制流程（预加载、就绪等待、事件钩子、FFmpeg x11grab），
+   音频输入使用 lavfi 静音源，不需要声卡
+3. 测量每个课件的额外开销、整体吞吐（课件/小时）、Chrome与FFmpeg的CPU和内存、采集帧率稳定性
+4. 结果写入 基准测试结果/*.json（包含提交号），可用 --compare 与之前的结果对比
+
+用法：
+    python benchmark_recording.py                     # 默认录制前3个课件，讲解加速10倍
+    python benchmark_recording.py --lessons 5 --speedup 20
+    python benchmark_recording.py --compare 基准测试结果/bench_abc1234_20250101_200000.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import psutil
+
+from auto_record_smart import SmartCoursewareRecorder, load_config
+from lesson_index import LESSON_PATTERN
+from local_lesson_server import LocalLessonServer
+from parallel_recorder import VirtualDisplay
+from tracing import percentile
+
+SDK_MODULE = "avatar-sdk-web_3.1.2.1002/index.js"
+
+# 虚拟人SDK桩：接口与课件用到的部分一致，讲解时长按字数/朗读速度/加速倍数计算
+STUB_SDK_TEMPLATE = """
+const SPEEDUP = %(speedup)s;
+const CHARS_PER_SECOND = %(chars_per_second)s;
+
+export default class AvatarPlatform {
+    constructor() { this.handlers = {}; this.speaking = null; }
+    static getVersion() { return 'benchmark-stub'; }
+    on(name, handler) { (this.handlers[name] = this.handlers[name] || []).push(handler); return this; }
+    once(name, handler) {
+        const wrapper = (data) => { this.off(name, wrapper); handler(data); };
+        return this.on(name, wrapper);
+    }
+    off(name, handler) {
+        this.handlers[name] = (this.handlers[name] || []).filter((h) => h !== handler);
+        return this;
+    }
+    emit(name, data) { (this.handlers[name] || []).slice().forEach((h) => h(data)); }
+    setApiInfo() { return this; }
+    setGlobalParams() { return this; }
+    async start() { setTimeout(() => this.emit('connected', { stub: true }), 200); }
+    async writeText(text) {
+        clearTimeout(this.speaking);
+        const ms = String(text).length / CHARS_PER_SECOND * 1000 / SPEEDUP;
+        this.speaking = setTimeout(() => this.emit('frame_stop', { stub: true }), ms);
+    }
+    async writeCmd() {}
+    async stop() { clearTimeout(this.speaking); }
+    destroy() { clearTimeout(this.speaking); this.handlers = {}; }
+}
+
+export const SDKEvents = {};
+export const PlayerEvents = {};
+export const RecorderEvents = {};
+export const UserMedia = {};
+"""
+
+SILENT_AUDIO_ARGS = ['-f', 'lavfi', '-i', 'anullsrc=r=48000:cl=stereo']
+
+
+class ResourceSampler(threading.Thread):
+    """每秒采样一次Chrome（chromedriver的所有子进程）和FFmpeg的CPU与内存"""
+
+    def __init__(self, recorder, interval=1.0):
+        super().__init__(name="资源采样", daemon=True)
+        self.recorder = recorder
+        self.interval = interval
+        self.lesson = None
+        self.samples = []
+        self.processes = {}
+        self.stopped = threading.Event()
+
+    def _process(self, pid):
+        # 同一个Process对象连续调用 cpu_percent 才能得到区间内的CPU占用
+        if pid not in self.processes:
+            self.processes[pid] = psutil.Process(pid)
+            self.processes[pid].cpu_percent(None)
+        return self.processes[pid]
+
+    def _usage(self, pids):
+        cpu = rss = 0.0
+        for pid in pids:
+            try:
+                process = self._process(pid)
+                cpu += process.cpu_percent(None)
+                rss += process.memory_info().rss
+            except psutil.Error:
+                self.processes.pop(pid, None)
+        return cpu, rss / (1024 * 1024)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            driver = self.recorder.driver
+            chrome_pids = []
+            try:
+                if driver and driver.service.process:
+                    chrome_pids = [p.pid for p in psutil.Process(driver.service.process.pid).children(recursive=True)]
+            except psutil.Error:
+                pass
+            ffmpeg = self.recorder.ffmpeg_process
+            chrome_cpu, chrome_rss = self._usage(chrome_pids)
+            ffmpeg_cpu, ffmpeg_rss = self._usage([ffmpeg.pid] if ffmpeg else [])
+            self.samples.append({
+                '课件': self.lesson,
+                'chrome_cpu': chrome_cpu, 'chrome_rss_mb': chrome_rss,
+                'ffmpeg_cpu': ffmpeg_cpu if ffmpeg else None, 'ffmpeg_rss_mb': ffmpeg_rss if ffmpeg else None,
+            })
+
+    def usage_for(self, lesson):
+        """课件期间的平均/峰值CPU（%）和峰值内存（MB）"""
+        samples = [s for s in self.samples if s['课件'] == lesson]
+        result = {}
+        for name in ('chrome', 'ffmpeg'):
+            cpu = [s[f'{name}_cpu'] for s in samples if s[f'{name}_cpu'] is not None]
+            rss = [s[f'{name}_rss_mb'] for s in samples if s[f'{name}_rss_mb'] is not None]
+            result[f'{name}_CPU平均_%'] = round(sum(cpu) / len(cpu), 1) if cpu else None
+            result[f'{name}_CPU峰值_%'] = round(max(cpu), 1) if cpu else None
+            result[f'{name}_内存峰值_MB'] = round(max(rss), 1) if rss else None
+        return result
+
+
+def git_revision():
+    """当前提交号（工作区有修改时加 -dirty）"""
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                               capture_output=True, text=True).stdout.strip()
+        return (revision or 'unknown') + ('-dirty' if dirty else '')
+    except FileNotFoundError:
+        return 'unknown'
+
+
+def benchmark_config(base_config, work_dir):
+    """基准测试使用的配置：关闭后台检查/转码，使用独立的浏览器缓存，避免影响正式录制；
+    关闭资源调节、进程看护和本机编码校准结果，不同提交、不同主机的结果才可以对比"""
+    config = json.loads(json.dumps(base_config or {}))
+    config.setdefault("本地课件服务", {})["浏览器缓存目录"] = str(work_dir / "chrome_cache")
+    config.setdefault("质量检查", {})["启用"] = False
+    config.setdefault("首尾裁剪", {})["启用"] = False
+    config.setdefault("两段式录制", {})["启用"] = False
+    config.setdefault("高级选项", {})["错误重试次数"] = 0
+    config.setdefault("资源调节", {})["启用"] = False
+    config.setdefault("进程看护", {})["启用"] = False
+    config.setdefault("编码校准", {})["使用主机配置"] = False
+    return config
+
+
+def run_benchmark(lesson_names, speedup, display_number, base_config):
+    root = Path(__file__).parent
+    work_dir = Path(tempfile.mkdtemp(prefix="录制基准测试_"))
+    config = benchmark_config(base_config, work_dir)
+    browser_config = config.get("浏览器配置", {})
+    chars_per_second = config.get("时长索引", {}).get("朗读速度_字每秒", 4.0)
+
+    stub = STUB_SDK_TEMPLATE % {'speedup': speedup, 'chars_per_second': chars_per_second}
+    server = LocalLessonServer(root, port=0, overrides={SDK_MODULE: stub.encode('utf-8')}).start()
+    display = VirtualDisplay(display_number, browser_config.get("窗口宽度", 1920), browser_config.get("窗口高度", 1080))
+    urls = [server.base_url + name for name in lesson_names]
+
+    recorder = None
+    sampler = None
+    lessons = []
+    ffmpeg_settings = None
+    try:
+        recorder = SmartCoursewareRecorder("", work_dir / "录制视频", config=config,
+                                           display=display.start(), worker_name="基准")
+        recorder.audio_input_args = SILENT_AUDIO_ARGS
+        recorder.lesson_index = recorder.load_lesson_index()
+        ffmpeg_settings = recorder.ffmpeg_settings()
+
+        setup_start = time.time()
+        recorder.setup_browser()
+        recorder.lesson_server = server
+        try:
+            recorder.warm_browser_cache(urls)
+        finally:
+            recorder.lesson_server = None
+        setup_seconds = time.time() - setup_start
+
+        sampler = ResourceSampler(recorder)
+        sampler.start()
+        batch_start = time.time()
+        for n, url in enumerate(urls):
+            name = lesson_names[n]
+            recorder.next_url = urls[n + 1] if n + 1 < len(urls) else None
+            sampler.lesson = name
+            start = time.time()
+            result = recorder.record_single_url(url, n + 1, len(urls), recorder.lesson_max_duration(url, 600))
+            wall = time.time() - start
+            sampler.lesson = None
+
+            stats = recorder.last_capture_stats or {}
+            media = stats.get('媒体时长_秒')
+            lessons.append({
+                '课件': name,
+                '结果': result,
+                '总耗时_秒': round(wall, 2),
+                '媒体时长_秒': media,
+                '额外开销_秒': round(wall - media, 2) if media else None,
+                '就绪等待_秒': round(sum(recorder.phase_waits.values()), 2),
+                '帧率均值': stats.get('帧率均值'),
+                '帧率标准差': stats.get('帧率标准差'),
+                '丢帧': stats.get('丢帧'),
+                '重复帧': stats.get('重复帧'),
+                '平均倍率': stats.get('平均倍率'),
+                **sampler.usage_for(name),
+            })
+        batch_seconds = time.time() - batch_start
+    finally:
+        if sampler:
+            sampler.stopped.set()
+        if recorder:
+            recorder.cleanup()
+            recorder.get_tracer().close()
+        display.stop()
+        server.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    overheads = [lesson['额外开销_秒'] for lesson in lessons if lesson['额外开销_秒'] is not None]
+    fps_deviation = [lesson['帧率标准差'] for lesson in lessons if lesson['帧率标准差'] is not None]
+    return {
+        '提交': git_revision(),
+        '时间': datetime.now().isoformat(timespec='seconds'),
+        '主机': {
+            '平台': platform.platform(),
+            'CPU核数': os.cpu_count(),
+            'Python': platform.python_version(),
+        },
+        '参数': {'课件': lesson_names, '讲解加速倍数': speedup, 'FFmpeg设置': ffmpeg_settings},
+        '汇总': {
+            '课件数': len(lessons),
+            '成功数': sum(1 for lesson in lessons if lesson['结果']),
+            '浏览器启动与预热_秒': round(setup_seconds, 2),
+            '批次耗时_秒': round(batch_seconds, 2),
+            '吞吐_课件每小时': round(len(lessons) / batch_seconds * 3600, 1) if batch_seconds else None,
+            '额外开销p50_秒': round(percentile(overheads, 50), 2) if overheads else None,
+            '额外开销p95_秒': round(percentile(overheads, 95), 2) if overheads else None,
+            '帧率标准差均值': round(sum(fps_deviation) / len(fps_deviation), 3) if fps_deviation else None,
+            '丢帧合计': sum(lesson['丢帧'] or 0 for lesson in lessons),
+        },
+        '课件': lessons,
+    }
+
+
+def compare(baseline, current):
+    """逐项对比两次结果的汇总指标"""
+    print(f"\n对比基准: {baseline['提交']}（{baseline['时间']}） → {current['提交']}（{current['时间']}）")
+    print(f"{'指标':<20} {'基准':>12} {'本次':>12} {'变化':>10}")
+    print("-" * 58)
+    for key, value in current['汇总'].items():
+        old = baseline.get('汇总', {}).get(key)
+        if isinstance(value, (int, float)) and isinstance(old, (int, float)) and old:
+            change = f"{(value - old) / old * 100:+.1f}%"
+        else:
+            change = ""
+        print(f"{key:<20} {str(old):>12} {str(value):>12} {change:>10}")
+
+
+if __name__ == "__main__":
+    if not sys.platform.startswith('linux'):
+        print("✗ 基准测试需要Linux（Xvfb虚拟显示器）")
+        sys.exit(1)
+
+    parser = argparse.ArgumentParser(description="录制流水线离线基准测试")
+    parser.add_argument('--lessons', type=int, default=3, help="录制的课件数量（按文件名顺序）")
+    parser.add_argument('--speedup', type=float, default=10, help="桩SDK的讲解加速倍数")
+    parser.add_argument('--display', type=int, default=120, help="Xvfb显示编号")
+    parser.add_argument('--output', default="基准测试结果", help="结果目录")
+    parser.add_argument('--compare', help="与之前的结果文件对比")
+    args = parser.parse_args()
+
+    names = sorted(p.name for p in Path(__file__).parent.iterdir() if LESSON_PATTERN.match(p.name))[:args.lessons]
+    results = run_benchmark(names, args.speedup, args.display, load_config())
+
+    output_dir = Path(args.output)
+    output_dir.mkdir(exist_ok=True)
+    result_file = output_dir / f"bench_{results['提交']}_{datetime.now():%Y%m%d_%H%M%S}.json"
+    with open(result_file, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+
+    print(f"\n{'课件':<36} {'耗时':>7} {'开销':>6} {'帧率σ':>6} {'丢帧':>5} {'Chrome CPU':>10} {'FFmpeg CPU':>10}")
+    print("-" * 90)
+    for lesson in results['课件']:
+        print(f"{lesson['课件']:<36} {lesson['总耗时_秒']:>7} {str(lesson['额外开销_秒']):>6} "
+              f"{str(lesson['帧率标准差']):>6} {str(lesson['丢帧']):>5} "
+              f"{str(lesson['chrome_CPU平均_%']):>10} {str(lesson['ffmpeg_CPU平均_%']):>10}")
+    print("-" * 90)
+    for key, value in results['汇总'].items():
+        print(f"{key}: {value}")
+    print(f"\n结果已保存: {result_file}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare(json.load(f), results)
@@ -0,0 +1,251 @@
+"""
+编码校准
+功能：
+1. 用一段实际录制的课件视频（默认取输出目录中最新的成片）依次试编码所有候选组合：
+   编码预设 × CRF × 帧率 × 输出宽度 × 编码线程数
+2. 每个组合测量编码倍率（媒体时长 / 墙钟时间）、CPU占用（FFmpeg -benchmark 的用户态+内核态时间）和输出大小（MB/分钟）
+3. 在编码倍率不低于目标实时倍率（默认1.2，给抓屏和浏览器留出余量）的组合中选出画质最好的一个：
+   帧率、分辨率优先，其次CRF越小、预设越慢越好（同样画质文件更小），最后CPU占用越低越好
+4. 结果写入本机的主机配置 host_profiles/<主机名>.json，录制时叠加在 config.json 的 FFmpeg配置 之上
+   （编码预设、视频质量_CRF、帧率、输出宽度、编码线程数）
+
+用法：
+    python encoder_calibration.py                                # 校准并写入本机主机配置
+    python encoder_calibration.py --clip 录制视频/01_1.1_xxx.mp4 --seconds 30
+    python encoder_calibration.py --show                         # 查看本机主机配置
+"""
+
+import argparse
+import itertools
+import json
+import os
+import re
+import socket
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+from resource_governor import PRESETS
+
+# FFmpeg -benchmark 在结束时输出：bench: utime=1.234s stime=0.056s rtime=0.789s
+_BENCH_PATTERN = re.compile(r'utime=([\d.]+)s\s+stime=([\d.]+)s\s+rtime=([\d.]+)s')
+
+# 主机配置中可以覆盖的 FFmpeg配置 项
+PROFILE_KEYS = ("编码预设", "视频质量_CRF", "帧率", "输出宽度", "编码线程数")
+
+
+def host_profile_path(config, host=None):
+    """本机主机配置文件：主机配置目录/<主机名>.json"""
+    directory = config.get("编码校准", {}).get("主机配置目录", "host_profiles")
+    return Path(directory) / f"{host or socket.gethostname()}.json"
+
+
+def load_host_profile(config):
+    """本机的编码校准结果（FFmpeg配置 覆盖项）；没有校准过或已关闭时返回{}"""
+    if not config.get("编码校准", {}).get("使用主机配置", True):
+        return {}
+    path = host_profile_path(config)
+    if not path.exists():
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        profile = json.load(f).get("FFmpeg配置", {})
+    return {key: value for key, value in profile.items() if key in PROFILE_KEYS}
+
+
+class EncoderCalibration:
+    """对一段课件视频试编码所有候选组合，选出本机能稳定快于实时的最好设置"""
+
+    def __init__(self, ffmpeg_path, config=None, log=print):
+        config = config or {}
+        calibration_config = config.get("编码校准", {})
+        ffmpeg_config = config.get("FFmpeg配置", {})
+        self.ffmpeg_path = ffmpeg_path
+        self.config = config
+        self.log = log
+        self.video_codec = ffmpeg_config.get("视频编码器", "libx264")
+        self.audio_codec = ffmpeg_config.get("音频编码器", "aac")
+        self.audio_bitrate = ffmpeg_config.get("音频比特率", "192k")
+        self.keyframe_seconds = ffmpeg_config.get("关键帧间隔_秒", 2)
+        self.target_speed = calibration_config.get("目标实时倍率", 1.2)
+        self.presets = calibration_config.get("候选编码预设", ["ultrafast", "superfast", "veryfast", "faster", "fast", "medium"])
+        self.crfs = calibration_config.get("候选CRF", [23, 26])
+        self.frame_rates = calibration_config.get("候选帧率", [30, 25])
+        self.widths = calibration_config.get("候选输出宽度", [0, 1600])
+        self.thread_counts = calibration_config.get("候选编码线程数", [0, 2])
+
+    def candidates(self):
+        for preset, crf, fps, width, threads in itertools.product(
+                self.presets, self.crfs, self.frame_rates, self.widths, self.thread_counts):
+            yield {'编码预设': preset, '视频质量_CRF': crf, '帧率': fps, '输出宽度': width, '编码线程数': threads}
+
+    def build_command(self, clip, seconds, candidate, output):
+        cmd = [
+            self.ffmpeg_path, '-hide_banner', '-loglevel', 'error', '-benchmark',
+            '-t', str(seconds), '-i', str(clip),
+            '-map', '0:v:0', '-map', '0:a?',
+        ]
+        if candidate['输出宽度']:
+            cmd += ['-vf', f"scale={candidate['输出宽度']}:-2"]
+        cmd += [
+            '-r', str(candidate['帧率']),
+            '-c:v', self.video_codec,
+            '-preset', candidate['编码预设'],
+            '-crf', str(candidate['视频质量_CRF']),
+            '-g', str(max(1, int(candidate['帧率'] * self.keyframe_seconds))),
+            '-pix_fmt', 'yuv420p',
+            '-c:a', self.audio_codec,
+            '-b:a', self.audio_bitrate,
+        ]
+        if candidate['编码线程数']:
+            cmd += ['-threads', str(candidate['编码线程数'])]
+        return cmd + ['-y', str(output)]
+
+    def measure(self, clip, seconds, media_seconds, candidate, output):
+        """试编码一个组合，返回带测量值的结果；失败时返回None"""
+        start = time.time()
+        result = subprocess.run(
+            self.build_command(clip, seconds, candidate, output),
+            capture_output=True,
+            text=True,
+            encoding='utf-8',
+            errors='ignore'
+        )
+        wall = time.time() - start
+        if result.returncode != 0 or not output.exists():
+            error = result.stderr.strip().splitlines()[-1:] or ['未知错误']
+            self.log(f"✗ 编码失败: {self.describe(candidate)}（{error[0]}）")
+            return None
+
+        bench = _BENCH_PATTERN.search(result.stderr)
+        cpu_seconds = float(bench.group(1)) + float(bench.group(2)) if bench else None
+        wall = float(bench.group(3)) if bench else wall
+        size_mb = output.stat().st_size / (1024 * 1024)
+        output.unlink()
+        speed = media_seconds / wall if wall > 0 else 0
+        return dict(
+            candidate,
+            编码倍率=round(speed, 2),
+            # 占整台主机CPU的百分比
+            CPU_百分比=round(cpu_seconds / wall / (os.cpu_count() or 1) * 100, 1) if cpu_seconds and wall > 0 else None,
+            MB每分钟=round(size_mb / media_seconds * 60, 2),
+            达标=speed >= self.target_speed,
+        )
+
+    @staticmethod
+    def describe(candidate):
+        width = candidate['输出宽度'] or '原始'
+        threads = candidate['编码线程数'] or '自动'
+        return (f"{candidate['编码预设']} CRF{candidate['视频质量_CRF']} {candidate['帧率']}fps "
+                f"宽度{width} 线程{threads}")
+
+    @staticmethod
+    def quality_key(result):
+        """画质排序键（越大越好）：帧率 > 分辨率 > CRF越小 > 预设越慢 > 文件越小 > CPU越低"""
+        preset_rank = -PRESETS.index(result['编码预设']) if result['编码预设'] in PRESETS else 0
+        return (
+            result['帧率'],
+            result['输出宽度'] or float('inf'),
+            -result['视频质量_CRF'],
+            preset_rank,
+            -result['MB每分钟'],
+            -(result['CPU_百分比'] or 0),
+        )
+
+    def run(self, clip, seconds, media_seconds):
+        """试编码所有组合，返回 (全部结果, 最好的达标组合或None)"""
+        candidates = list(self.candidates())
+        self.log(f"编码校准: {Path(clip).name} 前 {media_seconds:.0f}秒，{len(candidates)} 个组合，"
+                 f"目标 ≥{self.target_speed}x实时")
+        results = []
+        with tempfile.TemporaryDirectory() as work_dir:
+            output = Path(work_dir) / "calibration.mp4"
+            for n, candidate in enumerate(candidates, 1):
+                result = self.measure(clip, seconds, media_seconds, candidate, output)
+                if result is None:
+                    continue
+                results.append(result)
+                self.log(f"[{n}/{len(candidates)}] {self.describe(candidate)}: {result['编码倍率']:.2f}x，"
+                         f"CPU {result['CPU_百分比']}%，{result['MB每分钟']} MB/分钟"
+                         + ("" if result['达标'] else "（未达标）"))
+
+        passing = [r for r in results if r['达标']]
+        best = max(passing, key=self.quality_key) if passing else None
+        return results, best
+
+    def write_profile(self, clip, media_seconds, results, best):
+        path = host_profile_path(self.config)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({
+                '主机': socket.gethostname(),
+                '校准时间': datetime.now().isoformat(timespec='seconds'),
+                '片段': str(clip),
+                '片段时长_秒': round(media_seconds, 1),
+                'CPU核数': os.cpu_count(),
+                '目标实时倍率': self.target_speed,
+                'FFmpeg配置': {key: best[key] for key in PROFILE_KEYS},
+                '结果': results,
+            }, f, ensure_ascii=False, indent=2)
+        return path
+
+
+def find_clip(output_dir):
+    """输出目录中最新的成片（不含录制中的临时文件）"""
+    videos = [p for p in Path(output_dir).glob("*.mp4") if '.partial' not in p.name and '.transcoding' not in p.name]
+    return max(videos, key=lambda p: p.stat().st_mtime) if videos else None
+
+
+def probe_duration(ffmpeg_path, clip):
+    from video_verifier import ffprobe_path_for
+
+    result = subprocess.run(
+        [ffprobe_path_for(ffmpeg_path), '-v', 'error', '-show_entries', 'format=duration', '-of', 'csv=p=0', str(clip)],
+        capture_output=True,
+        text=True
+    )
+    try:
+        return float(result.stdout.strip())
+    except ValueError:
+        raise RuntimeError(f"无法读取视频时长: {clip}")
+
+
+if __name__ == "__main__":
+    from auto_record_smart import get_ffmpeg_path, load_config
+
+    parser = argparse.ArgumentParser(description="编码校准：试编码候选组合，把本机能稳定快于实时的最好设置写入主机配置")
+    parser.add_argument("--clip", help="用于校准的课件视频（默认取输出目录中最新的成片）")
+    parser.add_argument("--seconds", type=float, help="只使用视频的前N秒（默认为 编码校准.片段时长_秒）")
+    parser.add_argument("--show", action="store_true", help="只显示本机主机配置")
+    args = parser.parse_args()
+
+    config = load_config() or {}
+    profile_path = host_profile_path(config)
+    if args.show:
+        if profile_path.exists():
+            print(profile_path.read_text(encoding='utf-8'))
+        else:
+            print(f"本机还没有校准过（{profile_path} 不存在）")
+        raise SystemExit(0)
+
+    ffmpeg_path = get_ffmpeg_path()
+    clip = Path(args.clip) if args.clip else find_clip(config.get("录制配置", {}).get("输出目录", "录制视频"))
+    if clip is None or not clip.exists():
+        raise SystemExit("没有找到用于校准的视频，请先录制一个课件或用 --clip 指定")
+    seconds = args.seconds or config.get("编码校准", {}).get("片段时长_秒", 30)
+    media_seconds = min(seconds, probe_duration(ffmpeg_path, clip))
+
+    calibration = EncoderCalibration(ffmpeg_path, config)
+    results, best = calibration.run(clip, seconds, media_seconds)
+    if best is None:
+        fastest = max(results, key=lambda r: r['编码倍率'], default=None)
+        print(f"\n✗ 没有组合达到 {calibration.target_speed}x实时"
+              + (f"（最快 {calibration.describe(fastest)}: {fastest['编码倍率']:.2f}x）" if fastest else "")
+              + "，未写入主机配置；可以在 编码校准 中加入更快的预设、更低的帧率或分辨率后重试")
+        raise SystemExit(1)
+
+    path = calibration.write_profile(clip, media_seconds, results, best)
+    print(f"\n✓ 最佳组合: {calibration.describe(best)}（{best['编码倍率']:.2f}x实时，CPU {best['CPU_百分比']}%，"
+          f"{best['MB每分钟']} MB/分钟）")
+    print(f"✓ 已写入主机配置: {path}")
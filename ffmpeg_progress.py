@@ -0,0 +1,215 @@
+"""
+FFmpeg录制进度监控
+功能：
+1. 后台线程持续读取FFmpeg的 -progress 输出和stderr，管道不会写满导致FFmpeg卡住
+2. 把进度解析为每秒指标：实时倍率、丢帧/重复帧、输出码率、文件增长
+3. 定期把指标写入录制日志，采集跟不上实时（倍率持续偏低或持续丢帧）时报警
+4. 录制结束后输出汇总，FFmpeg异常退出时给出stderr最后几行
+"""
+
+import collections
+import threading
+import time
+
+# -progress 输出中需要转换为数字的字段
+_NUMERIC_FIELDS = {
+    'frame': int,
+    'fps': float,
+    'total_size': int,
+    'out_time_us': int,
+    'dup_frames': int,
+    'drop_frames': int,
+}
+
+
+def progress_args():
+    """FFmpeg参数：把机器可读的进度写到stdout，关闭stderr上的进度行"""
+    return ['-progress', 'pipe:1', '-nostats']
+
+
+def parse_speed(value):
+    """'1.02x' → 1.02；FFmpeg启动初期输出 'N/A'"""
+    try:
+        return float(value.rstrip('x'))
+    except (ValueError, AttributeError):
+        return None
+
+
+def parse_bitrate(value):
+    """'2345.6kbits/s' → 2345.6（kbit/s）"""
+    try:
+        return float(value.replace('kbits/s', ''))
+    except (ValueError, AttributeError):
+        return None
+
+
+class FFmpegProgressMonitor:
+    """读取FFmpeg进度并生成每秒指标"""
+
+    def __init__(self, process, log=print, config=None):
+        monitor_config = (config or {}).get("进度监控", {})
+        self.process = process
+        self.log = log
+        self.log_interval = monitor_config.get("日志间隔_秒", 10)
+        self.min_speed = monitor_config.get("最低实时倍率", 0.95)
+        self.alert_after = monitor_config.get("报警连续秒数", 5)
+        self.max_drops_per_second = monitor_config.get("每秒最多丢帧", 2)
+
+        self.lock = threading.Lock()
+        self.metrics = []
+        self.stderr_tail = collections.deque(maxlen=20)
+        self.alerts = 0
+        self.slow_seconds = 0
+        self.alerting = False
+        self.finished = False
+        self._last_sample = None
+        self._origin = None
+        self._last_log = 0
+        self._started = time.time()
+        self._threads = []
+
+    def start(self):
+        """启动stdout（进度）和stderr（错误信息）读取线程"""
+        for target, name in ((self._read_progress, "FFmpeg进度"), (self._read_stderr, "FFmpeg错误输出")):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def _read_progress(self):
+        block = {}
+        for raw in iter(self.process.stdout.readline, b''):
+            line = raw.decode('utf-8', errors='ignore').strip()
+            if '=' not in line:
+                continue
+            key, value = line.split('=', 1)
+            block[key] = value
+            # 每个进度块以 progress=continue / progress=end 结束
+            if key == 'progress':
+                self._on_block(block)
+                block = {}
+                if value == 'end':
+                    self.finished = True
+
+    def _read_stderr(self):
+        for raw in iter(self.process.stderr.readline, b''):
+            line = raw.decode('utf-8', errors='ignore').rstrip()
+            if line:
+                self.stderr_tail.append(line)
+
+    def _on_block(self, block):
+        sample = {'time': time.time()}
+        for key, convert in _NUMERIC_FIELDS.items():
+            try:
+                sample[key] = convert(block.get(key, ''))
+            except ValueError:
+                sample[key] = None
+        sample['speed'] = parse_speed(block.get('speed'))
+        sample['bitrate_kbps'] = parse_bitrate(block.get('bitrate'))
+
+        if self._origin is None and sample['out_time_us']:
+            self._origin = sample['time'] - sample['out_time_us'] / 1_000_000
+
+        previous = self._last_sample
+        self._last_sample = sample
+        if previous is None:
+            return
+
+        elapsed = sample['time'] - previous['time']
+        if elapsed <= 0:
+            return
+        metric = {
+            '秒': round(sample['time'] - self._started, 1),
+            '实时倍率': sample['speed'],
+            '帧率': sample['fps'],
+            '丢帧': self._delta(sample, previous, 'drop_frames'),
+            '重复帧': self._delta(sample, previous, 'dup_frames'),
+            '码率_kbps': sample['bitrate_kbps'],
+            '文件增长_KB每秒': round(self._delta(sample, previous, 'total_size') / 1024 / elapsed, 1),
+        }
+        with self.lock:
+            self.metrics.append(metric)
+        self._check_realtime(metric, elapsed)
+
+        if sample['time'] - self._last_log >= self.log_interval:
+            self._last_log = sample['time']
+            self.log(self.format_metric(metric))
+
+    def last_progress_time(self):
+        """最近一次收到进度块的时间（还没有收到时为启动时间），用于判断FFmpeg是否停滞"""
+        sample = self._last_sample
+        return sample['time'] if sample else self._started
+
+    def media_origin(self):
+        """输出文件 t=0 对应的系统时间（第一个有输出时长的进度块的时间减去输出时长），还没有进度时为None。
+        编码器缓冲的帧尚未计入输出时长，得到的时间只会比实际稍晚，按它换算的内容起点不会晚于实际"""
+        return self._origin
+
+    @staticmethod
+    def _delta(sample, previous, key):
+        if sample.get(key) is None or previous.get(key) is None:
+            return 0
+        return max(0, sample[key] - previous[key])
+
+    def _check_realtime(self, metric, elapsed):
+        """倍率低于阈值或丢帧过多持续 alert_after 秒时报警，恢复后提示一次"""
+        speed = metric['实时倍率']
+        lagging = (speed is not None and speed < self.min_speed) or \
+            metric['丢帧'] > self.max_drops_per_second * elapsed
+        self.slow_seconds = self.slow_seconds + elapsed if lagging else 0
+
+        if self.slow_seconds >= self.alert_after and not self.alerting:
+            self.alerting = True
+            self.alerts += 1
+            self.log(f"⚠ 采集跟不上实时: 已持续{self.slow_seconds:.0f}秒（{self.format_metric(metric)}）")
+        elif not lagging and self.alerting:
+            self.alerting = False
+            self.log("✓ 采集已恢复实时")
+
+    @staticmethod
+    def format_metric(metric):
+        speed = f"{metric['实时倍率']:.2f}x" if metric['实时倍率'] is not None else "N/A"
+        fps = f"{metric['帧率']:.1f}" if metric['帧率'] is not None else "N/A"
+        bitrate = f"{metric['码率_kbps']:.0f}kbps" if metric['码率_kbps'] is not None else "N/A"
+        return (f"录制进度 {metric['秒']:.0f}秒: 倍率 {speed}，帧率 {fps}，丢帧 {metric['丢帧']}，"
+                f"重复帧 {metric['重复帧']}，码率 {bitrate}，文件增长 {metric['文件增长_KB每秒']}KB/s")
+
+    def summary(self):
+        """录制汇总：平均/最低倍率、丢帧和重复帧总数、报警次数、帧率稳定性、媒体时长"""
+        with self.lock:
+            metrics = list(self.metrics)
+        speeds = [m['实时倍率'] for m in metrics if m['实时倍率'] is not None]
+        fps_values = [m['帧率'] for m in metrics if m['帧率']]
+        fps_mean = sum(fps_values) / len(fps_values) if fps_values else None
+        out_time = self._last_sample.get('out_time_us') if self._last_sample else None
+        frames = self._last_sample.get('frame') if self._last_sample else None
+        return {
+            '采样数': len(metrics),
+            '平均倍率': round(sum(speeds) / len(speeds), 3) if speeds else None,
+            '最低倍率': min(speeds) if speeds else None,
+            '丢帧': sum(m['丢帧'] for m in metrics),
+            '重复帧': sum(m['重复帧'] for m in metrics),
+            '报警次数': self.alerts,
+            '帧率均值': round(fps_mean, 2) if fps_mean else None,
+            '帧率标准差': round((sum((v - fps_mean) ** 2 for v in fps_values) / len(fps_values)) ** 0.5, 3)
+                          if fps_values else None,
+            '媒体时长_秒': round(out_time / 1_000_000, 2) if out_time else None,
+            # 可变帧率时重复帧被丢弃，编码帧数明显少于 帧率 × 时长
+            '编码帧数': frames,
+            # 收到 progress=end 说明FFmpeg正常写完了文件尾
+            '正常结束': self.finished,
+        }
+
+    def stop(self, timeout=5):
+        """等待读取线程在FFmpeg退出后读完剩余输出，并写入汇总"""
+        for thread in self._threads:
+            thread.join(timeout)
+        summary = self.summary()
+        average = f"{summary['平均倍率']:.2f}x" if summary['平均倍率'] is not None else "N/A"
+        lowest = f"{summary['最低倍率']:.2f}x" if summary['最低倍率'] is not None else "N/A"
+        self.log(f"录制统计: 平均倍率 {average}，最低倍率 {lowest}，丢帧 {summary['丢帧']}，"
+                 f"重复帧 {summary['重复帧']}，报警 {summary['报警次数']} 次")
+        if self.process.returncode not in (0, None, 255) and self.stderr_tail:
+            # 255 是按 q 停止时部分平台上的退出码
+            self.log("FFmpeg错误输出:\n    " + "\n    ".join(self.stderr_tail))
+        return summary
@@ -1,6 +1,7 @@
 """
 修复URL编码问题
 将UTF-16编码的URL文件转换为UTF-8，并解码URL编码
+（课件都在本仓库时，可以改用 python lesson_manifest.py 直接从课件目录生成URL文件）
 """
 
 import urllib.parse
@@ -0,0 +1,419 @@
+"""
+多节点任务队列
+功能：
+1. 一批课件放进共享的任务队列，任意多台机器上的录制节点各自领取课件，不再需要手工拆分URL列表和起始索引
+2. 领取时获得有期限的租约，录制期间由心跳线程定期续约；节点崩溃或断网后租约过期，课件自动回到队列由其他节点领取
+3. 每个课件最多尝试 错误重试次数+1 次（租约过期也计一次），超过后标记为失败
+4. 验证通过的课件写入共享的成片目录：哪个节点、输出路径、大小、内容哈希；重新入队时内容哈希未变的课件不会重录
+   （队列中的内容哈希不含本机编码校准，各节点的校准结果不同也可以比较；节点的校准结果记录在成片目录中）
+
+当前实现用一个SQLite数据库文件作为协调者（放在各节点都能访问的共享目录中），
+每次领取/续约/完成都是一个 BEGIN IMMEDIATE 事务。
+
+用法：
+    python job_queue.py enqueue               # 把URL列表中的课件放进队列（最长优先）
+    python job_queue.py work [--node 名称]     # 在本机启动一个录制节点，领取课件直到队列为空
+    python job_queue.py status                # 查看队列状态和成片目录
+"""
+
+import argparse
+import json
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+from lesson_index import lesson_name_from_url
+from run_journal import VERIFIED, FAILED
+
+JOB_QUEUED = 'queued'
+JOB_LEASED = 'leased'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+JOB_STATE_LABELS = {
+    JOB_QUEUED: '排队',
+    JOB_LEASED: '录制中',
+    JOB_DONE: '已完成',
+    JOB_FAILED: '失败',
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    lesson TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    content_hash TEXT,
+    node TEXT,
+    lease_token TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS catalog (
+    lesson TEXT PRIMARY KEY,
+    node TEXT NOT NULL,
+    output TEXT NOT NULL,
+    size_mb REAL,
+    content_hash TEXT,
+    detail TEXT,
+    finished_at TEXT NOT NULL
+);
+"""
+
+
+class SQLiteJobQueue:
+    """基于SQLite文件的任务队列（租约 + 心跳 + 过期回收）和成片目录"""
+
+    def __init__(self, db_path, lease_seconds=120, max_attempts=4, log=print):
+        self.db_path = Path(db_path)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.log = log
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.executescript(SCHEMA)
+        finally:
+            conn.close()
+
+    def _connect(self):
+        # 自动提交模式，事务由 _transaction 显式开始；timeout 为等待其他节点释放写锁的时间
+        return sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+
+    def _transaction(self):
+        return _Transaction(self._connect())
+
+    def enqueue(self, jobs):
+        """jobs: 按优先顺序排列的 [(URL, 内容哈希)]。
+        新课件和内容已修改的课件进入排队；已完成且哈希未变、或正在被录制的课件保持不变。返回排队数"""
+        queued = 0
+        now = time.time()
+        with self._transaction() as conn:
+            for priority, (url, content_hash) in enumerate(jobs):
+                lesson = lesson_name_from_url(url)
+                row = conn.execute("SELECT state, content_hash FROM jobs WHERE lesson = ?", (lesson,)).fetchone()
+                if row and (row[0] == JOB_LEASED or (row[0] == JOB_DONE and row[1] == content_hash)):
+                    conn.execute("UPDATE jobs SET priority = ? WHERE lesson = ?", (priority, lesson))
+                    continue
+                conn.execute(
+                    "INSERT OR REPLACE INTO jobs (lesson, url, priority, state, content_hash, attempts, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, 0, ?)",
+                    (lesson, url, priority, JOB_QUEUED, content_hash, now)
+                )
+                queued += 1
+        return queued
+
+    def _reclaim_expired(self, conn, now):
+        """租约过期的课件回到队列（计一次尝试），尝试次数用完的标记为失败"""
+        expired = conn.execute(
+            "SELECT lesson, node, attempts FROM jobs WHERE state = ? AND lease_expires < ?", (JOB_LEASED, now)
+        ).fetchall()
+        for lesson, node, attempts in expired:
+            attempts += 1
+            state = JOB_QUEUED if attempts < self.max_attempts else JOB_FAILED
+            conn.execute(
+                "UPDATE jobs SET state = ?, attempts = ?, lease_token = NULL, lease_expires = NULL, "
+                "error = ?, updated_at = ? WHERE lesson = ?",
+                (state, attempts, f"节点 {node} 的租约已过期", now, lesson)
+            )
+            self.log(f"⚠ 节点 {node} 的租约已过期，课件重新排队: {lesson}（已尝试 {attempts} 次）")
+
+    def lease(self, node):
+        """领取优先级最高的排队课件，返回 {课件, URL, 租约, 尝试次数}；没有可领取的课件时返回None"""
+        now = time.time()
+        with self._transaction() as conn:
+            self._reclaim_expired(conn, now)
+            row = conn.execute(
+                "SELECT lesson, url, attempts FROM jobs WHERE state = ? ORDER BY priority LIMIT 1", (JOB_QUEUED,)
+            ).fetchone()
+            if row is None:
+                return None
+            token = uuid.uuid4().hex
+            conn.execute(
+                "UPDATE jobs SET state = ?, node = ?, lease_token = ?, lease_expires = ?, updated_at = ? "
+                "WHERE lesson = ?",
+                (JOB_LEASED, node, token, now + self.lease_seconds, now, row[0])
+            )
+        return {'课件': row[0], 'URL': row[1], '租约': token, '尝试次数': row[2]}
+
+    def heartbeat(self, lesson, token):
+        """续约；租约已被回收（节点暂停超过租约期限）时返回False"""
+        now = time.time()
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_expires = ?, updated_at = ? WHERE lesson = ? AND lease_token = ? AND state = ?",
+                (now + self.lease_seconds, now, lesson, token, JOB_LEASED)
+            )
+        return cursor.rowcount == 1
+
+    def complete(self, lesson, token, ok, error=None):
+        """报告录制结果；失败且还有尝试次数时重新排队。租约已失效时返回False（结果不被采用）"""
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT attempts FROM jobs WHERE lesson = ? AND lease_token = ? AND state = ?",
+                (lesson, token, JOB_LEASED)
+            ).fetchone()
+            if row is None:
+                return False
+            attempts = row[0] + 1
+            if ok:
+                state = JOB_DONE
+            else:
+                state = JOB_QUEUED if attempts < self.max_attempts else JOB_FAILED
+            conn.execute(
+                "UPDATE jobs SET state = ?, attempts = ?, lease_token = NULL, lease_expires = NULL, "
+                "error = ?, updated_at = ? WHERE lesson = ?",
+                (state, attempts, error, now, lesson)
+            )
+        return True
+
+    def release(self, lesson, token):
+        """节点正常退出（如 Ctrl-C）时交还未完成的课件，不计尝试次数"""
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET state = ?, lease_token = NULL, lease_expires = NULL, updated_at = ? "
+                "WHERE lesson = ? AND lease_token = ? AND state = ?",
+                (JOB_QUEUED, time.time(), lesson, token, JOB_LEASED)
+            )
+
+    def record_output(self, lesson, node, output, size_mb=None, content_hash=None, **detail):
+        """把验证通过的成片写入共享目录（同一课件只保留最新一条）"""
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO catalog (lesson, node, output, size_mb, content_hash, detail, finished_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (lesson, node, str(output), size_mb, content_hash, json.dumps(detail, ensure_ascii=False),
+                 datetime.now().isoformat(timespec='seconds'))
+            )
+
+    def counts(self):
+        """各状态的课件数"""
+        with self._transaction() as conn:
+            return dict(conn.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+
+    def outstanding(self):
+        """还没有结果的课件数（排队 + 录制中）"""
+        counts = self.counts()
+        return counts.get(JOB_QUEUED, 0) + counts.get(JOB_LEASED, 0)
+
+    def jobs(self):
+        with self._transaction() as conn:
+            return conn.execute(
+                "SELECT lesson, state, node, attempts, error FROM jobs ORDER BY priority"
+            ).fetchall()
+
+    def catalog(self):
+        with self._transaction() as conn:
+            return conn.execute(
+                "SELECT lesson, node, output, size_mb, content_hash, finished_at FROM catalog ORDER BY lesson"
+            ).fetchall()
+
+
+class _Transaction:
+    """with 块即一个写事务（BEGIN IMMEDIATE 立即取得写锁，多个节点同时领取时不会领到同一个课件）"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self.conn.close()
+
+
+class LeaseKeeper(threading.Thread):
+    """心跳线程：为本节点持有的所有租约定期续约（录制中和等待后台质量检查的课件）"""
+
+    def __init__(self, job_queue, interval=30, log=print):
+        super().__init__(name="租约心跳", daemon=True)
+        self.job_queue = job_queue
+        self.interval = interval
+        self.log = log
+        self.lock = threading.Lock()
+        self.held = {}
+        self.stopped = threading.Event()
+
+    def hold(self, job):
+        with self.lock:
+            self.held[job['课件']] = job
+
+    def drop(self, lesson):
+        with self.lock:
+            return self.held.pop(lesson, None)
+
+    def jobs(self):
+        with self.lock:
+            return list(self.held.values())
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            for job in self.jobs():
+                try:
+                    if not self.job_queue.heartbeat(job['课件'], job['租约']):
+                        self.log(f"⚠ 租约已被回收，课件将由其他节点重新录制: {job['课件']}")
+                        self.drop(job['课件'])
+                except sqlite3.Error as e:
+                    # 共享目录暂时不可用时下一轮重试，租约期限远大于心跳间隔
+                    self.log(f"⚠ 续约失败: {job['课件']}（{e}）")
+
+    def stop(self):
+        self.stopped.set()
+
+
+class QueueWorker:
+    """录制节点：用本机的 SmartCoursewareRecorder 从任务队列领取课件，结果写回队列和成片目录"""
+
+    def __init__(self, recorder, job_queue, node=None):
+        queue_config = recorder.config.get("任务队列", {})
+        self.recorder = recorder
+        self.job_queue = job_queue
+        self.node = node or queue_config.get("节点名称") or socket.gethostname()
+        self.idle_interval = queue_config.get("空闲轮询间隔_秒", 15)
+        self.keeper = LeaseKeeper(job_queue, queue_config.get("心跳间隔_秒", 30), recorder.log)
+        self.processed = []
+
+    def setup(self):
+        """准备时长索引、课件服务、音频设备和浏览器（与单机录制相同）"""
+        recorder = self.recorder
+        recorder.lesson_index = recorder.load_lesson_index()
+        recorder.start_lesson_server([])
+        if not recorder.page_capture_enabled():
+            recorder.prepare_audio_device()
+        recorder.setup_browser()
+
+    def local_url(self, url):
+        server = self.recorder.lesson_server
+        return server.local_url(url) if server else url
+
+    def settle(self):
+        """把已有最终结果（验证通过或失败）的课件报告给队列，验证通过的写入成片目录"""
+        recorder = self.recorder
+        journal = recorder.get_journal()
+        for job in self.keeper.jobs():
+            lesson = job['课件']
+            entry = journal.entry(lesson) or {}
+            if entry.get('状态') not in (VERIFIED, FAILED):
+                continue
+            self.keeper.drop(lesson)
+            ok = entry['状态'] == VERIFIED
+            if not self.job_queue.complete(lesson, job['租约'], ok, entry.get('原因')):
+                recorder.log(f"⚠ 租约已失效，结果未被采用: {lesson}")
+                continue
+            if ok:
+                output = recorder.output_path_for(job['URL']).absolute()
+                # 运行记录中的哈希含本机编码校准，成片目录使用与入队时相同的、与节点无关的哈希
+                content_hash = recorder.get_manifest().content_hash(lesson, host_specific=False)
+                self.job_queue.record_output(lesson, self.node, output, entry.get('大小_MB'), content_hash,
+                                             质量报告=entry.get('质量报告'), 本机编码校准=entry.get('本机编码校准'))
+                recorder.log(f"✓ 已写入成片目录: {lesson} → {self.node}:{output}")
+
+    def run(self, max_duration=600):
+        """领取并录制课件，直到队列中没有排队或录制中的课件"""
+        recorder = self.recorder
+        recorder.log(f"录制节点 {self.node} 启动，任务队列: {self.job_queue.db_path}")
+        self.setup()
+        self.keeper.start()
+        try:
+            while True:
+                self.settle()
+                job = self.job_queue.lease(self.node)
+                if job is None:
+                    if not self.keeper.jobs() and self.job_queue.outstanding() == 0:
+                        break
+                    # 其他节点还在录制：它们崩溃时租约过期，课件会回到队列
+                    if not self.keeper.jobs():
+                        time.sleep(self.idle_interval)
+                    else:
+                        recorder.wait_background_jobs()
+                    continue
+
+                self.keeper.hold(job)
+                url = job['URL']
+                self.processed.append((len(self.processed), url))
+                counts = self.job_queue.counts()
+                recorder.log(f"⇠ 领取课件: {job['课件']}（第 {job['尝试次数'] + 1} 次尝试；"
+                             + "，".join(f"{JOB_STATE_LABELS[s]} {n}" for s, n in counts.items()) + "）")
+                lesson_max = recorder.lesson_max_duration(url, max_duration)
+                recorder.record_single_url(self.local_url(url), counts.get(JOB_DONE, 0) + 1,
+                                           sum(counts.values()), lesson_max)
+
+            recorder.wait_background_jobs()
+            self.settle()
+        finally:
+            self.keeper.stop()
+            recorder.stop_ffmpeg_recording()
+            # 中断或异常退出时交还未完成的课件
+            for job in self.keeper.jobs():
+                self.job_queue.release(job['课件'], job['租约'])
+                recorder.log(f"⇢ 已交还课件: {job['课件']}")
+            recorder.finish_run(self.processed)
+
+
+def open_queue(config, log=print):
+    queue_config = config.get("任务队列", {})
+    output_dir = Path(config.get("录制配置", {}).get("输出目录", "录制视频"))
+    return SQLiteJobQueue(
+        queue_config.get("数据库路径") or output_dir / "任务队列.db",
+        lease_seconds=queue_config.get("租约_秒", 120),
+        max_attempts=config.get("高级选项", {}).get("错误重试次数", 3) + 1,
+        log=log
+    )
+
+
+if __name__ == "__main__":
+    from auto_record_smart import SmartCoursewareRecorder, load_config
+
+    parser = argparse.ArgumentParser(description="多节点任务队列：入队、启动录制节点、查看状态")
+    parser.add_argument("command", choices=["enqueue", "work", "status"])
+    parser.add_argument("--node", help="节点名称（默认为 任务队列.节点名称 或主机名）")
+    args = parser.parse_args()
+
+    config = load_config() or {}
+    record_config = config.get("录制配置", {})
+    recorder = SmartCoursewareRecorder(
+        record_config.get("URL文件路径", "课程链接_已解码.txt"),
+        record_config.get("输出目录", "录制视频"),
+        config=config
+    )
+    job_queue = open_queue(config, recorder.log)
+
+    if args.command == "enqueue":
+        urls = recorder.read_urls()
+        index = recorder.load_lesson_index()
+        if index and config.get("时长索引", {}).get("最长优先", True):
+            urls = index.sort_longest_first(urls)
+        manifest = recorder.get_manifest()
+        queued = job_queue.enqueue([(url, manifest.content_hash(lesson_name_from_url(url), host_specific=False))
+                                    for url in urls])
+        print(f"✓ {len(urls)} 个课件中 {queued} 个进入队列（其余已完成且内容未修改，或正在录制）")
+    elif args.command == "work":
+        try:
+            QueueWorker(recorder, job_queue, args.node).run(record_config.get("最大录制时长_秒", 600))
+        except KeyboardInterrupt:
+            print("\n用户中断录制")
+            recorder.cleanup()
+    else:
+        print(f"{'课件':<40} {'状态':<8} {'节点':<16} 尝试")
+        print("-" * 80)
+        for lesson, state, node, attempts, error in job_queue.jobs():
+            print(f"{lesson:<40} {JOB_STATE_LABELS[state]:<8} {node or '':<16} {attempts}"
+                  + (f"  {error}" if error else ""))
+        print("-" * 80)
+        print("，".join(f"{JOB_STATE_LABELS[s]} {n}" for s, n in job_queue.counts().items()))
+        catalog = job_queue.catalog()
+        if catalog:
+            print(f"\n成片目录（{len(catalog)} 个）:")
+            for lesson, node, output, size_mb, _, finished_at in catalog:
+                print(f"  {lesson:<40} {node}:{output}（{size_mb} MB，{finished_at}）")
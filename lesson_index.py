@@ -0,0 +1,208 @@
+"""
+课件时长索引工具
+功能：
+1. 静态解析每个 NN_x.y_*.html 课件（不打开浏览器）
+2. 提取幻灯片数量、getSlideDuration() 每页时长表、讲稿字数
+3. 估算每个课件的预计播放时长
+4. 按文件内容哈希缓存到 课程时长索引.json，课件未修改时不重复解析
+
+录制脚本用它计算每个课件的最大录制时长、剩余时间（ETA）和最长优先调度顺序。
+"""
+
+import hashlib
+import json
+import re
+import urllib.parse
+from pathlib import Path
+
+INDEX_VERSION = 1
+
+LESSON_PATTERN = re.compile(r'^\d{2}_\d+\.\d+_.+\.html$')
+TOTAL_PATTERN = re.compile(r'(?:const|let|var)\s+total(?:Slides|Pages)\s*=\s*(\d+)')
+SLIDE_ELEMENT_PATTERN = re.compile(r'class=["\'](?:slide|page)(?:\s[^"\']*)?["\']')
+DURATIONS_PATTERN = re.compile(r'durations\s*=\s*\{(.*?)\}', re.S)
+DURATION_ENTRY_PATTERN = re.compile(r'["\']?(\d+)["\']?\s*:\s*(\d+)')
+DEFAULT_DURATION_PATTERN = re.compile(r'durations\[[^\]]+\]\s*\|\|\s*(\d+)')
+SCRIPT_PATTERN = re.compile(r'(?:subtitleScript|pageContent)\s*=\s*\{')
+SCRIPT_ENTRY_PATTERN = re.compile(
+    r'["\']?(\d+)["\']?\s*:\s*(`[^`]*`|"(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\')',
+    re.S
+)
+
+
+def lesson_name_from_url(url):
+    """从URL提取课件文件名（自动解码URL编码）"""
+    return urllib.parse.unquote(url.split('/')[-1])
+
+
+def file_hash(path):
+    """计算文件SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def script_entries(html):
+    """课件讲稿 {页码: 带引号的原文}（subtitleScript 或 pageContent）"""
+    match = SCRIPT_PATTERN.search(html)
+    if not match:
+        return {}
+    end = html.find('};', match.end())
+    body = html[match.end():end if end != -1 else None]
+    return {int(key): text for key, text in SCRIPT_ENTRY_PATTERN.findall(body)}
+
+
+def parse_lesson(html):
+    """解析课件HTML，返回幻灯片数量、每页时长表和每页讲稿字数"""
+    match = TOTAL_PATTERN.search(html)
+    slide_count = int(match.group(1)) if match else len(SLIDE_ELEMENT_PATTERN.findall(html))
+
+    durations = {}
+    default_duration = None
+    match = DURATIONS_PATTERN.search(html)
+    if match:
+        for key, value in DURATION_ENTRY_PATTERN.findall(match.group(1)):
+            durations[int(key)] = int(value)
+        default_match = DEFAULT_DURATION_PATTERN.search(html, match.end())
+        if default_match:
+            default_duration = int(default_match.group(1))
+
+    script_chars = {key: len(text) - 2 for key, text in script_entries(html).items()}
+
+    return {
+        'slide_count': slide_count,
+        'durations_ms': durations,
+        'default_duration_ms': default_duration,
+        'script_chars': script_chars,
+    }
+
+
+class LessonDurationIndex:
+    """课件时长索引（按文件哈希缓存）"""
+
+    def __init__(self, lesson_dir=".", cache_file="课程时长索引.json", config=None):
+        index_config = (config or {}).get("时长索引", {})
+        self.lesson_dir = Path(lesson_dir)
+        self.cache_file = Path(cache_file)
+        # 讲稿朗读速度（字/秒）和每页翻页开销（frame_stop后停顿1.5秒 + 翻页后0.8秒）
+        self.chars_per_second = index_config.get("朗读速度_字每秒", 4.0)
+        self.page_turn_seconds = index_config.get("翻页开销_秒", 2.3)
+        self.startup_seconds = index_config.get("启动开销_秒", 4.0)
+        self.default_slide_seconds = index_config.get("默认每页时长_秒", 20.0)
+        self.margin_ratio = index_config.get("时长余量倍数", 1.3)
+        self.margin_seconds = index_config.get("时长余量_秒", 30)
+        self.entries = {}
+
+    def settings_fingerprint(self):
+        """影响时长估算的设置的SHA-256；与缓存中记录的不同时缓存作废"""
+        settings = {
+            '朗读速度_字每秒': self.chars_per_second,
+            '翻页开销_秒': self.page_turn_seconds,
+            '启动开销_秒': self.startup_seconds,
+            '默认每页时长_秒': self.default_slide_seconds,
+        }
+        return hashlib.sha256(json.dumps(settings, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def load(self):
+        """加载缓存并索引课件目录下的所有课件，返回 {文件名: 索引条目}"""
+        cached = {}
+        fingerprint = self.settings_fingerprint()
+        stale = False
+        if self.cache_file.exists():
+            try:
+                with open(self.cache_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get('版本') == INDEX_VERSION and data.get('设置指纹') == fingerprint:
+                    cached = data.get('课件', {})
+                else:
+                    # 版本或估算设置（朗读速度、翻页/启动开销、默认每页时长）变化，全部重新估算
+                    stale = True
+            except Exception as e:
+                print(f"⚠ 时长索引缓存读取失败，将重新解析: {e}")
+
+        entries_by_hash = {}
+        changed = False
+        for path in sorted(self.lesson_dir.iterdir()):
+            if not LESSON_PATTERN.match(path.name):
+                continue
+            digest = file_hash(path)
+            entry = cached.get(digest)
+            if entry is None:
+                entry = self._build_entry(path)
+                changed = True
+            entries_by_hash[digest] = entry
+            self.entries[path.name] = entry
+
+        if stale or changed or set(entries_by_hash) != set(cached):
+            with open(self.cache_file, 'w', encoding='utf-8') as f:
+                json.dump({'版本': INDEX_VERSION, '设置指纹': fingerprint, '课件': entries_by_hash},
+                          f, ensure_ascii=False, indent=2)
+
+        return self.entries
+
+    def _build_entry(self, path):
+        """解析单个课件并估算播放时长"""
+        parsed = parse_lesson(path.read_text(encoding='utf-8'))
+
+        slide_seconds = []
+        for slide_num in range(1, parsed['slide_count'] + 1):
+            table_ms = parsed['durations_ms'].get(slide_num, parsed['default_duration_ms'])
+            chars = parsed['script_chars'].get(slide_num)
+            estimates = []
+            if table_ms:
+                estimates.append(table_ms / 1000)
+            if chars:
+                estimates.append(chars / self.chars_per_second + self.page_turn_seconds)
+            slide_seconds.append(round(max(estimates) if estimates else self.default_slide_seconds, 1))
+
+        return {
+            '文件名': path.name,
+            '幻灯片数': parsed['slide_count'],
+            '每页时长_秒': slide_seconds,
+            '讲稿字数': sum(parsed['script_chars'].values()),
+            '预计时长_秒': round(sum(slide_seconds) + self.startup_seconds, 1),
+        }
+
+    def expected_duration(self, lesson_name):
+        """课件预计播放时长（秒），未收录时返回None"""
+        entry = self.entries.get(lesson_name)
+        return entry['预计时长_秒'] if entry else None
+
+    def max_duration_for(self, lesson_name, cap=600):
+        """课件最大录制时长：预计时长加余量，不超过全局上限"""
+        expected = self.expected_duration(lesson_name)
+        if expected is None:
+            return cap
+        return min(cap, int(expected * self.margin_ratio + self.margin_seconds))
+
+    def sort_longest_first(self, urls):
+        """按预计时长从长到短排序URL（未收录的课件排在最前，按上限处理）"""
+        return sorted(
+            urls,
+            key=lambda url: -(self.expected_duration(lesson_name_from_url(url)) or float('inf'))
+        )
+
+    def estimate_remaining(self, urls, per_lesson_overhead=0):
+        """估算剩余URL的总录制时间（秒）"""
+        total = 0
+        for url in urls:
+            expected = self.expected_duration(lesson_name_from_url(url))
+            total += (expected if expected is not None else self.default_slide_seconds * 6) + per_lesson_overhead
+        return total
+
+
+if __name__ == "__main__":
+    lesson_dir = Path(__file__).parent
+    index = LessonDurationIndex(lesson_dir, lesson_dir / "课程时长索引.json")
+    entries = index.load()
+
+    print(f"{'课件':<40} {'页数':>4} {'字数':>6} {'预计时长':>8}")
+    print("-" * 64)
+    for name, entry in entries.items():
+        print(f"{name:<40} {entry['幻灯片数']:>4} {entry['讲稿字数']:>6} {entry['预计时长_秒']:>7.0f}秒")
+    print("-" * 64)
+    total_seconds = sum(entry['预计时长_秒'] for entry in entries.values())
+    print(f"共 {len(entries)} 个课件，预计总时长 {total_seconds / 60:.1f} 分钟")
+    print(f"索引已缓存到: {index.cache_file.absolute()}")
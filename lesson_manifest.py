@@ -0,0 +1,213 @@
+"""
+课件清单与增量录制
+功能：
+1. 直接从仓库中的 NN_x.y_*.html 课件生成URL列表（取代 URL编码链接.txt → fix_url_encoding.py 的手工转换）
+2. 为每个课件计算内容哈希：课件HTML + 它引用的本地资源（含SDK模块的动态导入）+ 影响成片的录制配置
+3. 验证通过的课件在运行记录中保存内容哈希；之后只重新录制哈希发生变化的课件（类似 make 的增量构建）
+
+用法：
+    python lesson_manifest.py                  # 重新生成 课程链接_已解码.txt
+    python lesson_manifest.py --status         # 查看哪些课件需要重新录制
+"""
+
+import argparse
+import hashlib
+import json
+import re
+from pathlib import Path
+
+from lesson_index import LESSON_PATTERN, file_hash, parse_lesson, script_entries
+from local_lesson_server import ASSET_REF_PATTERN, rewrite_cdn_references
+from encoder_calibration import load_host_profile
+
+MANIFEST_VERSION = 1
+
+# ES模块的静态导入和动态导入：from "./x.js"、import("./x.js")
+MODULE_IMPORT_PATTERN = re.compile(r'(?:\bfrom|\bimport)\s*\(?\s*["\']([^"\']+)["\']')
+
+# 影响成片内容的配置项（"分组.键" 或整个分组）；修改后所有课件都需要重新录制
+DEFAULT_HASHED_SETTINGS = [
+    "录制配置.录制引擎",
+    "浏览器配置.窗口宽度",
+    "浏览器配置.窗口高度",
+    "FFmpeg配置.帧率",
+    "FFmpeg配置.关键帧间隔_秒",
+    "FFmpeg配置.视频编码器",
+    "FFmpeg配置.编码预设",
+    "FFmpeg配置.视频质量_CRF",
+    "FFmpeg配置.音频编码器",
+    "FFmpeg配置.音频比特率",
+    "画面采集",
+    "两段式录制",
+    "首尾裁剪",
+    "虚拟时间录制",
+]
+
+
+def settings_fingerprint(config, keys=None, host_profile=None):
+    """参与哈希的配置项的SHA-256（键顺序无关）。
+    host_profile：本机编码校准结果，它覆盖的帧率/CRF/预设/输出宽度同样影响成片；没有校准过的主机哈希不变"""
+    selected = {}
+    for key in keys or DEFAULT_HASHED_SETTINGS:
+        value = config or {}
+        for part in key.split('.'):
+            value = value.get(part) if isinstance(value, dict) else None
+        selected[key] = value
+    if host_profile:
+        selected['本机编码校准'] = host_profile
+    return hashlib.sha256(json.dumps(selected, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class LessonManifest:
+    """课件清单：URL列表和每个课件的内容哈希"""
+
+    def __init__(self, lesson_dir=".", config=None):
+        config = config or {}
+        manifest_config = config.get("课件清单", {})
+        self.lesson_dir = Path(lesson_dir).resolve()
+        self.remote_prefix = config.get("本地课件服务", {}).get("线上地址前缀", "https://cherishwy1974.github.io/123/")
+        # 重新校准或换到校准结果不同的节点录制时，内容哈希随之变化，课件会重新录制
+        self.settings_hash = settings_fingerprint(config, manifest_config.get("参与哈希的配置"),
+                                                  load_host_profile(config))
+        # 不含本机编码校准的哈希：多节点任务队列中各节点的校准结果不同，队列的记录需要在节点之间可比
+        self.shared_settings_hash = settings_fingerprint(config, manifest_config.get("参与哈希的配置"))
+        # 共享资源在多个课件之间只读取一次
+        self.asset_hashes = {}
+        self.asset_refs = {}
+
+    def lesson_files(self):
+        """课件目录下的所有课件（按文件名排序，即章节顺序）"""
+        return sorted(path for path in self.lesson_dir.iterdir() if LESSON_PATTERN.match(path.name))
+
+    def urls(self):
+        """课件的线上地址列表（与 课程链接_已解码.txt 格式相同，未做URL编码）"""
+        return [self.remote_prefix + path.name for path in self.lesson_files()]
+
+    def write_url_file(self, url_file):
+        """生成URL文件（UTF-8，每行一个地址）"""
+        urls = self.urls()
+        with open(url_file, 'w', encoding='utf-8') as f:
+            for url in urls:
+                f.write(url + '\n')
+        return urls
+
+    def _resolve(self, ref, base_dir):
+        """本地引用 → 仓库中的文件；外部地址、页内锚点和不存在的文件返回None"""
+        ref = ref.split('?')[0].split('#')[0]
+        if not ref or '://' in ref or ref.startswith(('data:', 'mailto:', '//')):
+            return None
+        path = (self.lesson_dir / ref.lstrip('/')) if ref.startswith('/') else (base_dir / ref)
+        path = path.resolve()
+        if self.lesson_dir not in path.parents:
+            return None
+        if not path.is_file():
+            # 与本地课件服务相同：./noto-serif-sc.css 等引用实际位于 assets 目录
+            path = self.lesson_dir / 'assets' / path.name
+        return path if path.is_file() else None
+
+    def _references(self, path):
+        """文件直接引用的本地资源（HTML的src/href和模块导入，JS的模块导入）"""
+        if path in self.asset_refs:
+            return self.asset_refs[path]
+        refs = set()
+        if path.suffix in ('.html', '.js'):
+            text = path.read_text(encoding='utf-8', errors='ignore')
+            found = MODULE_IMPORT_PATTERN.findall(text)
+            if path.suffix == '.html':
+                # CDN引用在录制时由本地课件服务替换为仓库中的副本
+                found += ASSET_REF_PATTERN.findall(rewrite_cdn_references(text))
+            refs = {asset for asset in (self._resolve(ref, path.parent) for ref in found) if asset}
+        self.asset_refs[path] = refs
+        return refs
+
+    def assets_for(self, lesson_path):
+        """课件引用的全部本地资源（递归跟踪JS模块导入）"""
+        seen = set()
+        stack = [Path(lesson_path).resolve()]
+        while stack:
+            for asset in self._references(stack.pop()):
+                if asset not in seen:
+                    seen.add(asset)
+                    stack.append(asset)
+        return sorted(seen)
+
+    def _asset_hash(self, path):
+        if path not in self.asset_hashes:
+            self.asset_hashes[path] = file_hash(path)
+        return self.asset_hashes[path]
+
+    def content_hash(self, lesson_name, host_specific=True):
+        """课件内容哈希（课件文件不存在时返回None）；host_specific=False 时不含本机编码校准（任务队列使用）"""
+        lesson_path = self.lesson_dir / lesson_name
+        if not lesson_path.is_file():
+            return None
+        settings_hash = self.settings_hash if host_specific else self.shared_settings_hash
+        digest = hashlib.sha256(f"v{MANIFEST_VERSION}:{settings_hash}\n".encode('utf-8'))
+        digest.update(f"{lesson_name}:{file_hash(lesson_path)}\n".encode('utf-8'))
+        for asset in self.assets_for(lesson_path):
+            relative = asset.relative_to(self.lesson_dir).as_posix()
+            digest.update(f"{relative}:{self._asset_hash(asset)}\n".encode('utf-8'))
+        return digest.hexdigest()
+
+    def slide_hashes(self, lesson_name):
+        """分段录制用的每页哈希 {页码: 哈希}：
+        某一页的讲稿修改只影响这一页；讲稿以外的任何修改（页面、脚本、资源、配置）影响所有页"""
+        lesson_path = self.lesson_dir / lesson_name
+        if not lesson_path.is_file():
+            return {}
+        html = lesson_path.read_text(encoding='utf-8')
+        scripts = script_entries(html)
+        layout = html
+        for text in scripts.values():
+            layout = layout.replace(text, '', 1)
+
+        base = hashlib.sha256(f"v{MANIFEST_VERSION}:{self.settings_hash}\n".encode('utf-8'))
+        base.update(layout.encode('utf-8'))
+        for asset in self.assets_for(lesson_path):
+            relative = asset.relative_to(self.lesson_dir).as_posix()
+            base.update(f"{relative}:{self._asset_hash(asset)}\n".encode('utf-8'))
+
+        hashes = {}
+        for slide_num in range(1, parse_lesson(html)['slide_count'] + 1):
+            digest = base.copy()
+            digest.update(scripts.get(slide_num, '').encode('utf-8'))
+            hashes[slide_num] = digest.hexdigest()
+        return hashes
+
+
+if __name__ == "__main__":
+    from auto_record_smart import load_config
+    from run_journal import RunJournal, VERIFIED
+
+    parser = argparse.ArgumentParser(description="从课件目录生成URL列表，查看需要重新录制的课件")
+    parser.add_argument("--status", action="store_true", help="对比运行记录，列出内容已修改的课件")
+    args = parser.parse_args()
+
+    config = load_config() or {}
+    lesson_dir = Path(config.get("时长索引", {}).get("课件目录") or Path(__file__).parent)
+    manifest = LessonManifest(lesson_dir, config)
+
+    if not args.status:
+        url_file = config.get("录制配置", {}).get("URL文件路径", "课程链接_已解码.txt")
+        urls = manifest.write_url_file(url_file)
+        print(f"✓ 已生成 {url_file}: {len(urls)} 个课件")
+    else:
+        output_dir = Path(config.get("录制配置", {}).get("输出目录", "录制视频"))
+        journal = RunJournal(output_dir / "录制记录.jsonl")
+        print(f"{'课件':<40} 状态")
+        print("-" * 60)
+        stale = 0
+        for path in manifest.lesson_files():
+            entry = journal.entry(path.name) or {}
+            if entry.get('状态') != VERIFIED:
+                status = "未录制"
+            elif entry.get('降档设置'):
+                status = "资源调节降档录制，需要重新录制"
+            elif entry.get('内容哈希') in (None, manifest.content_hash(path.name)):
+                status = "最新"
+            else:
+                status = "已修改，需要重新录制"
+            stale += status != "最新"
+            print(f"{path.name:<40} {status}")
+        print("-" * 60)
+        print(f"共 {len(manifest.lesson_files())} 个课件，需要录制 {stale} 个")
@@ -0,0 +1,191 @@
+"""
+本地课件服务器
+功能：
+1. 在本机提供课件仓库的静态文件服务（内存缓存，文件修改后自动重新读取）
+2. 把课件中的CDN引用（tailwind、MathJax、d3、polyfill）改写为仓库里的本地副本
+3. 录制时把线上课件地址映射到 localhost，页面加载只依赖本地磁盘
+
+用法：
+    python local_lesson_server.py            # 在 http://127.0.0.1:8765/ 提供课件
+"""
+
+import mimetypes
+import re
+import threading
+import urllib.parse
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# CDN地址 → 仓库中的本地副本
+CDN_REWRITES = {
+    "https://cdn.tailwindcss.com": "/tailwind.min.js",
+    "https://cdn.jsdelivr.net/npm/mathjax@3/es5/tex-mml-chtml.js": "/mathjax-tex-mml-chtml.js",
+    "https://cdnjs.cloudflare.com/ajax/libs/mathjax/3.2.2/es5/tex-mml-chtml.min.js": "/mathjax-tex-mml-chtml.js",
+    "https://d3js.org/d3.v7.min.js": "/d3.v7.min.js",
+    "https://polyfill.io/v3/polyfill.min.js?features=es6": "/polyfill.min.js",
+}
+
+ASSET_REF_PATTERN = re.compile(r'(?:src|href)=["\']([^"\']+)["\']')
+
+
+def rewrite_cdn_references(html):
+    """把HTML中的CDN引用替换为本地路径"""
+    for remote, local in CDN_REWRITES.items():
+        html = html.replace(remote, local)
+    return html
+
+
+class _FileCache:
+    """按修改时间失效的内存文件缓存"""
+
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        mtime = path.stat().st_mtime
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry and entry[0] == mtime:
+                return entry[1]
+
+        data = path.read_bytes()
+        if path.suffix == '.html':
+            data = rewrite_cdn_references(data.decode('utf-8')).encode('utf-8')
+
+        with self.lock:
+            self.entries[path] = (mtime, data)
+        return data
+
+
+class _LessonRequestHandler(SimpleHTTPRequestHandler):
+    """从内存缓存提供文件的请求处理器"""
+
+    server_version = "LessonServer/1.0"
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def _serve(self, send_body):
+        root = self.server.root
+        relative = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path).lstrip('/')
+        path = (root / relative).resolve()
+
+        # 替换文件（基准测试用桩SDK等）优先于磁盘文件
+        override = self.server.overrides.get(relative)
+        if override is not None:
+            self._send(relative, override, send_body, cacheable=False)
+            return
+
+        if root not in path.parents and path != root:
+            self.send_error(403)
+            return
+        if path.is_dir():
+            path = path / 'index.html'
+        if not path.is_file():
+            # 部分课件以 ./noto-serif-sc.css 等相对路径引用 assets 目录下的文件
+            fallback = root / 'assets' / path.name
+            if not fallback.is_file():
+                self.send_error(404)
+                return
+            path = fallback
+
+        self._send(path.name, self.server.cache.get(path), send_body)
+
+    def _send(self, name, data, send_body, cacheable=True):
+        content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        if content_type.startswith('text/') or content_type.endswith('javascript'):
+            content_type += '; charset=utf-8'
+
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        # 课件HTML每次重新验证（编辑后立即生效），其他资源允许浏览器磁盘缓存
+        # 替换文件不进浏览器缓存，以免之后的正式录制读到桩文件
+        if not cacheable:
+            self.send_header('Cache-Control', 'no-store')
+        elif name.endswith('.html'):
+            self.send_header('Cache-Control', 'no-cache')
+        else:
+            self.send_header('Cache-Control', 'public, max-age=86400')
+        self.end_headers()
+        if send_body:
+            self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # 录制期间不输出每个请求
+        pass
+
+
+class LocalLessonServer:
+    """本地课件服务器（后台线程运行）"""
+
+    def __init__(self, root=".", host="127.0.0.1", port=8765, remote_prefix="https://cherishwy1974.github.io/123/",
+                 overrides=None):
+        self.root = Path(root).resolve()
+        # {相对路径: 内容}，用于替换仓库中的文件（如基准测试的桩SDK）
+        self.overrides = overrides or {}
+        self.host = host
+        self.port = port
+        self.remote_prefix = remote_prefix
+        self.httpd = None
+        self.thread = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}/"
+
+    def start(self):
+        """启动服务器"""
+        self.httpd = ThreadingHTTPServer((self.host, self.port), _LessonRequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.root = self.root
+        self.httpd.cache = _FileCache()
+        self.httpd.overrides = self.overrides
+        self.port = self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="本地课件服务", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """关闭服务器"""
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+        self.httpd = None
+
+    def local_url(self, url):
+        """把线上课件地址映射为本地地址（其他地址原样返回）"""
+        if self.remote_prefix and url.startswith(self.remote_prefix):
+            return self.base_url + urllib.parse.unquote(url[len(self.remote_prefix):])
+        return url
+
+    def cache_warmup_urls(self, urls):
+        """挑选能覆盖全部外部资源引用的最少课件，用于预热浏览器磁盘缓存"""
+        seen = set()
+        warmup = []
+        for url in urls:
+            if not url.startswith(self.base_url):
+                continue
+            path = self.root / urllib.parse.unquote(url[len(self.base_url):])
+            if not path.is_file():
+                continue
+            refs = set(ASSET_REF_PATTERN.findall(rewrite_cdn_references(path.read_text(encoding='utf-8'))))
+            if not refs <= seen:
+                seen |= refs
+                warmup.append(url)
+        return warmup
+
+
+if __name__ == "__main__":
+    server = LocalLessonServer(Path(__file__).parent).start()
+    print(f"✓ 本地课件服务已启动: {server.base_url}")
+    print("按 Ctrl+C 停止")
+    try:
+        server.thread.join()
+    except KeyboardInterrupt:
+        server.stop()
+        print("\n服务已停止")
@@ -0,0 +1,346 @@
+"""
+页面内音视频采集（MediaRecorder）
+功能：
+1. 向课件页面注入采集脚本：WebAudio 中连接到扬声器（destination）的节点同时接入采集节点，
+   媒体元素（虚拟人 WebRTC 的 <video>/<audio>）的音轨也接入，混成一路只属于这个标签页的声音
+2. 可选采集画面：getDisplayMedia 采集当前标签页（浏览器以 --auto-accept-this-tab-capture 启动）
+3. MediaRecorder 每秒产出一个数据块，通过 CDP binding（Runtime.addBinding）送回 Python，按序号写入文件
+4. 只采集声音时，录制结束后与 FFmpeg 抓取的画面按开始时间对齐合成；采集画面时直接转码为输出格式
+
+不需要 VB-Cable 等系统级虚拟声卡：录不到系统里的其他声音，也没有声卡延迟，同一台机器可以同时录制多个课件。
+CDP连接使用 websocket-client（selenium 4 的依赖，随 selenium 一起安装）。
+"""
+
+import base64
+import itertools
+import json
+import os
+import threading
+import time
+import urllib.request
+from pathlib import Path
+
+import websocket
+
+from transcoder import run_low_priority
+
+BINDING_NAME = "__recorderChunk"
+
+# 采集脚本（可重复执行）：既作为 Page.addScriptToEvaluateOnNewDocument 的新文档脚本，
+# 也在每个课件加载后补执行一次（后台预加载的标签页没有新文档脚本）
+PAGE_CAPTURE_INIT_JS = """
+(() => {
+    if (window.__pageCapture) return;
+    const state = window.__pageCapture = {
+        taps: new Map(), elements: new Set(), recorder: null, mix: null, added: new Set(), timer: null, seq: 0
+    };
+
+    // WebAudio：连接到 destination 的节点同时连接到本上下文的采集节点
+    const tapFor = (context) => {
+        if (!state.taps.has(context) && typeof context.createMediaStreamDestination === 'function') {
+            state.taps.set(context, context.createMediaStreamDestination());
+        }
+        return state.taps.get(context);
+    };
+    const originalConnect = AudioNode.prototype.connect;
+    AudioNode.prototype.connect = function (target, ...rest) {
+        const result = originalConnect.call(this, target, ...rest);
+        if (target instanceof AudioDestinationNode) {
+            const tap = tapFor(this.context);
+            if (tap) originalConnect.call(this, tap);
+        }
+        return result;
+    };
+
+    // 媒体元素：SDK创建的 <audio>/<video> 不一定挂到DOM上，在设置 srcObject 和 play() 时登记
+    const srcObject = Object.getOwnPropertyDescriptor(HTMLMediaElement.prototype, 'srcObject');
+    Object.defineProperty(HTMLMediaElement.prototype, 'srcObject', {
+        configurable: true,
+        get() { return srcObject.get.call(this); },
+        set(value) { state.elements.add(this); srcObject.set.call(this, value); }
+    });
+    const originalPlay = HTMLMediaElement.prototype.play;
+    HTMLMediaElement.prototype.play = function (...args) {
+        state.elements.add(this);
+        return originalPlay.apply(this, args);
+    };
+
+    const send = (message) => window.__recorderChunk(JSON.stringify(message));
+
+    // 把新出现的音轨接入混音（每条音轨只接一次）
+    const collect = () => {
+        if (!state.mix) return;
+        const streams = [];
+        state.taps.forEach((tap) => streams.push(tap.stream));
+        document.querySelectorAll('audio, video').forEach((el) => state.elements.add(el));
+        state.elements.forEach((el) => {
+            if (el.srcObject instanceof MediaStream) {
+                streams.push(el.srcObject);
+            } else if (el.currentSrc && !el.paused && typeof el.captureStream === 'function') {
+                try { streams.push(el.captureStream()); } catch (e) { /* 跨域媒体无法采集 */ }
+            }
+        });
+        streams.forEach((stream) => stream.getAudioTracks().forEach((track) => {
+            if (state.added.has(track.id) || track.readyState !== 'live') return;
+            state.added.add(track.id);
+            state.mix.context.createMediaStreamSource(new MediaStream([track])).connect(state.mix.destination);
+        }));
+    };
+
+    state.start = async (options) => {
+        // 分段录制时同一页面会多次开始，每次序号从0开始
+        state.seq = 0;
+        state.added = new Set();
+        const context = new AudioContext();
+        await context.resume();
+        state.mix = { context: context, destination: context.createMediaStreamDestination() };
+        collect();
+        state.timer = setInterval(collect, 500);
+
+        const tracks = state.mix.destination.stream.getAudioTracks();
+        let mimeType = 'audio/webm;codecs=opus';
+        if (options.video) {
+            state.display = await navigator.mediaDevices.getDisplayMedia({
+                video: { frameRate: options.frameRate }, audio: false,
+                preferCurrentTab: true, selfBrowserSurface: 'include'
+            });
+            tracks.unshift(...state.display.getVideoTracks());
+            mimeType = 'video/webm;codecs=vp8,opus';
+        }
+
+        const recorder = state.recorder = new MediaRecorder(new MediaStream(tracks), {
+            mimeType: mimeType,
+            audioBitsPerSecond: options.audioBitsPerSecond,
+            videoBitsPerSecond: options.videoBitsPerSecond
+        });
+        recorder.ondataavailable = (event) => {
+            if (!event.data.size) return;
+            const seq = state.seq++;
+            const reader = new FileReader();
+            reader.onload = () => send({ type: 'chunk', seq: seq, data: reader.result.split(',', 2)[1] });
+            reader.readAsDataURL(event.data);
+        };
+        recorder.onstop = () => send({ type: 'end', chunks: state.seq });
+        recorder.onerror = (event) => send({ type: 'error', message: String(event.error || event) });
+        await new Promise((resolve) => {
+            recorder.onstart = () => {
+                send({ type: 'start', time: Date.now() });
+                resolve();
+            };
+            recorder.start(options.timeslice);
+        });
+        return mimeType;
+    };
+
+    state.stop = () => {
+        clearInterval(state.timer);
+        if (state.recorder && state.recorder.state !== 'inactive') state.recorder.stop();
+        if (state.display) state.display.getTracks().forEach((track) => track.stop());
+        if (state.mix) state.mix.context.close();
+        state.mix = null;
+    };
+})();
+"""
+
+
+class CDPSession:
+    """直接连接页面DevTools的会话（ChromeDriver的execute_cdp_cmd收不到事件）"""
+
+    def __init__(self, websocket_url, on_event):
+        self.ws = websocket.create_connection(websocket_url, suppress_origin=True, enable_multithread=True)
+        self.on_event = on_event
+        self.ids = itertools.count(1)
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.reader = threading.Thread(target=self._read_loop, name="页面采集CDP", daemon=True)
+        self.reader.start()
+
+    def call(self, method, params=None, timeout=30):
+        """发送命令并等待结果"""
+        message_id = next(self.ids)
+        done = threading.Event()
+        with self.lock:
+            self.pending[message_id] = [done, None]
+        self.ws.send(json.dumps({'id': message_id, 'method': method, 'params': params or {}}))
+        if not done.wait(timeout):
+            raise TimeoutError(f"CDP命令超时: {method}")
+        with self.lock:
+            response = self.pending.pop(message_id)[1]
+        if 'error' in response:
+            raise RuntimeError(f"{method}: {response['error'].get('message')}")
+        return response.get('result', {})
+
+    def _read_loop(self):
+        while True:
+            try:
+                message = json.loads(self.ws.recv())
+            except Exception:
+                return
+            if 'id' in message:
+                with self.lock:
+                    waiter = self.pending.get(message['id'])
+                    if waiter:
+                        waiter[1] = message
+                        waiter[0].set()
+            else:
+                self.on_event(message.get('method'), message.get('params', {}))
+
+    def close(self):
+        try:
+            self.ws.close()
+        except Exception:
+            pass
+
+
+class PageCaptureSession:
+    """一次页面内采集：数据块按序号写入 output_file"""
+
+    def __init__(self, driver, output_file, config=None, log=print, ffmpeg_config=None):
+        """ffmpeg_config：录制器当前生效的FFmpeg设置（本机编码校准、资源调节），没有时使用 config 中的 FFmpeg配置"""
+        capture_config = (config or {}).get("页面内采集", {})
+        ffmpeg_config = ffmpeg_config or (config or {}).get("FFmpeg配置", {})
+        self.driver = driver
+        self.output_file = Path(output_file)
+        self.log = log
+        self.video = capture_config.get("采集画面", False)
+        self.options = {
+            'video': self.video,
+            'frameRate': ffmpeg_config.get("帧率", 30),
+            'audioBitsPerSecond': capture_config.get("音频码率", 128000),
+            'videoBitsPerSecond': capture_config.get("画面码率", 8000000),
+            'timeslice': 1000,
+        }
+        self.session = None
+        self.file = None
+        self.next_seq = 0
+        self.buffered = {}
+        self.expected_chunks = None
+        self.started_at = None
+        self.stopped_at = None
+        self.error = None
+        self.bytes = 0
+        self.started = threading.Event()
+        self.finished = threading.Event()
+        self.lock = threading.Lock()
+
+    def _websocket_url(self):
+        """当前标签页的DevTools地址"""
+        address = self.driver.capabilities['goog:chromeOptions']['debuggerAddress']
+        target_id = self.driver.execute_cdp_cmd('Target.getTargetInfo', {})['targetInfo']['targetId']
+        with urllib.request.urlopen(f"http://{address}/json/list", timeout=5) as response:
+            targets = json.load(response)
+        for target in targets:
+            if target['id'] == target_id:
+                return target['webSocketDebuggerUrl']
+        raise RuntimeError("找不到当前标签页的DevTools地址")
+
+    def start(self):
+        """连接页面、注入采集脚本并开始录制，返回页面时钟的开始时间（秒）"""
+        self.output_file.parent.mkdir(parents=True, exist_ok=True)
+        self.file = open(self.output_file, 'wb')
+        self.session = CDPSession(self._websocket_url(), self._on_event)
+        self.session.call('Runtime.enable')
+        self.session.call('Runtime.addBinding', {'name': BINDING_NAME})
+        self.session.call('Runtime.evaluate', {'expression': PAGE_CAPTURE_INIT_JS})
+        # userGesture：getDisplayMedia 需要用户操作触发
+        result = self.session.call('Runtime.evaluate', {
+            'expression': f"window.__pageCapture.start({json.dumps(self.options)})",
+            'awaitPromise': True,
+            'userGesture': True,
+            'returnByValue': True,
+        })
+        if 'exceptionDetails' in result:
+            raise RuntimeError(f"页面内采集启动失败: {result['exceptionDetails'].get('exception', {}).get('description')}")
+        self.started.wait(5)
+        self.log(f"✓ 页面内采集已开始（{result['result']['value']}）")
+        return self.started_at
+
+    def _on_event(self, method, params):
+        if method != 'Runtime.bindingCalled' or params.get('name') != BINDING_NAME:
+            return
+        message = json.loads(params['payload'])
+        with self.lock:
+            if message['type'] == 'chunk':
+                self.buffered[message['seq']] = base64.b64decode(message['data'])
+                # 数据块异步编码，到达顺序可能与序号不同
+                while self.next_seq in self.buffered:
+                    data = self.buffered.pop(self.next_seq)
+                    self.file.write(data)
+                    self.bytes += len(data)
+                    self.next_seq += 1
+            elif message['type'] == 'start':
+                self.started_at = message['time'] / 1000
+                self.started.set()
+            elif message['type'] == 'end':
+                self.expected_chunks = message['chunks']
+                self.stopped_at = time.time()
+            elif message['type'] == 'error':
+                self.error = message['message']
+                self.log(f"⚠ 页面内采集出错: {self.error}")
+
+            if self.expected_chunks is not None and self.next_seq >= self.expected_chunks:
+                self.finished.set()
+
+    def stop(self, timeout=15):
+        """停止录制，等待剩余数据块写完，返回统计"""
+        if self.session is None:
+            if self.file:
+                self.file.close()
+            return {'正常结束': False}
+        try:
+            self.session.call('Runtime.evaluate', {'expression': "window.__pageCapture.stop()"}, timeout=5)
+        except Exception as e:
+            self.error = self.error or str(e)
+        complete = self.finished.wait(timeout)
+        self.session.close()
+        self.session = None
+        with self.lock:
+            self.file.close()
+        seconds = (self.stopped_at or time.time()) - (self.started_at or time.time())
+        stats = {
+            '正常结束': complete and not self.error,
+            '数据块': self.next_seq,
+            '大小_MB': round(self.bytes / (1024 * 1024), 2),
+            '媒体时长_秒': round(seconds, 1),
+        }
+        if not complete:
+            self.log(f"⚠ 页面内采集未收到全部数据块（{self.next_seq}/{self.expected_chunks}）")
+        return stats
+
+
+def mux_page_audio(ffmpeg_path, video_file, audio_file, offset, audio_args, log=print):
+    """把页面内采集的声音合成进FFmpeg抓取的画面（流复制画面，offset为声音相对画面的开始时间）"""
+    video_file = Path(video_file)
+    temp = video_file.with_name(video_file.stem + '.muxing' + video_file.suffix)
+    cmd = [ffmpeg_path, '-hide_banner', '-loglevel', 'error',
+           '-i', str(video_file), '-itsoffset', f'{offset:.3f}', '-i', str(audio_file),
+           '-map', '0:v', '-map', '1:a', '-c:v', 'copy'] + audio_args
+    if video_file.suffix == '.mp4':
+        cmd += ['-movflags', '+faststart']
+    cmd += ['-y', str(temp)]
+    result = run_low_priority(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore')
+    if result.returncode != 0 or not temp.exists():
+        log(f"⚠ 声音合成失败: {result.stderr.strip()[-200:]}")
+        if temp.exists():
+            temp.unlink()
+        return False
+    os.replace(temp, video_file)
+    Path(audio_file).unlink()
+    return True
+
+
+def convert_page_video(ffmpeg_path, source, target, encoder_args, frame_rate, log=print):
+    """页面内采集的 WebM（可变帧率）转为输出格式；frame_rate 为None时保持可变帧率"""
+    cmd = [ffmpeg_path, '-hide_banner', '-loglevel', 'error', '-i', str(source)]
+    if frame_rate:
+        cmd += ['-r', str(frame_rate)]
+    cmd += encoder_args
+    if Path(target).suffix == '.mp4':
+        cmd += ['-movflags', '+faststart']
+    cmd += ['-y', str(target)]
+    result = run_low_priority(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore')
+    if result.returncode != 0 or not Path(target).exists():
+        log(f"⚠ 页面内采集转码失败: {result.stderr.strip()[-200:]}")
+        return False
+    Path(source).unlink()
+    return True
@@ -0,0 +1,321 @@
+"""
+并行录制脚本（Linux多工作线程版）
+功能：
+1. 同时运行N个录制器，每个录制器独占一个Xvfb虚拟显示器
+2. 每个录制器独占一个PulseAudio null sink，声音互不串扰
+3. 每个录制器使用独立的Chrome配置目录和独立的FFmpeg进程
+4. URL按队列分发给空闲的录制器，共享同一个录制日志
+5. 启用资源调节时，同时录制的课件数、帧率和编码预设按主机余量在课件之间调整
+
+依赖：
+- Xvfb
+- PulseAudio（pactl）
+- selenium
+"""
+
+import queue
+import shutil
+import subprocess
+import threading
+import time
+from contextlib import nullcontext
+from pathlib import Path
+
+from auto_record_smart import SmartCoursewareRecorder, load_config
+from resource_governor import ResourceGovernor
+from run_journal import VERIFIED, FAILED
+
+
+class VirtualDisplay:
+    """Xvfb虚拟显示器"""
+
+    def __init__(self, number, width=1920, height=1080):
+        self.display = f":{number}"
+        self.socket = Path(f"/tmp/.X11-unix/X{number}")
+        self.lock_file = Path(f"/tmp/.X{number}-lock")
+        self.width = width
+        self.height = height
+        self.process = None
+
+    def start(self, timeout=10):
+        """启动Xvfb，等待X服务器的套接字出现（Xvfb退出或超时都视为启动失败）"""
+        if not shutil.which("Xvfb"):
+            raise RuntimeError("未找到Xvfb，请先安装（apt install xvfb）")
+        # 套接字或锁文件已存在说明显示器编号被其他X服务器占用（或是残留文件）：
+        # 等待套接字时无法区分新旧服务器，录制器会连到错误的显示器
+        for path in (self.socket, self.lock_file):
+            if path.exists():
+                raise RuntimeError(f"显示器 {self.display} 已被占用（{path} 已存在），请更换 并行录制.起始显示编号 或清理残留文件")
+
+        self.process = subprocess.Popen(
+            ["Xvfb", self.display, "-screen", "0", f"{self.width}x{self.height}x24", "-nolisten", "tcp"],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+        # 等待X服务器就绪
+        deadline = time.time() + timeout
+        while not self.socket.exists():
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Xvfb启动失败: {self.display}（退出码 {self.process.returncode}）")
+            if time.time() >= deadline:
+                self.stop()
+                raise RuntimeError(f"Xvfb启动超时: {self.display}（{timeout}秒内未就绪）")
+            time.sleep(0.1)
+        return self.display
+
+    def stop(self):
+        """关闭Xvfb"""
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.process = None
+
+
+class PulseNullSink:
+    """PulseAudio null sink（每个录制器一个独立的虚拟声卡）"""
+
+    def __init__(self, name):
+        self.name = name
+        self.module_id = None
+
+    def start(self):
+        """加载null sink模块"""
+        result = subprocess.run(
+            ["pactl", "load-module", "module-null-sink", f"sink_name={self.name}",
+             f"sink_properties=device.description={self.name}"],
+            capture_output=True,
+            text=True
+        )
+        if result.returncode != 0:
+            raise RuntimeError(f"创建音频设备失败: {result.stderr.strip()}")
+        self.module_id = result.stdout.strip()
+        return self.name
+
+    def stop(self):
+        """卸载null sink模块"""
+        if self.module_id:
+            subprocess.run(["pactl", "unload-module", self.module_id], capture_output=True)
+        self.module_id = None
+
+
+class RecordingWorker(threading.Thread):
+    """录制工作线程：从队列中领取URL并录制"""
+
+    def __init__(self, worker_id, url_queue, results, url_file, output_dir, config,
+                 display_number, profile_root, max_duration, lesson_index=None,
+                 lesson_server=None, warmup_urls=None, transcoder=None, journal=None,
+                 verifier=None, tracer=None, governor=None):
+        super().__init__(name=f"录制线程{worker_id}", daemon=True)
+        self.worker_id = worker_id
+        self.url_queue = url_queue
+        self.results = results
+        self.url_file = url_file
+        self.output_dir = output_dir
+        self.config = config
+        self.max_duration = max_duration
+        self.lesson_index = lesson_index
+        self.lesson_server = lesson_server
+        self.warmup_urls = warmup_urls or []
+        self.transcoder = transcoder
+        self.journal = journal
+        self.verifier = verifier
+        self.tracer = tracer
+        self.governor = governor
+
+        browser_config = config.get("浏览器配置", {})
+        self.virtual_display = VirtualDisplay(
+            display_number,
+            browser_config.get("窗口宽度", 1920),
+            browser_config.get("窗口高度", 1080)
+        )
+        self.audio_sink = PulseNullSink(f"recorder_sink_{worker_id}")
+        self.profile_dir = Path(profile_root) / f"worker_{worker_id}"
+        self.recorder = None
+
+    def run(self):
+        try:
+            display = self.virtual_display.start()
+            sink = self.audio_sink.start()
+            self.recorder = SmartCoursewareRecorder(
+                self.url_file,
+                self.output_dir,
+                config=self.config,
+                display=display,
+                audio_source=sink,
+                profile_dir=str(self.profile_dir),
+                worker_name=f"W{self.worker_id}"
+            )
+            self.recorder.lesson_index = self.lesson_index
+            self.recorder.transcoder = self.transcoder
+            self.recorder.journal = self.journal
+            self.recorder.verifier = self.verifier
+            self.recorder.tracer = self.tracer
+            self.recorder.governor = self.governor
+            self.recorder.log(f"工作线程启动: 显示器{display}, 音频{sink}")
+            if not self.recorder.page_capture_enabled():
+                self.recorder.prepare_audio_device()
+            self.recorder.setup_browser()
+            if self.lesson_server:
+                # 服务器归调度器所有，这里只借用来预热本线程的浏览器缓存
+                self.recorder.lesson_server = self.lesson_server
+                try:
+                    self.recorder.warm_browser_cache(self.warmup_urls)
+                finally:
+                    self.recorder.lesson_server = None
+
+            while True:
+                # 资源调节降低并发时，多出的工作线程在这里等待，不领取新课件
+                with self.governor.limit.slot() if self.governor else nullcontext():
+                    try:
+                        index, total, url = self.url_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    try:
+                        lesson_max = self.recorder.lesson_max_duration(url, self.max_duration)
+                        result = self.recorder.record_single_url(url, index, total, lesson_max)
+                        self.results.append((url, result))
+                    finally:
+                        self.url_queue.task_done()
+
+        except Exception as e:
+            if self.recorder:
+                self.recorder.log(f"✗ 工作线程异常退出: {e}")
+            else:
+                print(f"✗ 工作线程{self.worker_id}启动失败: {e}")
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        """释放浏览器、FFmpeg、音频设备和虚拟显示器"""
+        if self.recorder:
+            self.recorder.cleanup()
+            self.recorder.driver = None
+        self.audio_sink.stop()
+        self.virtual_display.stop()
+
+
+class ParallelRecordingPool:
+    """并行录制调度器"""
+
+    def __init__(self, url_file, output_dir="录制视频", config=None, workers=2):
+        self.url_file = url_file
+        self.output_dir = output_dir
+        self.config = config or {}
+        self.workers = workers
+
+        parallel_config = self.config.get("并行录制", {})
+        self.display_base = parallel_config.get("起始显示编号", 99)
+        self.profile_root = parallel_config.get("Chrome配置目录", "chrome_profiles")
+
+        # 仅用于读取URL和写汇总日志
+        self.coordinator = SmartCoursewareRecorder(url_file, output_dir, config=self.config)
+
+    def record_all(self, start_index=0, max_duration=600):
+        """并行录制所有URL"""
+        urls = self.coordinator.start_lesson_server(self.coordinator.read_urls())
+        total = len(urls)
+
+        # 最长优先：长课件先开始，避免批次末尾只剩一个长课件在跑
+        lesson_index = self.coordinator.load_lesson_index()
+        self.coordinator.lesson_index = lesson_index
+        pending = self.coordinator.order_pending(urls, start_index)
+
+        worker_count = max(1, min(self.workers, len(pending)))
+        if self.config.get("资源调节", {}).get("启用", False):
+            # 并行时调节同时录制的课件数；需在创建转码队列之前设置，转码并发不再受调节
+            self.coordinator.governor = ResourceGovernor(
+                dict(self.config, FFmpeg配置=self.coordinator.base_ffmpeg_settings()), self.coordinator.log,
+                concurrency=worker_count, concurrency_target="录制"
+            )
+        self.coordinator.log(f"共找到 {total} 个URL，从第 {start_index + 1} 个开始")
+        self.coordinator.log(f"并行录制：{worker_count} 个工作线程")
+        if lesson_index:
+            remaining = lesson_index.estimate_remaining([url for _, url in pending])
+            self.coordinator.log(f"预计总时长 {remaining / 60:.1f} 分钟，并行后约 {remaining / 60 / worker_count:.1f} 分钟")
+
+        unfinished = 0
+        try:
+            unfinished = self.run_round(pending, total, max_duration, lesson_index)
+
+            # 录制失败或质量检查未通过的课件自动重新录制
+            retries = self.config.get("高级选项", {}).get("错误重试次数", 3)
+            for attempt in range(1, retries + 1):
+                self.coordinator.wait_background_jobs()
+                failed = self.coordinator.failed_lessons(pending)
+                if not failed:
+                    break
+                self.coordinator.log(f"\n{len(failed)} 个课件录制失败或质量检查未通过，第 {attempt}/{retries} 次重新录制")
+                unfinished = self.run_round(failed, total, max_duration, lesson_index)
+        finally:
+            self.coordinator.stop_lesson_server()
+            self.coordinator.close_background_jobs()
+            self.coordinator.get_tracer().close()
+
+        counts = self.coordinator.lesson_state_counts(pending)
+        self.coordinator.log(f"\n{'='*60}")
+        self.coordinator.log("并行录制完成！")
+        self.coordinator.log(f"成功: {counts.get(VERIFIED, 0)}, 失败: {counts.get(FAILED, 0)}, 未处理: {unfinished}")
+        self.coordinator.log(f"输出目录: {Path(self.output_dir).absolute()}")
+        self.coordinator.log(f"{'='*60}")
+
+    def run_round(self, pending, total, max_duration, lesson_index):
+        """启动工作线程录制一轮 [(序号, URL)]，返回未处理的数量"""
+        url_queue = queue.Queue()
+        for i, url in pending:
+            url_queue.put((i + 1, total, url))
+
+        results = []
+        workers = [
+            RecordingWorker(
+                worker_id, url_queue, results, self.url_file, self.output_dir, self.config,
+                self.display_base + worker_id, self.profile_root, max_duration, lesson_index,
+                self.coordinator.lesson_server, [url for _, url in pending],
+                self.coordinator.get_transcoder() if self.coordinator.two_stage_enabled() else None,
+                self.coordinator.get_journal(),
+                self.coordinator.get_verifier() if self.coordinator.quality_check_enabled() else None,
+                self.coordinator.get_tracer(),
+                self.coordinator.governor
+            )
+            for worker_id in range(max(1, min(self.workers, len(pending))))
+        ]
+
+        for worker in workers:
+            worker.start()
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            # 工作线程是守护线程，主线程退出前需要主动释放各自的资源
+            for worker in workers:
+                worker.shutdown()
+            raise
+        return url_queue.qsize()
+
+
+if __name__ == "__main__":
+    config = load_config() or {}
+
+    record_config = config.get("录制配置", {})
+    URL_FILE = record_config.get("URL文件路径", "课程链接_已解码.txt")
+    OUTPUT_DIR = record_config.get("输出目录", "录制视频")
+    MAX_DURATION = record_config.get("最大录制时长_秒", 600)
+    START_INDEX = record_config.get("起始索引", 0)
+    WORKERS = config.get("并行录制", {}).get("工作进程数", 2)
+
+    print("\n配置信息：")
+    print(f"  URL文件: {URL_FILE}")
+    print(f"  输出目录: {OUTPUT_DIR}")
+    print(f"  最大时长: {MAX_DURATION}秒")
+    print(f"  起始索引: {START_INDEX}")
+    print(f"  并行数量: {WORKERS}")
+    print()
+
+    pool = ParallelRecordingPool(URL_FILE, OUTPUT_DIR, config=config, workers=WORKERS)
+
+    try:
+        pool.record_all(start_index=START_INDEX, max_duration=MAX_DURATION)
+    except KeyboardInterrupt:
+        print("\n用户中断录制")
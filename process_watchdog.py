@@ -0,0 +1,235 @@
+"""
+进程看护
+功能：
+1. 后台线程定期采样Chrome（chromedriver下的整个进程树，渲染进程单独统计）和FFmpeg的内存(RSS)与CPU
+2. 每个课件结束时把资源曲线写入 输出目录/资源曲线/<课件>.json，并在日志中输出峰值和平均值
+3. 浏览器连续录制的课件数或内存达到上限时，在下一个课件开始前重启浏览器，避免长时间运行的内存增长累积
+4. 录制中FFmpeg长时间没有进度时终止FFmpeg；页面长时间没有响应（课件事件轮询没有返回）时终止渲染进程。
+   这一课立即失败（按错误重试重新录制），不必等到最大录制时长；终止过渲染进程时下一课开始前重启浏览器
+"""
+
+import json
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import psutil
+
+
+class ProcessWatchdog(threading.Thread):
+    """采样录制器的Chrome和FFmpeg进程，检测停滞并决定何时重启浏览器"""
+
+    def __init__(self, recorder, curve_dir):
+        super().__init__(name="进程看护", daemon=True)
+        watchdog_config = recorder.config.get("进程看护", {})
+        self.recorder = recorder
+        self.curve_dir = Path(curve_dir)
+        self.interval = watchdog_config.get("采样间隔_秒", 5)
+        self.recycle_lessons = watchdog_config.get("每N个课件重启浏览器", 15)
+        self.memory_limit_mb = watchdog_config.get("浏览器内存上限_MB", 3000)
+        self.ffmpeg_stall_seconds = watchdog_config.get("FFmpeg停滞_秒", 20)
+        self.page_stall_seconds = watchdog_config.get("页面停滞_秒", 60)
+        self.save_curves = watchdog_config.get("保存资源曲线", True)
+
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        # 保留 psutil.Process 对象：cpu_percent 按两次采样之间的CPU时间计算
+        self.processes = {}
+        self.renderer_pids = set()
+        self.lesson = None
+        self.lesson_started = None
+        self.samples = []
+        self.last_sample = None
+        self.lessons_since_restart = 0
+        self.renderer_killed = False
+        self.stall = None
+
+    def start(self):
+        super().start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                sample = self.sample()
+            except psutil.Error:
+                continue
+            with self.lock:
+                self.last_sample = sample
+                if self.lesson is not None:
+                    self.samples.append(sample)
+            self.check_stalls()
+
+    def chrome_pids(self):
+        """chromedriver启动的Chrome进程树（浏览器主进程、GPU、渲染进程等）"""
+        service = getattr(getattr(self.recorder.driver, 'service', None), 'process', None)
+        if service is None:
+            return []
+        try:
+            return [child.pid for child in psutil.Process(service.pid).children(recursive=True)]
+        except psutil.Error:
+            return []
+
+    def _measure(self, pids):
+        """[(pid, RSS_MB, CPU%)]，已退出的进程跳过"""
+        measured = []
+        for pid in pids:
+            try:
+                process = self.processes.get(pid)
+                if process is None:
+                    process = self.processes[pid] = psutil.Process(pid)
+                    process.cpu_percent(None)
+                    if '--type=renderer' in process.cmdline():
+                        self.renderer_pids.add(pid)
+                measured.append((pid, process.memory_info().rss / (1024 * 1024), process.cpu_percent(None)))
+            except psutil.Error:
+                self.processes.pop(pid, None)
+        return measured
+
+    def sample(self):
+        """一次采样：Chrome合计和最大渲染进程的内存、CPU，FFmpeg的内存、CPU"""
+        now = time.time()
+        chrome = self._measure(self.chrome_pids())
+        ffmpeg_process = self.recorder.ffmpeg_process
+        ffmpeg = self._measure([ffmpeg_process.pid]) if ffmpeg_process and ffmpeg_process.poll() is None else []
+
+        alive = {pid for pid, _, _ in chrome + ffmpeg}
+        for pid in set(self.processes) - alive:
+            del self.processes[pid]
+        self.renderer_pids &= alive
+
+        renderers = [rss for pid, rss, _ in chrome if pid in self.renderer_pids]
+        return {
+            '秒': round(now - self.lesson_started, 1) if self.lesson_started else None,
+            'Chrome_MB': round(sum(rss for _, rss, _ in chrome), 1),
+            '渲染进程_MB': round(max(renderers, default=0), 1),
+            'Chrome_CPU_%': round(sum(cpu for _, _, cpu in chrome), 1),
+            'Chrome进程数': len(chrome),
+            'FFmpeg_MB': round(ffmpeg[0][1], 1) if ffmpeg else 0,
+            'FFmpeg_CPU_%': round(ffmpeg[0][2], 1) if ffmpeg else 0,
+        }
+
+    def check_stalls(self):
+        """录制中：FFmpeg没有进度则终止FFmpeg；页面没有响应则终止渲染进程"""
+        recorder = self.recorder
+        process = recorder.ffmpeg_process
+        if process is None or process.poll() is not None or self.stall:
+            return
+        now = time.time()
+
+        monitor = recorder.progress_monitor
+        if monitor and now - monitor.last_progress_time() > self.ffmpeg_stall_seconds:
+            self.trip(f"FFmpeg {now - monitor.last_progress_time():.0f}秒没有进度，已终止")
+            process.kill()
+            return
+
+        alive_at = recorder.page_alive_at
+        if alive_at and now - alive_at > self.page_stall_seconds:
+            killed = 0
+            for pid in list(self.renderer_pids):
+                try:
+                    psutil.Process(pid).kill()
+                    killed += 1
+                except psutil.Error:
+                    pass
+            self.renderer_killed = True
+            self.trip(f"页面 {now - alive_at:.0f}秒没有响应，已终止 {killed} 个渲染进程")
+
+    def trip(self, reason):
+        with self.lock:
+            self.stall = reason
+        self.recorder.log(f"⚠ 进程看护: {reason}")
+
+    def stall_reason(self):
+        """本课件中检测到的停滞（没有时为None）；录制循环据此立即结束这一课"""
+        return self.stall
+
+    def begin_lesson(self, lesson):
+        with self.lock:
+            self.lesson = lesson
+            self.lesson_started = time.time()
+            self.samples = []
+            self.stall = None
+        self.recorder.page_alive_at = None
+
+    def end_lesson(self):
+        """结束本课件的采样：输出资源汇总，保存资源曲线"""
+        with self.lock:
+            lesson, samples = self.lesson, self.samples
+            started = self.lesson_started
+            self.lesson = None
+            self.lesson_started = None
+            self.samples = []
+        self.lessons_since_restart += 1
+        if not samples:
+            return None
+
+        summary = self.summarize(samples)
+        self.recorder.log(
+            f"资源占用: Chrome 峰值 {summary['Chrome峰值_MB']} MB（渲染进程峰值 {summary['渲染进程峰值_MB']} MB），"
+            f"平均CPU {summary['Chrome平均CPU_%']}%；FFmpeg 峰值 {summary['FFmpeg峰值_MB']} MB，"
+            f"平均CPU {summary['FFmpeg平均CPU_%']}%（{summary['采样数']} 次采样）"
+        )
+        if self.save_curves:
+            self.curve_dir.mkdir(parents=True, exist_ok=True)
+            with open(self.curve_dir / f"{Path(lesson).stem}.json", 'w', encoding='utf-8') as f:
+                json.dump({
+                    '课件': lesson,
+                    '开始时间': datetime.fromtimestamp(started).isoformat(timespec='seconds'),
+                    '汇总': summary,
+                    '采样': samples,
+                }, f, ensure_ascii=False, indent=2)
+        return summary
+
+    @staticmethod
+    def summarize(samples):
+        recording = [s for s in samples if s['FFmpeg_MB']]
+        return {
+            '采样数': len(samples),
+            'Chrome峰值_MB': max(s['Chrome_MB'] for s in samples),
+            '渲染进程峰值_MB': max(s['渲染进程_MB'] for s in samples),
+            'Chrome平均CPU_%': round(sum(s['Chrome_CPU_%'] for s in samples) / len(samples), 1),
+            'FFmpeg峰值_MB': max((s['FFmpeg_MB'] for s in recording), default=0),
+            'FFmpeg平均CPU_%': round(sum(s['FFmpeg_CPU_%'] for s in recording) / len(recording), 1)
+                               if recording else 0,
+        }
+
+    def recycle_reason(self):
+        """下一个课件开始前是否需要重启浏览器，需要时返回原因"""
+        if self.renderer_killed:
+            return "上一个课件中终止过渲染进程"
+        if self.recycle_lessons and self.lessons_since_restart >= self.recycle_lessons:
+            return f"已连续录制 {self.lessons_since_restart} 个课件"
+        last = self.last_sample
+        if self.memory_limit_mb and last and last['Chrome_MB'] > self.memory_limit_mb:
+            return f"浏览器内存 {last['Chrome_MB']:.0f} MB 超过上限 {self.memory_limit_mb} MB"
+        return None
+
+    def browser_restarted(self):
+        with self.lock:
+            self.lessons_since_restart = 0
+            self.renderer_killed = False
+            self.last_sample = None
+            self.processes = {}
+            self.renderer_pids = set()
+
+    @staticmethod
+    def kill_leftovers(pids, timeout=5):
+        """driver.quit() 之后仍未退出的Chrome进程（浏览器卡死时）直接终止"""
+        processes = []
+        for pid in pids:
+            try:
+                processes.append(psutil.Process(pid))
+            except psutil.Error:
+                pass
+        _, alive = psutil.wait_procs(processes, timeout=timeout)
+        for process in alive:
+            try:
+                process.kill()
+            except psutil.Error:
+                pass
+        return len(alive)
@@ -0,0 +1,175 @@
+"""
+资源调节
+功能：
+1. 每个课件录完后测量主机余量：这段时间的CPU占用、内存占用，以及FFmpeg的实时倍率、丢帧和报警次数
+2. 余量不足（采集跟不上实时、丢帧过多，或CPU/内存超过上限）时立即降一档：先降并发，再换更快的编码预设，最后降低帧率
+3. 连续若干个课件都有充足余量时才升一档，顺序相反（先恢复帧率和预设，最后恢复并发）：优先保证采集稳定，其次才是吞吐
+4. 只在配置的范围内调整，每次决定（测量值、原因、动作、调整后的设置）都写入录制日志
+5. 调整只影响之后开始的课件；不修改config.json，课件内容哈希不受影响。
+   帧率或编码预设低于配置时录制的课件在运行记录中标记降档设置，之后的运行视为需要重录（按配置的设置重新录制）
+
+并发指：单机录制时为后台转码并发数，并行录制时为同时录制的课件数
+"""
+
+import threading
+from contextlib import contextmanager
+
+import psutil
+
+# 从慢（压缩率高）到快（CPU占用低）
+PRESETS = ["veryslow", "slower", "slow", "medium", "fast", "faster", "veryfast", "superfast", "ultrafast"]
+
+
+class ConcurrencyLimit:
+    """上限可以随时调整的并发许可；调低后正在运行的任务不受影响，结束后不再放行新任务"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self.condition = threading.Condition()
+
+    def set_limit(self, limit):
+        with self.condition:
+            self.limit = limit
+            self.condition.notify_all()
+
+    @contextmanager
+    def slot(self):
+        with self.condition:
+            while self.active >= self.limit:
+                self.condition.wait()
+            self.active += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.active -= 1
+                self.condition.notify_all()
+
+
+class ResourceGovernor:
+    """在课件之间按主机余量调整帧率、编码预设和并发数（并行录制时由所有录制器共享）"""
+
+    def __init__(self, config, log=print, concurrency=1, concurrency_target="转码"):
+        governor_config = config.get("资源调节", {})
+        ffmpeg_config = config.get("FFmpeg配置", {})
+        self.log = log
+        self.concurrency_target = concurrency_target
+        self.cpu_limit = governor_config.get("CPU上限_%", 85)
+        self.cpu_headroom = governor_config.get("CPU宽裕_%", 60)
+        self.memory_limit = governor_config.get("内存上限_%", 85)
+        self.min_speed = config.get("进度监控", {}).get("最低实时倍率", 0.95)
+        self.max_drops_per_minute = governor_config.get("每分钟最多丢帧", 30)
+        self.recover_after = governor_config.get("恢复所需课件数", 3)
+
+        # 调整范围：帧率 [最低帧率, 配置帧率]，预设 [配置预设, 最快编码预设]，并发 [1, 配置并发数]
+        self.max_frame_rate = ffmpeg_config.get("帧率", 30)
+        self.min_frame_rate = min(governor_config.get("最低帧率", 15), self.max_frame_rate)
+        self.frame_rate_step = governor_config.get("帧率步长", 5)
+        base_preset = ffmpeg_config.get("编码预设", "medium")
+        fastest = governor_config.get("最快编码预设", "veryfast")
+        if base_preset in PRESETS and fastest in PRESETS:
+            self.presets = PRESETS[PRESETS.index(base_preset):PRESETS.index(fastest) + 1] or [base_preset]
+        else:
+            self.presets = [base_preset]
+        self.max_concurrency = max(1, concurrency)
+
+        self.frame_rate = self.max_frame_rate
+        self.preset_index = 0
+        self.limit = ConcurrencyLimit(self.max_concurrency)
+        self.lock = threading.Lock()
+        self.healthy_streak = 0
+        # 第一次调用只建立起点，之后每次得到两次调用之间的平均CPU占用
+        psutil.cpu_percent(None)
+
+    @property
+    def preset(self):
+        return self.presets[self.preset_index]
+
+    def ffmpeg_config(self, ffmpeg_config):
+        """叠加当前帧率和编码预设后的 FFmpeg配置"""
+        return dict(ffmpeg_config, 帧率=self.frame_rate, 编码预设=self.preset)
+
+    def degraded_settings(self):
+        """当前帧率或编码预设低于配置时返回 {帧率, 编码预设}，否则None"""
+        with self.lock:
+            if self.frame_rate >= self.max_frame_rate and self.preset_index == 0:
+                return None
+            return {'帧率': self.frame_rate, '编码预设': self.preset}
+
+    def describe(self):
+        return f"帧率 {self.frame_rate}，编码预设 {self.preset}，{self.concurrency_target}并发 {self.limit.limit}"
+
+    def measure(self, stats):
+        """上次决定以来的主机CPU/内存和本课件的采集指标，返回 (测量值, 余量不足的原因)"""
+        media_minutes = (stats.get('媒体时长_秒') or 60) / 60
+        measured = {
+            'CPU_%': psutil.cpu_percent(None),
+            '内存_%': psutil.virtual_memory().percent,
+            '平均倍率': stats.get('平均倍率'),
+            '丢帧': stats.get('丢帧') or 0,
+            '报警次数': stats.get('报警次数') or 0,
+        }
+        problems = []
+        if measured['平均倍率'] is not None and measured['平均倍率'] < self.min_speed:
+            problems.append(f"平均倍率 {measured['平均倍率']:.2f}x")
+        if measured['丢帧'] / media_minutes > self.max_drops_per_minute:
+            problems.append(f"丢帧 {measured['丢帧']}")
+        if measured['报警次数']:
+            problems.append(f"实时报警 {measured['报警次数']} 次")
+        if measured['CPU_%'] > self.cpu_limit:
+            problems.append(f"CPU {measured['CPU_%']:.0f}%")
+        if measured['内存_%'] > self.memory_limit:
+            problems.append(f"内存 {measured['内存_%']:.0f}%")
+        return measured, problems
+
+    def after_lesson(self, lesson, stats):
+        """一个课件录完：测量余量并决定是否调整，返回执行的动作（没有调整时为None）"""
+        with self.lock:
+            measured, problems = self.measure(stats or {})
+            action = None
+            if problems:
+                self.healthy_streak = 0
+                reason = f"余量不足（{'，'.join(problems)}）"
+                action = self.step_down() or "已是最低档"
+            elif measured['CPU_%'] < self.cpu_headroom:
+                self.healthy_streak += 1
+                reason = f"余量充足（{self.healthy_streak}/{self.recover_after}）"
+                if self.healthy_streak >= self.recover_after:
+                    self.healthy_streak = 0
+                    action = self.step_up()
+            else:
+                self.healthy_streak = 0
+                reason = "余量正常"
+
+            speed = f"{measured['平均倍率']:.2f}x" if measured['平均倍率'] is not None else "N/A"
+            self.log(f"资源调节 [{lesson}]: CPU {measured['CPU_%']:.0f}%，内存 {measured['内存_%']:.0f}%，"
+                     f"倍率 {speed}，丢帧 {measured['丢帧']}，报警 {measured['报警次数']} → {reason}，"
+                     f"{action or '保持不变'}；当前 {self.describe()}")
+            return action
+
+    def step_down(self):
+        """降一档：先降并发（只损失吞吐），再换更快的预设，最后降低帧率"""
+        if self.limit.limit > 1:
+            self.limit.set_limit(self.limit.limit - 1)
+            return f"{self.concurrency_target}并发降为 {self.limit.limit}"
+        if self.preset_index < len(self.presets) - 1:
+            self.preset_index += 1
+            return f"编码预设改为 {self.preset}"
+        if self.frame_rate > self.min_frame_rate:
+            self.frame_rate = max(self.min_frame_rate, self.frame_rate - self.frame_rate_step)
+            return f"帧率降为 {self.frame_rate}"
+        return None
+
+    def step_up(self):
+        """升一档：与降档顺序相反，先恢复画面质量，最后恢复并发"""
+        if self.frame_rate < self.max_frame_rate:
+            self.frame_rate = min(self.max_frame_rate, self.frame_rate + self.frame_rate_step)
+            return f"帧率恢复为 {self.frame_rate}"
+        if self.preset_index > 0:
+            self.preset_index -= 1
+            return f"编码预设恢复为 {self.preset}"
+        if self.limit.limit < self.max_concurrency:
+            self.limit.set_limit(self.limit.limit + 1)
+            return f"{self.concurrency_target}并发升为 {self.limit.limit}"
+        return None
@@ -0,0 +1,119 @@
+"""
+录制运行记录（断点续录）
+功能：
+1. 每个课件的状态变化追加写入 JSONL 文件（每行一条，写入后立即落盘）
+2. 状态：queued（排队）→ loading（加载）→ recording（录制）→ finalising（收尾/转码）→ verified（已验证）/ failed（失败）
+3. 重新运行时读取每个课件的最后状态，只录制未完成的课件，不需要手动修改起始索引
+4. 进程崩溃或 Ctrl+C 时文件最多丢失最后一行，不影响之前的记录
+
+用法：
+    python run_journal.py [录制视频/录制记录.jsonl]     # 查看每个课件的当前状态
+"""
+
+import json
+import os
+import sys
+import threading
+from datetime import datetime
+from pathlib import Path
+
+QUEUED = 'queued'
+LOADING = 'loading'
+RECORDING = 'recording'
+FINALISING = 'finalising'
+VERIFIED = 'verified'
+FAILED = 'failed'
+
+STATE_LABELS = {
+    QUEUED: '排队',
+    LOADING: '加载',
+    RECORDING: '录制中',
+    FINALISING: '收尾',
+    VERIFIED: '已完成',
+    FAILED: '失败',
+}
+
+
+def partial_path_for(output_file):
+    """录制中的临时文件路径；验证通过后才原子改名为正式文件"""
+    output_file = Path(output_file)
+    return output_file.with_name(output_file.stem + '.partial' + output_file.suffix)
+
+
+class RunJournal:
+    """追加写入的课件状态记录（多个录制线程共享时加锁）"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.load()
+
+    def load(self):
+        """读取已有记录，保留每个课件的最后一条（跳过崩溃时写了一半的行）"""
+        self.entries = {}
+        if not self.path.exists():
+            return self.entries
+        with open(self.path, 'r', encoding='utf-8') as f:
+            content = f.read()
+        for line in content.splitlines():
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            self.entries[entry['课件']] = entry
+        # 半行结尾时先补换行，后续记录另起一行
+        if content and not content.endswith('\n'):
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write('\n')
+        return self.entries
+
+    def record(self, lesson, state, **detail):
+        """记录课件的新状态并立即落盘"""
+        entry = {'时间': datetime.now().isoformat(timespec='seconds'), '课件': lesson, '状态': state}
+        entry.update(detail)
+        line = json.dumps(entry, ensure_ascii=False) + '\n'
+        with self.lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self.entries[lesson] = entry
+        return entry
+
+    def state(self, lesson):
+        """课件的最后状态，没有记录时返回None"""
+        entry = self.entries.get(lesson)
+        return entry['状态'] if entry else None
+
+    def entry(self, lesson):
+        return self.entries.get(lesson)
+
+    def counts(self):
+        """各状态的课件数量"""
+        with self.lock:
+            counts = {}
+            for entry in self.entries.values():
+                counts[entry['状态']] = counts.get(entry['状态'], 0) + 1
+            return counts
+
+    def describe(self):
+        """状态统计，如 '已完成 12，失败 1，录制中 1'"""
+        counts = self.counts()
+        return "，".join(f"{STATE_LABELS.get(state, state)} {count}" for state, count in counts.items()) or "无记录"
+
+
+if __name__ == "__main__":
+    journal_path = Path(sys.argv[1] if len(sys.argv) > 1 else "录制视频/录制记录.jsonl")
+    if not journal_path.exists():
+        print(f"没有运行记录: {journal_path}")
+        sys.exit(0)
+
+    journal = RunJournal(journal_path)
+    print(f"{'课件':<40} {'状态':<6} {'时间':<20} 说明")
+    print("-" * 90)
+    for lesson, entry in journal.entries.items():
+        print(f"{lesson:<40} {STATE_LABELS.get(entry['状态'], entry['状态']):<6} "
+              f"{entry['时间']:<20} {entry.get('原因', '')}")
+    print("-" * 90)
+    print(journal.describe())
@@ -0,0 +1,301 @@
+"""
+按页分段录制
+功能：
+1. 不使用课件的自动播放，由录制器逐页控制：直接跳到第N页（switchToSlideSilent / switchToPageSilent / changePage 等），
+   启动FFmpeg，让虚拟人讲这一页，讲完后停止FFmpeg，每页一个分段文件
+2. 某一页失败时只重录这一页（直接跳到该页），不需要从头重播整个课件
+3. 每页记录哈希（讲稿 + 页面 + 资源 + 配置），课件修改后只重录哈希变化的页
+4. 所有分段用FFmpeg concat 分离器拼接，不重新编码
+
+分段文件保存在 录制视频/分段/<课件名>/，分段清单记录每页的哈希和时长。
+"""
+
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+
+from run_journal import partial_path_for, RECORDING
+from transcoder import run_low_priority
+
+# 讲解闸门：只放行录制器指定页码的 speakContent，
+# 挡住虚拟人连接成功后课件自己发起的第一页讲解（此时还没有开始录制）
+SEGMENT_CONTROL_JS = """
+if (window.__segmentControl) {
+    return true;
+}
+const original = window.speakContent;
+if (typeof original !== 'function') {
+    return false;
+}
+const control = window.__segmentControl = { allowed: null };
+window.speakContent = function (slideNum, ...rest) {
+    if (control.allowed !== slideNum) {
+        return Promise.resolve();
+    }
+    // 每次放行只生效一次
+    control.allowed = null;
+    return original.call(this, slideNum, ...rest);
+};
+document.body.classList.add('recording-mode');
+return true;
+"""
+
+# 各课件模板通用的页数和翻页（课件事件钩子、分段录制和虚拟时间引擎共用）：
+# slideCount() 为页数；slideNavigator() 为可用的翻页函数名（没有时为null）；
+# goToSlide(N) 静默跳转到第N页，课件没有可用的翻页函数时返回false
+SLIDE_NAVIGATION_JS = """
+const slideCount = () => {
+    if (typeof totalSlides !== 'undefined') return totalSlides;
+    if (typeof totalPages !== 'undefined') return totalPages;
+    return document.querySelectorAll('.slide, .page').length || Infinity;
+};
+const slideNavigator = () => {
+    for (const name of ['switchToSlideSilent', 'switchToPageSilent', 'switchToPage', 'showSlide']) {
+        if (typeof window[name] === 'function') return name;
+    }
+    // changePage(方向) 只能相对翻页，需要知道当前页
+    if (typeof changePage === 'function' && typeof currentPage !== 'undefined') return 'changePage';
+    return null;
+};
+const goToSlide = (slideNum) => {
+    switch (slideNavigator()) {
+        case 'switchToSlideSilent': switchToSlideSilent(slideNum); return true;
+        case 'switchToPageSilent': switchToPageSilent(slideNum); return true;
+        case 'switchToPage': switchToPage(slideNum); return true;
+        case 'showSlide': showSlide(slideNum - 1); return true;
+        case 'changePage': changePage(slideNum - currentPage); return true;
+        default: return false;
+    }
+};
+"""
+
+# 课件是否支持分段录制：有 speakContent（讲解闸门）和可用的翻页函数
+SEGMENT_SUPPORT_JS = SLIDE_NAVIGATION_JS + """
+return typeof speakContent === 'function' && slideNavigator() !== null;
+"""
+
+# 静默跳转到第N页（不触发讲解），返回这一页是否有讲稿；没有可用的翻页函数时返回null
+SEGMENT_GOTO_JS = SLIDE_NAVIGATION_JS + """
+const slideNum = arguments[0];
+window.__segmentControl.allowed = null;
+if (!goToSlide(slideNum)) {
+    return null;
+}
+if (typeof currentSlide !== 'undefined') {
+    currentSlide = slideNum - 1;
+    if (typeof updateSlideInfo === 'function') updateSlideInfo();
+} else if (typeof currentPage !== 'undefined') {
+    currentPage = slideNum;
+    if (typeof updatePageInfo === 'function') updatePageInfo();
+}
+const scripts = typeof subtitleScript !== 'undefined' ? subtitleScript
+    : (typeof pageContent !== 'undefined' ? pageContent : {});
+return !!scripts[slideNum];
+"""
+
+SEGMENT_SPEAK_JS = """
+window.__segmentControl.allowed = arguments[0];
+speakContent(arguments[0]);
+"""
+
+SEGMENT_MANIFEST = "分段清单.json"
+
+
+class SegmentStore:
+    """一个课件的分段目录：分段文件和分段清单（每页的哈希、时长）"""
+
+    def __init__(self, directory, suffix):
+        self.directory = Path(directory)
+        self.suffix = suffix
+        self.manifest_file = self.directory / SEGMENT_MANIFEST
+        self.entries = {}
+        if self.manifest_file.exists():
+            try:
+                with open(self.manifest_file, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                self.entries = {}
+
+    def path_for(self, slide_num):
+        return self.directory / f"slide_{slide_num:02d}{self.suffix}"
+
+    def is_current(self, slide_num, slide_hash):
+        """这一页已有分段且哈希未变"""
+        entry = self.entries.get(str(slide_num))
+        return bool(entry and entry.get('哈希') == slide_hash and self.path_for(slide_num).exists())
+
+    def mark(self, slide_num, slide_hash, seconds):
+        """记录一页分段完成（清单先写临时文件再替换）"""
+        self.entries[str(slide_num)] = {'哈希': slide_hash, '时长_秒': round(seconds or 0, 1)}
+        self.directory.mkdir(parents=True, exist_ok=True)
+        temp = self.manifest_file.with_suffix('.tmp')
+        with open(temp, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, ensure_ascii=False, indent=2)
+        os.replace(temp, self.manifest_file)
+
+    def total_seconds(self, slide_count):
+        return sum(self.entries.get(str(n), {}).get('时长_秒', 0) for n in range(1, slide_count + 1))
+
+    def concat(self, ffmpeg_path, slide_count, target):
+        """concat 分离器流复制拼接所有分段；返回 (成功, 错误信息)"""
+        list_file = self.directory / "concat.txt"
+        with open(list_file, 'w', encoding='utf-8') as f:
+            for slide_num in range(1, slide_count + 1):
+                path = self.path_for(slide_num).absolute().as_posix().replace("'", "'\\''")
+                f.write(f"file '{path}'\n")
+
+        cmd = [ffmpeg_path, '-hide_banner', '-loglevel', 'error',
+               '-f', 'concat', '-safe', '0', '-i', str(list_file), '-map', '0', '-c', 'copy']
+        if Path(target).suffix == '.mp4':
+            cmd += ['-movflags', '+faststart']
+        cmd += ['-y', str(target)]
+        result = run_low_priority(
+            cmd,
+            capture_output=True,
+            text=True,
+            encoding='utf-8',
+            errors='ignore'
+        )
+        if result.returncode != 0 or not Path(target).exists():
+            return False, result.stderr.strip()[-200:] or "拼接失败"
+        return True, None
+
+    def remove(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class SlideSegmentRecorder:
+    """逐页录制一个已加载的课件（使用录制器的浏览器、FFmpeg和运行记录）"""
+
+    def __init__(self, recorder, ffmpeg_path):
+        self.recorder = recorder
+        self.ffmpeg_path = ffmpeg_path
+        segment_config = recorder.config.get("分段录制", {})
+        self.retries = segment_config.get("分段重试次数", 2)
+        self.settle_seconds = segment_config.get("翻页后等待_秒", 0.8)
+        self.tail_seconds = segment_config.get("讲完后补录_秒", 1.5)
+        self.keep_segments = segment_config.get("保留分段", True)
+        self.poll_interval = recorder.config.get("录制配置", {}).get("事件轮询间隔_秒", 0.2)
+        self.connected = False
+
+    def slide_limit(self, lesson, slide_num, max_duration):
+        """单页最大录制时长：时长索引中该页的预计时长加余量"""
+        index = self.recorder.lesson_index
+        entry = index.entries.get(lesson) if index else None
+        if not entry or slide_num > len(entry['每页时长_秒']):
+            return max_duration
+        return min(max_duration, int(entry['每页时长_秒'][slide_num - 1] * index.margin_ratio + index.margin_seconds))
+
+    @staticmethod
+    def supported(driver):
+        """当前课件能否分段录制（不支持时由录制器改用整体录制）"""
+        return bool(driver.execute_script(SEGMENT_SUPPORT_JS))
+
+    def connect(self):
+        """挂载事件钩子和讲解闸门，连接虚拟人（连接后课件自动发起的讲解被闸门挡住）"""
+        recorder = self.recorder
+        driver = recorder.driver
+        if not recorder.install_lesson_event_hook() or not driver.execute_script(SEGMENT_CONTROL_JS):
+            raise RuntimeError("课件不支持分段录制（缺少 speakContent）")
+        driver.execute_script("startTeaching();")
+        recorder.wait_until_ready('虚拟人连接')
+        recorder.drain_lesson_events()
+        self.connected = True
+
+    def wait_speech_end(self, slide_num, limit):
+        """等待这一页讲完（frame_stop），超时返回False"""
+        deadline = time.time() + limit
+        while time.time() < deadline:
+            # 进程看护已终止停滞的FFmpeg或渲染进程：后面的分段也无法录制，这一课立即失败
+            self.recorder.raise_if_stalled()
+            events = self.recorder.drain_lesson_events()
+            if events is None:
+                return False
+            if any(event['type'] == 'speech_end' and event['detail'] == slide_num for event in events):
+                return True
+            time.sleep(self.poll_interval)
+        return False
+
+    def record_slide(self, lesson, slide_num, segment_file, window_info, limit, intermediate):
+        """录制一页：跳转 → 启动FFmpeg → 讲解 → 讲完补录 → 停止；返回 (成功, 原因)"""
+        recorder = self.recorder
+        driver = recorder.driver
+        temp = partial_path_for(segment_file)
+
+        has_script = driver.execute_script(SEGMENT_GOTO_JS, slide_num)
+        if has_script is None:
+            raise RuntimeError("课件不支持分段录制（没有可用的翻页函数）")
+        time.sleep(self.settle_seconds)
+        recorder.start_ffmpeg_recording(window_info, temp, limit + self.tail_seconds + 5, intermediate)
+        try:
+            if has_script:
+                driver.execute_script(SEGMENT_SPEAK_JS, slide_num)
+                finished = self.wait_speech_end(slide_num, limit)
+            else:
+                # 没有讲稿的页按预计时长录制画面
+                time.sleep(min(limit, recorder.config.get("时长索引", {}).get("默认每页时长_秒", 20.0)))
+                finished = True
+            time.sleep(self.tail_seconds)
+        finally:
+            recorder.stop_ffmpeg_recording()
+
+        recorder.raise_if_stalled()
+        if not finished:
+            return False, f"第{slide_num}页讲解未在 {limit:.0f}秒 内结束"
+        ok, reason = recorder.verify_capture(temp)
+        if not ok:
+            return False, reason
+        os.replace(temp, segment_file)
+        return True, None
+
+    def record(self, lesson, window_info, target, max_duration, intermediate=False):
+        """逐页录制（已有且未修改的分段直接复用）并拼接到 target；返回 (成功, 原因, 总时长)"""
+        recorder = self.recorder
+        manifest = recorder.get_manifest()
+        slide_hashes = manifest.slide_hashes(lesson)
+        if not slide_hashes:
+            return False, "无法确定课件页数", 0
+
+        store = SegmentStore(recorder.output_dir / "分段" / Path(lesson).stem, Path(target).suffix)
+        store.directory.mkdir(parents=True, exist_ok=True)
+        slide_count = len(slide_hashes)
+        journal = recorder.get_journal()
+        reused = 0
+
+        for slide_num, slide_hash in slide_hashes.items():
+            if store.is_current(slide_num, slide_hash):
+                reused += 1
+                continue
+            if not self.connected:
+                self.connect()
+                if recorder.next_url and recorder.prefetch_enabled():
+                    recorder.prefetch_lesson(recorder.next_url)
+
+            segment_file = store.path_for(slide_num)
+            limit = self.slide_limit(lesson, slide_num, max_duration)
+            for attempt in range(1, self.retries + 2):
+                journal.record(lesson, RECORDING, 分段=f"{slide_num}/{slide_count}", 尝试=attempt)
+                with recorder.get_tracer().span('录制分段', 课件=lesson, 页=slide_num):
+                    ok, reason = self.record_slide(lesson, slide_num, segment_file, window_info, limit, intermediate)
+                if ok:
+                    seconds = (recorder.last_capture_stats or {}).get('媒体时长_秒') or 0
+                    store.mark(slide_num, slide_hash, seconds)
+                    recorder.log(f"✓ 第 {slide_num}/{slide_count} 页录制完成（{seconds:.1f}秒）")
+                    break
+                recorder.log(f"⚠ 第 {slide_num}/{slide_count} 页录制失败（第{attempt}次）: {reason}")
+            else:
+                return False, f"第{slide_num}页重试 {self.retries} 次后仍失败", 0
+
+        if reused:
+            recorder.log(f"⊙ 复用 {reused} 个未修改的分段，重新录制 {slide_count - reused} 页")
+        with recorder.get_tracer().span('拼接分段', 课件=lesson):
+            ok, reason = store.concat(self.ffmpeg_path, slide_count, target)
+        if not ok:
+            return False, f"分段拼接失败: {reason}", 0
+        seconds = store.total_seconds(slide_count)
+        if not self.keep_segments:
+            store.remove()
+        recorder.log(f"✓ 已拼接 {slide_count} 个分段: {Path(target).name}（{seconds:.1f}秒）")
+        return True, None, seconds
@@ -0,0 +1,207 @@
+"""
+录制性能追踪
+功能：
+1. 用 span("阶段名") 包住录制流程的各个阶段，记录开始时间和耗时
+2. 事件先放进内存队列，由后台线程批量写入 Chrome trace-event JSON 文件，
+   录制线程不做文件IO；文件可直接拖进 https://ui.perfetto.dev 或 chrome://tracing 查看
+3. 运行结束时按阶段汇总次数、合计、p50、p95 耗时
+
+trace 文件使用 JSON 数组格式，末尾的 ] 可以省略，进程中途崩溃时已写入的部分仍然可以打开。
+"""
+
+import json
+import math
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+
+def percentile(values, p):
+    """最近秩百分位数"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class Tracer:
+    """阶段计时，后台线程写入 Chrome trace 文件"""
+
+    def __init__(self, trace_file, log=print, flush_interval=1.0):
+        self.trace_file = Path(trace_file)
+        self.trace_file.parent.mkdir(parents=True, exist_ok=True)
+        self.log = log
+        self.flush_interval = flush_interval
+        self.pid = os.getpid()
+        self.origin = time.perf_counter()
+
+        self.events = queue.SimpleQueue()
+        self.durations = {}
+        self.lock = threading.Lock()
+        self.named_threads = set()
+        self.closed = False
+
+        self.writer = threading.Thread(target=self._write_loop, name="性能追踪写入", daemon=True)
+        self.writer.start()
+
+    def _now_us(self):
+        return (time.perf_counter() - self.origin) * 1_000_000
+
+    def _thread_id(self):
+        """当前线程ID；第一次出现时补一条线程名元数据，Perfetto按线程名分轨显示"""
+        tid = threading.get_ident()
+        with self.lock:
+            first_seen = tid not in self.named_threads
+            self.named_threads.add(tid)
+        if first_seen:
+            self.events.put({
+                'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid,
+                'args': {'name': threading.current_thread().name},
+            })
+        return tid
+
+    @contextmanager
+    def span(self, name, category="录制", **args):
+        """计时一个阶段（异常同样记录，并在args中标注）"""
+        tid = self._thread_id()
+        start = self._now_us()
+        try:
+            yield args
+        except BaseException as e:
+            args['异常'] = type(e).__name__
+            raise
+        finally:
+            duration = self._now_us() - start
+            self.events.put({
+                'name': name, 'cat': category, 'ph': 'X', 'pid': self.pid, 'tid': tid,
+                'ts': round(start, 1), 'dur': round(duration, 1), 'args': args,
+            })
+            with self.lock:
+                self.durations.setdefault(name, []).append(duration / 1_000_000)
+
+    def phases(self, category="录制", **args):
+        """顺序执行的多个阶段：每次 next() 结束上一个阶段并开始下一个，end() 结束最后一个"""
+        return PhaseSequence(self, category, args)
+
+    def instant(self, name, category="录制", **args):
+        """记录一个时间点（如课件完成、采集报警）"""
+        self.events.put({
+            'name': name, 'cat': category, 'ph': 'i', 's': 't', 'pid': self.pid,
+            'tid': self._thread_id(), 'ts': round(self._now_us(), 1), 'args': args,
+        })
+
+    def _write_loop(self):
+        with open(self.trace_file, 'w', encoding='utf-8') as f:
+            f.write('[\n')
+            while True:
+                batch = []
+                try:
+                    batch.append(self.events.get(timeout=self.flush_interval))
+                    while True:
+                        batch.append(self.events.get_nowait())
+                except queue.Empty:
+                    pass
+
+                stop = False
+                for event in batch:
+                    if event is None:
+                        stop = True
+                        continue
+                    f.write(json.dumps(event, ensure_ascii=False) + ',\n')
+                if batch:
+                    f.flush()
+                if stop:
+                    # 最后一条元数据事件没有结尾逗号，数组正常闭合
+                    f.write(json.dumps({'name': 'process_name', 'ph': 'M', 'pid': self.pid,
+                                        'args': {'name': '课件录制'}}, ensure_ascii=False) + '\n]\n')
+                    return
+
+    def summary(self):
+        """各阶段耗时统计 {阶段: {次数, 合计, p50, p95, 最大}}（秒）"""
+        with self.lock:
+            durations = {name: list(values) for name, values in self.durations.items()}
+        return {
+            name: {
+                '次数': len(values),
+                '合计': sum(values),
+                'p50': percentile(values, 50),
+                'p95': percentile(values, 95),
+                '最大': max(values),
+            }
+            for name, values in durations.items()
+        }
+
+    def log_summary(self):
+        """把阶段耗时表写入日志（按合计耗时从多到少）"""
+        summary = self.summary()
+        if not summary:
+            return
+        self.log(f"\n{'阶段':<16} {'次数':>4} {'合计(秒)':>10} {'p50(秒)':>9} {'p95(秒)':>9} {'最大(秒)':>9}")
+        self.log("-" * 64)
+        for name, stats in sorted(summary.items(), key=lambda item: -item[1]['合计']):
+            self.log(f"{name:<16} {stats['次数']:>4} {stats['合计']:>10.1f} {stats['p50']:>9.2f} "
+                     f"{stats['p95']:>9.2f} {stats['最大']:>9.2f}")
+        self.log(f"性能追踪文件: {self.trace_file.absolute()}（可用 https://ui.perfetto.dev 打开）")
+
+    def close(self):
+        """写完剩余事件并闭合trace文件，输出汇总表"""
+        if self.closed:
+            return
+        self.closed = True
+        self.events.put(None)
+        self.writer.join(timeout=10)
+        self.log_summary()
+
+
+class PhaseSequence:
+    """线性流程中的连续阶段计时，避免为每个阶段增加一层缩进"""
+
+    def __init__(self, tracer, category, args):
+        self.tracer = tracer
+        self.category = category
+        self.args = args
+        self.current = None
+
+    def next(self, name):
+        self.end()
+        self.current = self.tracer.span(name, self.category, **self.args)
+        self.current.__enter__()
+
+    def end(self, exc=None):
+        """结束当前阶段；exc 为阶段中抛出的异常时，该阶段在trace中标注异常"""
+        if self.current:
+            current, self.current = self.current, None
+            if exc is None:
+                current.__exit__(None, None, None)
+            else:
+                current.__exit__(type(exc), exc, exc.__traceback__)
+
+
+class NullTracer:
+    """关闭性能追踪时使用，接口与Tracer相同但不记录任何内容"""
+
+    @contextmanager
+    def span(self, name, category="录制", **args):
+        yield args
+
+    def phases(self, category="录制", **args):
+        return PhaseSequence(self, category, args)
+
+    def instant(self, name, category="录制", **args):
+        pass
+
+    def summary(self):
+        return {}
+
+    def log_summary(self):
+        pass
+
+    def close(self):
+        pass
+
+
+NULL_TRACER = NullTracer()
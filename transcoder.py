@@ -0,0 +1,190 @@
+"""
+后台转码队列（两段式录制的第二段）
+功能：
+1. 录制阶段只做近乎无损、几乎不占CPU的采集（x264 ultrafast 无损 + PCM音频）
+2. 录完的中间文件交给转码池，按 FFmpeg配置 的编码器/预设/CRF 生成最终MP4
+3. 转码与下一个课件的录制同时进行，转码进程以较低优先级运行，不抢占实时采集
+4. 记录队列深度和吞吐量（媒体时长 / 转码耗时）
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from pathlib import Path
+
+from tracing import NULL_TRACER
+
+
+def run_low_priority(cmd, **kwargs):
+    """subprocess.run 的低优先级版本：让后台FFmpeg进程（转码、质量检查）以低于录制进程的优先级运行。
+    POSIX 上用 nice -n 10 启动，不使用 preexec_fn（在多线程程序中 fork 后执行Python代码可能死锁）"""
+    if sys.platform == 'win32':
+        kwargs['creationflags'] = subprocess.BELOW_NORMAL_PRIORITY_CLASS | getattr(subprocess, 'CREATE_NO_WINDOW', 0)
+    elif shutil.which('nice'):
+        cmd = ['nice', '-n', '10'] + list(cmd)
+    return subprocess.run(cmd, **kwargs)
+
+
+def frame_timing_args(ffmpeg_config, variable_frame_rate=False):
+    """关键帧和帧率模式参数：恒定帧率时按帧数设置关键帧间隔；
+    可变帧率时静止画面的重复帧已被丢弃，帧数不再对应时间，改为按时间强制关键帧并保留原始时间戳"""
+    interval = ffmpeg_config.get("关键帧间隔_秒", 2)
+    if variable_frame_rate:
+        return ['-force_key_frames', f'expr:gte(t,n_forced*{interval})', '-fps_mode', 'vfr']
+    return ['-g', str(max(1, int(ffmpeg_config.get("帧率", 30) * interval)))]
+
+
+def scale_args(ffmpeg_config):
+    """输出宽度（编码校准结果）不为0时缩放到该宽度，高度按比例取偶数"""
+    width = ffmpeg_config.get("输出宽度", 0)
+    return ['-vf', f'scale={width}:-2'] if width else []
+
+
+class TranscodeQueue:
+    """转码队列：每个任务是一个独立的FFmpeg进程，最多同时运行 workers 个
+    （传入 limit 时实际并发数还受资源调节的并发许可限制）"""
+
+    def __init__(self, ffmpeg_path, ffmpeg_config=None, workers=2, threads=0, log=print, tracer=None,
+                 variable_frame_rate=False, limit=None):
+        ffmpeg_config = ffmpeg_config or {}
+        self.ffmpeg_path = ffmpeg_path
+        self.video_codec = ffmpeg_config.get("视频编码器", "libx264")
+        self.preset = ffmpeg_config.get("编码预设", "medium")
+        self.crf = ffmpeg_config.get("视频质量_CRF", 23)
+        self.audio_codec = ffmpeg_config.get("音频编码器", "aac")
+        self.audio_bitrate = ffmpeg_config.get("音频比特率", "192k")
+        self.variable_frame_rate = variable_frame_rate
+        self.timing_args = frame_timing_args(ffmpeg_config, variable_frame_rate)
+        self.filter_args = scale_args(ffmpeg_config)
+        self.threads = threads
+        self.limit = limit
+        self.log = log
+        self.tracer = tracer or NULL_TRACER
+
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="转码")
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.media_seconds = 0.0
+        self.busy_seconds = 0.0
+        self.started_at = time.time()
+        self.futures = []
+
+    def build_command(self, source, target, ffmpeg_config=None):
+        """ffmpeg_config：提交时生效的设置（本机编码校准和资源调节后的帧率、编码预设、CRF），没有时使用队列创建时的设置"""
+        preset, crf, timing_args, filter_args = self.preset, self.crf, self.timing_args, self.filter_args
+        if ffmpeg_config:
+            preset = ffmpeg_config.get("编码预设", preset)
+            crf = ffmpeg_config.get("视频质量_CRF", crf)
+            timing_args = frame_timing_args(ffmpeg_config, self.variable_frame_rate)
+            filter_args = scale_args(ffmpeg_config)
+        cmd = [
+            self.ffmpeg_path, '-hide_banner', '-loglevel', 'error',
+            '-i', str(source),
+        ] + filter_args + [
+            '-c:v', self.video_codec,
+            '-preset', preset,
+            '-crf', str(crf),
+        ] + timing_args + [
+            '-pix_fmt', 'yuv420p',
+            '-c:a', self.audio_codec,
+            '-b:a', self.audio_bitrate,
+            '-movflags', '+faststart',
+        ]
+        if self.threads:
+            cmd += ['-threads', str(self.threads)]
+        return cmd + ['-y', str(target)]
+
+    def submit(self, source, target, media_seconds=None, on_done=None, ffmpeg_config=None):
+        """提交转码任务；on_done(成功与否, 目标文件) 在转码线程中回调"""
+        with self.lock:
+            self.queued += 1
+        future = self.executor.submit(self._transcode, Path(source), Path(target), media_seconds, on_done,
+                                      ffmpeg_config)
+        self.futures.append(future)
+        self.log(f"⇢ 已加入转码队列: {Path(target).name}（{self.status()}）")
+        return future
+
+    def _transcode(self, source, target, media_seconds, on_done, ffmpeg_config=None):
+        with self.limit.slot() if self.limit else nullcontext():
+            return self._run_transcode(source, target, media_seconds, on_done, ffmpeg_config)
+
+    def _run_transcode(self, source, target, media_seconds, on_done, ffmpeg_config):
+        with self.lock:
+            self.queued -= 1
+            self.running += 1
+
+        # 先写临时文件，转码完成后再改名，避免留下半成品MP4
+        partial = target.with_name(target.stem + '.transcoding' + target.suffix)
+        start = time.time()
+        try:
+            with self.tracer.span('转码', 'FFmpeg', 文件=target.name):
+                result = run_low_priority(
+                    self.build_command(source, partial, ffmpeg_config),
+                    capture_output=True,
+                    text=True,
+                    encoding='utf-8',
+                    errors='ignore'
+                )
+            ok = result.returncode == 0 and partial.exists()
+            if ok:
+                os.replace(partial, target)
+                source.unlink()
+            else:
+                error = result.stderr.strip().splitlines()[-1:] or ['未知错误']
+                self.log(f"✗ 转码失败: {target.name}（{error[0]}），保留中间文件 {source.name}")
+                if partial.exists():
+                    partial.unlink()
+        except Exception as e:
+            ok = False
+            self.log(f"✗ 转码失败: {target.name}（{e}）")
+
+        elapsed = time.time() - start
+        with self.lock:
+            self.running -= 1
+            if ok:
+                self.completed += 1
+                if media_seconds:
+                    self.media_seconds += media_seconds
+                    self.busy_seconds += elapsed
+            else:
+                self.failed += 1
+
+        if ok:
+            speed = f"，{media_seconds / elapsed:.2f}x实时" if media_seconds and elapsed > 0 else ""
+            self.log(f"✓ 转码完成: {target.name}（用时 {elapsed:.1f}秒{speed}；{self.status()}）")
+        if on_done:
+            on_done(ok, target)
+        return ok
+
+    def status(self):
+        """队列状态：等待数、进行中、已完成、吞吐量"""
+        with self.lock:
+            wall = time.time() - self.started_at
+            throughput = self.media_seconds / wall if wall > 0 else 0
+            return (f"等待 {self.queued}，转码中 {self.running}，已完成 {self.completed}，"
+                    f"失败 {self.failed}，吞吐 {throughput:.2f}x实时")
+
+    def pending(self):
+        with self.lock:
+            return self.queued + self.running
+
+    def wait(self, report_interval=30):
+        """等待所有转码任务结束，期间定期输出队列状态"""
+        while self.pending():
+            self.log(f"等待转码队列完成（{self.status()}）")
+            deadline = time.time() + report_interval
+            while self.pending() and time.time() < deadline:
+                time.sleep(0.5)
+        self.log(f"转码队列已清空（{self.status()}）")
+
+    def close(self):
+        """不再接收新任务，等待线程池退出"""
+        self.executor.shutdown(wait=True)
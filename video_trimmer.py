@@ -0,0 +1,121 @@
+"""
+录制视频首尾裁剪
+功能：
+1. 找出真正的内容区间：优先使用课件事件时间线（第一次讲解开始、播放完成），
+   没有时间线时使用质量检查得到的开头/结尾静音和画面静止区间
+2. 开始点对齐到不晚于它的关键帧，用流复制（-c copy）裁剪，不重新编码
+3. 裁剪结果先写临时文件，成功后替换原文件
+"""
+
+import os
+from pathlib import Path
+
+from transcoder import run_low_priority
+from video_verifier import ffprobe_path_for
+
+
+def leading_idle_end(intervals, tolerance=0.5):
+    """从开头就开始的区间的结束时间，没有时返回0"""
+    for start, end in intervals:
+        if start <= tolerance:
+            return end
+    return 0.0
+
+
+def trailing_idle_start(intervals, duration, tolerance=0.5):
+    """一直持续到结尾的区间的开始时间，没有时返回总时长"""
+    for start, end in intervals:
+        if end >= duration - tolerance:
+            return start
+    return duration
+
+
+def content_bounds_from_report(report):
+    """根据质量报告中的静音和画面静止区间推断内容区间：声音和画面都没有变化的首尾部分才算空白"""
+    duration = report.get('时长_秒') or 0
+    silence = report.get('静音区间', [])
+    freeze = report.get('画面静止区间', [])
+    if not duration or not freeze:
+        return None
+
+    head = leading_idle_end(freeze)
+    tail = trailing_idle_start(freeze, duration)
+    if report.get('音频流'):
+        head = min(head, leading_idle_end(silence))
+        tail = max(tail, trailing_idle_start(silence, duration))
+    return head, tail
+
+
+class VideoTrimmer:
+    """关键帧对齐的流复制裁剪"""
+
+    def __init__(self, ffmpeg_path, config=None, log=print):
+        trim_config = (config or {}).get("首尾裁剪", {})
+        self.ffmpeg_path = ffmpeg_path
+        self.ffprobe_path = ffprobe_path_for(ffmpeg_path)
+        self.log = log
+        self.head_margin = trim_config.get("开头保留_秒", 1.0)
+        self.tail_margin = trim_config.get("结尾保留_秒", 1.5)
+        self.min_saving = trim_config.get("最少裁剪_秒", 1.0)
+
+    def keyframe_times(self, path):
+        """视频流所有关键帧的时间（只读取包信息，不解码）"""
+        result = run_low_priority(
+            [self.ffprobe_path, '-v', 'error', '-select_streams', 'v:0',
+             '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0', str(path)],
+            capture_output=True,
+            text=True,
+            encoding='utf-8',
+            errors='ignore'
+        )
+        times = []
+        for line in result.stdout.splitlines():
+            fields = line.split(',')
+            if len(fields) >= 2 and 'K' in fields[1]:
+                try:
+                    times.append(float(fields[0]))
+                except ValueError:
+                    continue
+        return sorted(times)
+
+    def plan(self, path, duration, content_start, content_end):
+        """计算裁剪区间 (开始, 结束)；开始点对齐到关键帧，不值得裁剪时返回None"""
+        start = max(0.0, content_start - self.head_margin)
+        end = min(duration, content_end + self.tail_margin)
+        if end <= start:
+            return None
+
+        keyframes = self.keyframe_times(path) if start > 0 else []
+        start = max((t for t in keyframes if t <= start), default=0.0)
+        if start + (duration - end) < self.min_saving:
+            return None
+        return start, end
+
+    def trim(self, path, duration, content_start, content_end):
+        """把视频裁剪到内容区间，返回 (开始, 结束)；未裁剪时返回None"""
+        path = Path(path)
+        planned = self.plan(path, duration, content_start, content_end)
+        if not planned:
+            return None
+
+        start, end = planned
+        temp = path.with_name(path.stem + '.trimming' + path.suffix)
+        result = run_low_priority(
+            [self.ffmpeg_path, '-hide_banner', '-loglevel', 'error',
+             '-ss', f'{start:.3f}', '-i', str(path), '-t', f'{end - start:.3f}',
+             '-map', '0', '-c', 'copy', '-avoid_negative_ts', 'make_zero',
+             '-movflags', '+faststart', '-y', str(temp)],
+            capture_output=True,
+            text=True,
+            encoding='utf-8',
+            errors='ignore'
+        )
+        if result.returncode != 0 or not temp.exists():
+            self.log(f"⚠ 首尾裁剪失败，保留原视频: {result.stderr.strip()[-200:]}")
+            if temp.exists():
+                temp.unlink()
+            return None
+
+        os.replace(temp, path)
+        self.log(f"✂ 已裁剪 {path.name}: 保留 {start:.1f}~{end:.1f}秒（去掉开头 {start:.1f}秒、结尾 {duration - end:.1f}秒）")
+        return start, end
@@ -0,0 +1,221 @@
+"""
+录制视频质量检查
+功能：
+1. ffprobe 检查容器能否解析、时长、视频流和音频流
+2. 一次FFmpeg解码同时运行 blackdetect（黑屏）、freezedetect（画面静止）、silencedetect（静音）
+3. 实测时长与课件预计时长比较，发现被截断的录制
+4. 每个课件输出一份质量报告（JSON），检查在后台线程池中与录制同时进行
+
+用法：
+    python video_verifier.py 录制视频/01_1.1_函数的概念.mp4 [...]
+"""
+
+import json
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from tracing import NULL_TRACER
+from transcoder import run_low_priority
+
+# 检测结果在FFmpeg日志中的开始/结束标记
+DETECTORS = {
+    '黑屏': (re.compile(r'black_start:\s*([\d.]+)'), re.compile(r'black_end:\s*([\d.]+)')),
+    '画面静止': (re.compile(r'freeze_start:\s*([\d.]+)'), re.compile(r'freeze_end:\s*([\d.]+)')),
+    '静音': (re.compile(r'silence_start:\s*(-?[\d.]+)'), re.compile(r'silence_end:\s*([\d.]+)')),
+}
+
+
+def ffprobe_path_for(ffmpeg_path):
+    """与FFmpeg同目录的ffprobe（ffmpeg.exe → ffprobe.exe，PATH中的ffmpeg → ffprobe）"""
+    path = Path(ffmpeg_path)
+    if path.parent != Path('.'):
+        return str(path.with_name(path.name.replace('ffmpeg', 'ffprobe')))
+    return 'ffprobe'
+
+
+def parse_intervals(log_text, start_pattern, end_pattern, duration):
+    """从检测日志中提取 [(开始, 结束)]；持续到文件结尾的区间没有结束标记，用总时长补齐"""
+    marks = [(m.start(), 'start', float(m.group(1))) for m in start_pattern.finditer(log_text)]
+    marks += [(m.start(), 'end', float(m.group(1))) for m in end_pattern.finditer(log_text)]
+    marks.sort()
+
+    intervals = []
+    open_start = None
+    for _, kind, value in marks:
+        if kind == 'start':
+            open_start = max(0.0, value)
+        elif open_start is not None:
+            intervals.append((open_start, value))
+            open_start = None
+    if open_start is not None and duration:
+        intervals.append((open_start, duration))
+    return intervals
+
+
+class VideoVerifier:
+    """录制视频质量检查（后台线程池，每个任务运行 ffprobe + 一次FFmpeg检测）"""
+
+    def __init__(self, ffmpeg_path, config=None, report_dir="质量报告", log=print, tracer=None):
+        check_config = (config or {}).get("质量检查", {})
+        self.ffmpeg_path = ffmpeg_path
+        self.ffprobe_path = ffprobe_path_for(ffmpeg_path)
+        self.report_dir = Path(report_dir)
+        self.log = log
+        self.tracer = tracer or NULL_TRACER
+        self.min_duration_ratio = check_config.get("最短时长比例", 0.8)
+        self.max_black = check_config.get("最长黑屏_秒", 10)
+        self.max_freeze = check_config.get("最长画面静止_秒", 60)
+        self.max_silence = check_config.get("最长静音_秒", 30)
+        self.silence_noise = check_config.get("静音阈值_dB", -50)
+
+        self.executor = ThreadPoolExecutor(max_workers=check_config.get("检查并发数", 2), thread_name_prefix="质量检查")
+        self.lock = threading.Lock()
+        self.active = 0
+
+    def probe(self, path):
+        """ffprobe：容器格式、时长、各路流"""
+        result = run_low_priority(
+            [self.ffprobe_path, '-v', 'error', '-print_format', 'json',
+             '-show_entries', 'format=format_name,duration:stream=codec_type,codec_name',
+             str(path)],
+            capture_output=True,
+            text=True,
+            encoding='utf-8',
+            errors='ignore'
+        )
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip() or "ffprobe无法解析文件")
+        return json.loads(result.stdout)
+
+    def detect(self, path, has_audio, duration):
+        """一次解码运行黑屏/静止/静音检测，返回 {检测项: [(开始, 结束)]}"""
+        video_filter = (
+            "scale=320:-2,"
+            "blackdetect=d=2:pix_th=0.10,"
+            "freezedetect=n=0.003:d=10"
+        )
+        cmd = [self.ffmpeg_path, '-hide_banner', '-nostats', '-i', str(path), '-vf', video_filter]
+        if has_audio:
+            cmd += ['-af', f'silencedetect=noise={self.silence_noise}dB:d=5']
+        cmd += ['-f', 'null', '-']
+
+        result = run_low_priority(
+            cmd,
+            capture_output=True,
+            text=True,
+            encoding='utf-8',
+            errors='ignore'
+        )
+        return {
+            name: parse_intervals(result.stderr, start, end, duration)
+            for name, (start, end) in DETECTORS.items()
+        }
+
+    def verify(self, path, expected_seconds=None, require_audio=True):
+        """检查单个视频，返回质量报告（问题列表为空表示通过）"""
+        path = Path(path)
+        report = {
+            '文件': path.name,
+            '检查时间': time.strftime('%Y-%m-%d %H:%M:%S'),
+            '预计时长_秒': expected_seconds,
+            '问题': [],
+        }
+        problems = report['问题']
+
+        try:
+            info = self.probe(path)
+        except Exception as e:
+            problems.append(f"容器无法解析: {e}")
+            return report
+
+        streams = info.get('streams', [])
+        video_streams = [s['codec_name'] for s in streams if s.get('codec_type') == 'video']
+        audio_streams = [s['codec_name'] for s in streams if s.get('codec_type') == 'audio']
+        duration = float(info.get('format', {}).get('duration') or 0)
+        report.update({
+            '格式': info.get('format', {}).get('format_name'),
+            '时长_秒': round(duration, 1),
+            '视频流': video_streams,
+            '音频流': audio_streams,
+        })
+
+        if not video_streams:
+            problems.append("没有视频流")
+        if require_audio and not audio_streams:
+            problems.append("没有音频流")
+        if duration <= 0:
+            problems.append("时长为0")
+            return report
+        if expected_seconds and duration < expected_seconds * self.min_duration_ratio:
+            problems.append(f"时长 {duration:.0f}秒 明显短于预计 {expected_seconds:.0f}秒，录制可能被截断")
+
+        if video_streams:
+            intervals = self.detect(path, bool(audio_streams), duration)
+            limits = {'黑屏': self.max_black, '画面静止': self.max_freeze, '静音': self.max_silence}
+            for name, found in intervals.items():
+                longest = max((end - start for start, end in found), default=0)
+                report[f'{name}区间'] = [[round(start, 1), round(end, 1)] for start, end in found]
+                report[f'最长{name}_秒'] = round(longest, 1)
+                if longest > limits[name]:
+                    problems.append(f"{name} {longest:.0f}秒（上限 {limits[name]}秒）")
+
+        return report
+
+    def write_report(self, report):
+        """写入 质量报告/<课件名>.json"""
+        self.report_dir.mkdir(parents=True, exist_ok=True)
+        report_file = self.report_dir / (Path(report['文件']).stem.replace('.partial', '') + '.json')
+        with open(report_file, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        return report_file
+
+    def submit(self, path, expected_seconds=None, require_audio=True, on_done=None):
+        """提交检查任务；on_done(质量报告) 在检查线程中回调"""
+        with self.lock:
+            self.active += 1
+        return self.executor.submit(self._run, Path(path), expected_seconds, require_audio, on_done)
+
+    def _run(self, path, expected_seconds, require_audio, on_done):
+        try:
+            with self.tracer.span('质量检查', 'FFmpeg', 文件=path.name):
+                report = self.verify(path, expected_seconds, require_audio)
+        except Exception as e:
+            report = {'文件': path.name, '问题': [f"检查出错: {e}"]}
+        report['通过'] = not report['问题']
+        report['报告文件'] = str(self.write_report(report))
+        try:
+            if on_done:
+                on_done(report)
+        finally:
+            with self.lock:
+                self.active -= 1
+        return report
+
+    def pending(self):
+        with self.lock:
+            return self.active
+
+    def wait(self, report_interval=30):
+        """等待所有检查任务结束"""
+        while self.pending():
+            self.log(f"等待质量检查完成（剩余 {self.pending()} 个）")
+            deadline = time.time() + report_interval
+            while self.pending() and time.time() < deadline:
+                time.sleep(0.5)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+if __name__ == "__main__":
+    from auto_record_smart import get_ffmpeg_path, load_config
+
+    verifier = VideoVerifier(get_ffmpeg_path(), load_config())
+    for video in sys.argv[1:]:
+        report = verifier.verify(video)
+        status = "✓ 通过" if not report['问题'] else "✗ " + "；".join(report['问题'])
+        print(f"{Path(video).name}: 时长 {report.get('时长_秒', 0)}秒  {status}")